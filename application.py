@@ -1,14 +1,13 @@
 import json
 import logging
 import os
-from tempfile import mkdtemp
+import time
 from urllib.parse import quote_plus
 
 import jsonpickle
 import requests
-from flask import (Flask, flash, jsonify, make_response, redirect,
+from flask import (Flask, Response, flash, jsonify, make_response, redirect,
                    render_template, request, session, url_for)
-from flask_sessionstore import Session
 from flask_sslify import SSLify
 
 from werkzeug.exceptions import default_exceptions
@@ -16,9 +15,13 @@ from werkzeug.security import check_password_hash, generate_password_hash
 
 import common_db
 import controller
-from application_helpers import admin_user_required
+import game_cache
+import game_events
+import serializers
+import view_deltas
+from application_helpers import admin_user_required, load_session_game
 from cards import Card, Deck
-from game import (Game, get_list_of_games_for_this_user,
+from game import (Game, get_database_checksum, get_list_of_games_for_this_user,
                   get_list_of_games_looking_for_players, get_users_for_game)
 # from https://github.com/cs50/python-cs50
 from helpers import apology, login_required
@@ -52,12 +55,9 @@ else:
 
 app.config["SESSION_PERMANENT"] = True
 
-# Configure session to use filesystem (instead of signed cookies)
-app.config["SESSION_FILE_DIR"] = mkdtemp()
-app.config['SESSION_TYPE'] = 'filesystem'
-
-# initiate session
-Session(app)
+# sessions are signed cookies holding only user_id, is_admin and game_id, so
+# any worker on any instance can serve any player. The game itself is loaded
+# from the database when a request needs it - see load_session_game()
 
 
 # Ensure templates are auto-reloaded
@@ -68,9 +68,11 @@ app.config["TEMPLATES_AUTO_RELOAD"] = True
 
 @app.after_request
 def after_request(response):
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
+    # routes can set their own cache policy; everything else is never cached
+    if "Cache-Control" not in response.headers:
+        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+        response.headers["Expires"] = 0
+        response.headers["Pragma"] = "no-cache"
     return response
 
 
@@ -119,7 +121,6 @@ def load_game():
         app_logger.error("Unable to load game %s", game_id)
         return "error loading game"
     else:
-        session["game"] = game  # even if None
         session["game_id"] = game.state.game_id
         app_logger.info("Loaded game %s", session["game_id"])
 
@@ -133,7 +134,7 @@ def load_game():
             f"do_add_to_game returned {action_result} and message '{message}'")
     else:
         # loading an existing game without adding the user to it
-        action_result = True
+        action_result, message = True, f"Loaded game {game_id}"
 
     if action_result and game.ready_to_start:
         app_logger.debug(
@@ -145,13 +146,39 @@ def load_game():
         return redirect(url_for("logged_in") + f"?msg={quote_plus(message)}")
 
 
+@app.route("/add_bot")
+@login_required
+def add_bot():
+    """adds a computer player to one of this user's games which is waiting for players"""
+    app_logger.debug("call to /add_bot")
+    game_id = request.args.get("game_id")
+    if not game_id:
+        app_logger.error("called /add_bot but didnt include a game ID")
+        return apology("must provide game id", 400)
+
+    game = controller.do_load_game(int(game_id), session["user_id"])
+    if not game:
+        app_logger.error("Unable to load game %s", game_id)
+        return apology("unable to load game", 500)
+    if not game.this_player:
+        return apology("you can only add computer players to your own games", 403)
+
+    action_result, message = controller.do_add_bot_to_game(game)
+    app_logger.debug(f"do_add_bot_to_game returned {action_result} and message '{message}'")
+    if action_result and game.ready_to_start:
+        session["game_id"] = game.state.game_id
+        return redirect(url_for("play"))
+    return redirect(url_for("logged_in") + f"?msg={quote_plus(message)}")
+
+
 @app.route("/playcards", methods=["POST"])
 @login_required
 def play_cards():
     # TODO --> need to build the front end to start sending these
     # find out the action
     app_logger.debug("call to /playcards")
-    if session["game"]:
+    game = load_session_game()
+    if game:
         if not request.is_json:
             app_logger.error("/playcards without JSON payload")
             response = {'action': 'unknown', 'action_result': False,
@@ -159,10 +186,13 @@ def play_cards():
         else:
             request_json = request.get_json(cache=False)
             app_logger.debug("/playcards request: %s", request_json)
-            response = controller.do_playcards(request_json, session["game"])
-            app_logger.debug("/playcards response: %s",
-                             jsonpickle.encode(response, unpicklable=False))
-            return jsonpickle.encode(response, unpicklable=False)
+            response = controller.do_playcards(request_json, game)
+            app_logger.debug("/playcards response: %s", response)
+            wire_format = serializers.negotiate_wire_format(request.accept_mimetypes)
+            resp = make_response(serializers.encode_response(response, wire_format), 200)
+            resp.headers['Content-Type'] = wire_format
+            resp.headers["Vary"] = "Accept"
+            return resp
     else:
         app_logger.error("caleld /playcards without active game")
         response = {'action': "any", 'action_result': False,
@@ -173,24 +203,102 @@ def play_cards():
 @app.route("/checkstate", methods=["GET", "POST"])
 @login_required
 def checkstate():
-    """ returns the latest checksum recorded for this game in the database,
-        and the latest held in game state in session """
-    game = session["game"]
+    """ returns the latest checksum recorded for this game in the database.
+        If the request JSON includes the "checksum" the client already has,
+        the request is held until the game changes or the long poll times out """
+    game_id = session["game_id"]
+    request_json = request.get_json(silent=True, cache=False)
+    known_checksum = None
+    if isinstance(request_json, dict):
+        known_checksum = request_json.get("checksum")
+    if known_checksum is None:
+        database_checksum = get_database_checksum(game_id)
+    else:
+        database_checksum = controller.do_wait_for_game_change(game_id, known_checksum)
     response = {"action": "haschanged",
-                "database_checksum": game.get_database_checksum()}
+                "database_checksum": database_checksum}
     return json.dumps(response)
 
 
+@app.route("/gameevents")
+@login_required
+def gameevents():
+    """ a server-sent event stream which sends a "checksum" event each time this game
+        is saved, and a keepalive comment while nothing changes. Streams end after
+        game_events.EVENT_STREAM_LIFETIME seconds; browsers reconnect automatically.
+        Each stream holds a worker thread, so past game_events.MAX_EVENT_STREAMS the
+        stream is refused and the browser falls back to long polling /checkstate """
+    game_id = session["game_id"]
+    known_checksum = request.args.get("checksum")
+    if not game_events.event_stream_slots.acquire(blocking=False):
+        app_logger.warning("refused /gameevents - %s streams already open", game_events.MAX_EVENT_STREAMS)
+        resp = make_response("too many event streams", 503)
+        resp.headers["Retry-After"] = game_events.EVENT_STREAM_LIFETIME
+        return resp
+
+    def stream():
+        # tell the browser how long to wait before reconnecting, in ms
+        yield "retry: 1000\n\n"
+        ends = time.monotonic() + game_events.EVENT_STREAM_LIFETIME
+        for checksum in controller.do_subscribe_to_game(game_id, known_checksum):
+            if checksum is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: checksum\ndata: {checksum}\n\n"
+            if time.monotonic() >= ends:
+                return
+
+    resp = Response(stream(), mimetype="text/event-stream")
+    # stop proxies holding events back
+    resp.headers["X-Accel-Buffering"] = "no"
+    # whether or not the stream was ever started
+    resp.call_on_close(game_events.event_stream_slots.release)
+    return resp
+
+
 @app.route("/getgamestate")
 @login_required
 def getgamestate():
     """returns a JSON object to caller with a summary of the current
        state of the game, excluding sensitive information such as
-       hidden cards, cards in other players' hands, or the deck"""
-    state = jsonpickle.encode(controller.get_game_state(
-        session["game"]), unpicklable=False)
+       hidden cards, cards in other players' hands, or the deck.
+       The ETag identifies the game version and player, so a client which
+       already has this view gets a 304 without the game being loaded.
+       Clients which Accept application/x-msgpack get MessagePack instead
+       (see serializers). ?game_id=GAME_ID&since=CHECKSUM (the game and
+       checksum of the view the client has) asks for just what has changed
+       since (see view_deltas)"""
+    wire_format = serializers.negotiate_wire_format(request.accept_mimetypes)
+    etag_suffix = serializers.Wire_Formats.Etag_Suffix[wire_format]
+    game_id = session.get("game_id")
+    if game_id is not None:
+        etag = controller.game_state_etag(game_id, get_database_checksum(game_id), session["user_id"]) + etag_suffix
+        if etag in request.if_none_match:
+            app_logger.debug("/getgamestate not modified: %s", etag)
+            resp = make_response("", 304)
+            resp.set_etag(etag)
+            resp.headers["Cache-Control"] = "private, no-cache"
+            resp.headers["Vary"] = "Accept"
+            return resp
+
+    game_state = controller.get_game_state(load_session_game())
+    delta = None
+    if game_state.get("checksum") is not None:
+        delta = view_deltas.delta_since(game_state, session["user_id"],
+                                        request.args.get("game_id", type=int), request.args.get("since"))
+    if delta is None:
+        state = serializers.encode_game_state(game_state, wire_format)
+    else:
+        state = serializers.encode_game_state_delta(delta, wire_format)
     resp = make_response(state, 200)
-    resp.headers['Content-Type'] = 'application/json'
+    resp.headers['Content-Type'] = wire_format
+    resp.headers["Vary"] = "Accept"
+    if game_state.get("checksum") is not None:
+        # the version of the game actually sent, which may be newer than the one checked above
+        resp.set_etag(controller.game_state_etag(game_state["game"]["state"].game_id, game_state["checksum"],
+                                              session["user_id"]) + etag_suffix)
+        # browsers may keep it, but must check it's still current before using it
+        resp.headers["Cache-Control"] = "private, no-cache"
     app_logger.debug("/getgamestate returns: %s", state)
     return resp
 
@@ -198,7 +306,7 @@ def getgamestate():
 @app.route("/game_internals")
 @admin_user_required
 def game_internals():
-    game = session["game"]
+    game = load_session_game()
     if game:
         game_state = {"active-game": True,
                       'state': game}
@@ -211,6 +319,24 @@ def game_internals():
     return resp
 
 
+@app.route("/game_cache_stats")
+@admin_user_required
+def game_cache_stats():
+    """hit, miss and eviction counters for this worker's game cache"""
+    resp = make_response(json.dumps(game_cache.cache.stats()), 200)
+    resp.headers['Content-Type'] = 'application/json'
+    return resp
+
+
+@app.route("/bot_executor_stats")
+@admin_user_required
+def bot_executor_stats():
+    """queue depth, job outcomes and timings for this worker's bot moves"""
+    resp = make_response(json.dumps(controller.bot_jobs.stats()), 200)
+    resp.headers['Content-Type'] = 'application/json'
+    return resp
+
+
 @app.route("/startnewgame", methods=["GET", "POST"])
 @login_required
 def startnewgame():
@@ -225,17 +351,15 @@ def startnewgame():
             response, game = controller.do_start_new_game(request_json, session["user_id"])
             if game:
                 session["game_id"] = game.state.game_id
-                session["game"] = game
                 response["redirect"] = url_for("logged_in") + response["redirect_querystring"]
-            resp = make_response(jsonpickle.encode(
-                response, unpicklable=False), 200)
+            resp = make_response(serializers.encode_response(response), 200)
             resp.headers['Content-Type'] = 'application/json'
             return resp
         else:
             app_logger.error("/startnewgame POST without JSON")
             response = {"startnewgame": False,
                         "message": "you must submit your message as a JSON encoded object"}
-            resp = make_response(jsonpickle.encode(response, unpicklable=False), 400)
+            resp = make_response(serializers.encode_response(response), 400)
             resp.headers['Content-Type'] = 'application/json'
             return resp
 
@@ -253,9 +377,7 @@ def play():
     if session["game_id"] == None:
         return redirect(url_for('startnewgame'))
     else:
-        # take game from session
-        game = session["game"]
-        controller.do_reload_game(game)
+        # the page fetches the game state itself via /getgamestate
         return render_template("play.html")
 
 
@@ -282,8 +404,6 @@ def login():
         if user_id:
             session["user_id"] = user_id
             session["is_admin"] = is_admin
-            session["password"] = password
-            session["game"] = None
             session["game_id"] = None
             return redirect(url_for("logged_in"))
         else:
@@ -297,9 +417,7 @@ def login():
 @app.route("/logout")
 def logout():
     """Log user out"""
-    game = session.get("game")
-    if game:
-        controller.do_save_game(game)
+    # every move is saved as it's made, so there's nothing to save here
     # Forget any user_id
     session.clear()
 
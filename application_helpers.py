@@ -1,9 +1,11 @@
 import requests
 import urllib.parse
 
-from flask import redirect, render_template, request, session, make_response
+from flask import g, redirect, render_template, request, session, make_response
 from functools import wraps
 
+import controller
+
 
 def admin_user_required(f):
     """
@@ -20,4 +22,20 @@ def admin_user_required(f):
         else:
             return make_response("you are not authorized to view this page", 401)
 
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+
+def load_session_game():
+    """
+    Returns the game for session["game_id"], or None if there isn't one.
+
+    The session only holds the game's ID, so the game is loaded from the
+    database - at most once per request.
+    """
+    if "game" not in g:
+        game_id = session.get("game_id")
+        if game_id is None:
+            g.game = None
+        else:
+            g.game = controller.do_load_game(game_id, session["user_id"])
+    return g.game
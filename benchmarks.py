@@ -0,0 +1,129 @@
+"""Measures how big the game state sent to the browser is, and how long it takes
+   to encode and decode, with each of ENCODERS. Decoding is timed in Python, which
+   gives the relative cost of each format rather than what a browser would take.
+
+   The views measured are taken from simulated games (see simulator.py), as the
+   player whose turn it is sees the game after every move, so early, mid and late
+   game tables are all included. The size of the deltas sent to players who already
+   have the view before each move is compared with that of the full view too.
+
+   usage: python benchmarks.py --games 20 --players 4
+"""
+import argparse
+import copy
+import gzip
+import json
+import logging
+import random
+import sys
+import time
+
+import jsonpickle
+
+import bots
+import controller
+import serializers
+import simulator
+import view_deltas
+
+logger = logging.getLogger(__name__)
+
+# name --> (function which encodes a view from controller.game_view, function which decodes it again)
+ENCODERS = {"jsonpickle": (lambda view: jsonpickle.encode(view, unpicklable=False), json.loads),
+            "serializers": (serializers.encode_game_state, json.loads)}
+if serializers.msgpack is not None:
+    ENCODERS["msgpack"] = (lambda view: serializers.encode_game_state(view, serializers.Wire_Formats.MSGPACK),
+                           lambda payload: serializers.msgpack.unpackb(payload, strict_map_key=False))
+
+
+def sample_views(games, config, seed=0, max_moves=bots.MAX_BOT_MOVES):
+    """returns the view of the player whose move it is after every move of games simulated games"""
+    views = []
+    for game_number in range(games):
+        game = simulator.new_game(config, random.Random(f"{seed}-{game_number}"))
+        player_ids = {player.ID for player in game.players}
+        for _ in range(max_moves):
+            if not bots.play_bot_turns(game, player_ids, max_moves=1):
+                break
+            game.set_this_player(game.state.play_order[0])
+            # the view refers to the game, which the next move changes
+            views.append(copy.deepcopy(controller.game_view(game)))
+    return views
+
+
+def __best_time(function, items, repeats):
+    """calls function on every one of items repeats times, returning the results and the best time"""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        results = [function(item) for item in items]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return results, best
+
+
+def benchmark_encoders(views, encoders=ENCODERS, repeats=3):
+    """encodes and decodes every one of views repeats times with each of encoders, returning
+       {name: {"bytes_per_view", "gzipped_bytes_per_view", "microseconds_per_view",
+       "decode_microseconds_per_view"}} (the times are the best of the repeats)"""
+    results = {}
+    for name, (encode, decode) in encoders.items():
+        encoded, encode_time = __best_time(encode, views, repeats)
+        payloads = [payload.encode() if isinstance(payload, str) else payload for payload in encoded]
+        _, decode_time = __best_time(decode, encoded, repeats)
+        results[name] = {"bytes_per_view": sum(len(payload) for payload in payloads) / len(views),
+                         "gzipped_bytes_per_view": sum(len(gzip.compress(payload)) for payload in payloads) / len(views),
+                         "microseconds_per_view": encode_time / len(views) * 1e6,
+                         "decode_microseconds_per_view": decode_time / len(views) * 1e6}
+    return results
+
+
+def benchmark_deltas(games, config, seed=0, max_moves=bots.MAX_BOT_MOVES):
+    """the size of the full view, and of the delta to it from the view before, as the first
+       player sees the game after every move of games simulated games (see view_deltas)"""
+    full_bytes = delta_bytes = moves = 0
+    view_deltas.history.clear()
+    for game_number in range(games):
+        game = simulator.new_game(config, random.Random(f"{seed}-{game_number}"))
+        player_ids = {player.ID for player in game.players}
+        viewer = game.players[0].ID
+        since = None
+        for _ in range(max_moves):
+            if not bots.play_bot_turns(game, player_ids, max_moves=1):
+                break
+            game.set_this_player(viewer)
+            # as if it had been saved
+            game.database_checksum = game.checksum()
+            view = controller.game_view(game)
+            delta = view_deltas.delta_since(view, viewer, game.state.game_id, since)
+            since = view["checksum"]
+            if delta is not None:
+                full_bytes += len(serializers.encode_game_state(view))
+                delta_bytes += len(serializers.encode_game_state_delta(delta))
+                moves += 1
+    view_deltas.history.clear()
+    return {"moves": moves,
+            "full_bytes_per_move": full_bytes / moves if moves else 0,
+            "delta_bytes_per_move": delta_bytes / moves if moves else 0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the game state encoders")
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--seed", default="0")
+    parser.add_argument("--repeats", type=int, default=3)
+    simulator.add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    # the engine logs every move at debug level
+    logging.basicConfig(level=logging.WARNING)
+
+    views = sample_views(args.games, simulator.config_from_args(args), args.seed)
+    report = {"views": len(views),
+              "encoders": benchmark_encoders(views, repeats=args.repeats),
+              "deltas": benchmark_deltas(args.games, simulator.config_from_args(args), args.seed)}
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
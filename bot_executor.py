@@ -0,0 +1,139 @@
+"""Plays bot moves in the background, so that requests don't wait for them.
+
+   Whenever a save leaves it a bot's move, a job of (game_id, checksum) is put
+   on a queue in this worker. A small pool of threads takes jobs off the queue
+   and runs the job handler (see controller.do_bot_turns), which loads the
+   game, plays the bots' moves and saves them only if the game's checksum in
+   the database still matches the job's - if someone else saved in between,
+   their save queued its own job.
+
+   The queue is in memory, so nothing else needs to be running. Jobs lost when
+   a worker stops are queued again the next time anyone fetches the game.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# how many threads each worker runs bot moves on
+BOT_EXECUTOR_THREADS = int(os.environ.get("BOT_EXECUTOR_THREADS", 2))
+
+Bot_Job = namedtuple("Bot_Job", ["game_id", "checksum", "queued_at"])
+
+
+class Job_Results(object):
+    """how a job went - the first thing a job handler returns"""
+    SAVED = "saved"
+    NOTHING_TO_DO = "nothing_to_do"
+    STALE = "stale"
+    CONFLICT = "conflict"
+    FAILED = "failed"
+
+    All = [SAVED, NOTHING_TO_DO, STALE, CONFLICT, FAILED]
+
+
+class Bot_Executor(object):
+    """a queue of bot jobs and the threads which run them.
+
+        methods:
+        .submit(game_id, checksum) --> queue a job, unless one is already queued for the game.
+            Only one job runs for a game at a time - a job submitted while one is running
+            is queued once it finishes
+        .join() --> wait until every queued job has run
+        .stats() --> dict of queue depth, job outcomes and timings
+    """
+
+    def __init__(self, handler, threads=BOT_EXECUTOR_THREADS):
+        # handler(game_id, checksum) --> (one of Job_Results, number of moves played,
+        #                                 seconds spent working out and playing them)
+        self.handler = handler
+        self.threads = threads
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__queued_games = set()
+        self.__running_games = set()
+        # game_id --> checksum of jobs to queue once the game's running job finishes
+        self.__resubmit = {}
+        self.__workers = []
+        self.__results = {result: 0 for result in Job_Results.All}
+        self.__moves = 0
+        self.__wait_seconds = 0.0
+        self.__max_wait_seconds = 0.0
+        self.__run_seconds = 0.0
+        self.__move_seconds = 0.0
+
+    def submit(self, game_id, checksum):
+        with self.__lock:
+            if game_id in self.__queued_games:
+                # the queued job will load the latest version of the game anyway
+                return False
+            if game_id in self.__running_games:
+                self.__resubmit[game_id] = checksum
+                return False
+            self.__queued_games.add(game_id)
+            self.__start_workers()
+        self.__queue.put(Bot_Job(game_id, checksum, time.perf_counter()))
+        logger.debug("queued bot job for game %s at checksum %s", game_id, checksum)
+        return True
+
+    def join(self):
+        self.__queue.join()
+
+    def __start_workers(self):
+        # threads are only started once there's work, so importing this costs nothing
+        while len(self.__workers) < self.threads:
+            worker = threading.Thread(target=self.__work, name=f"bot-executor-{len(self.__workers)}", daemon=True)
+            worker.start()
+            self.__workers.append(worker)
+
+    def __work(self):
+        while True:
+            job = self.__queue.get()
+            try:
+                self.__run(job)
+            finally:
+                self.__queue.task_done()
+
+    def __run(self, job):
+        started = time.perf_counter()
+        with self.__lock:
+            # from now on a new save needs a new job
+            self.__queued_games.discard(job.game_id)
+            self.__running_games.add(job.game_id)
+        try:
+            result, moves, move_seconds = self.handler(job.game_id, job.checksum)
+        except Exception:
+            logger.exception("bot job for game %s failed", job.game_id)
+            result, moves, move_seconds = Job_Results.FAILED, 0, 0.0
+        finished = time.perf_counter()
+        logger.debug("bot job for game %s: %s, %s moves", job.game_id, result, moves)
+        with self.__lock:
+            self.__results[result] += 1
+            self.__moves += moves
+            wait = started - job.queued_at
+            self.__wait_seconds += wait
+            self.__max_wait_seconds = max(self.__max_wait_seconds, wait)
+            self.__run_seconds += finished - started
+            self.__move_seconds += move_seconds
+            self.__running_games.discard(job.game_id)
+            resubmit = job.game_id in self.__resubmit
+            checksum = self.__resubmit.pop(job.game_id, None)
+        if resubmit:
+            self.submit(job.game_id, checksum)
+
+    def stats(self):
+        with self.__lock:
+            jobs = sum(self.__results.values())
+            return {"queue_depth": self.__queue.qsize(),
+                    "threads": len(self.__workers),
+                    "jobs": jobs,
+                    "results": dict(self.__results),
+                    "moves": self.__moves,
+                    "mean_wait_seconds": self.__wait_seconds / jobs if jobs else None,
+                    "max_wait_seconds": self.__max_wait_seconds,
+                    "mean_job_seconds": self.__run_seconds / jobs if jobs else None,
+                    "seconds_per_move": self.__move_seconds / self.__moves if self.__moves else None}
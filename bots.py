@@ -0,0 +1,152 @@
+"""Computer players. A bot is a row in users with is_bot set, which takes a seat
+   in player_game like anyone else. Bots never make HTTP requests: whenever a
+   save leaves it a bot's move, the controller queues a job on controller.bot_jobs
+   (see bot_executor), and controller.do_bot_turns loads the game in the
+   background, calls play_bot_turns to play every bot move up to the next
+   human's turn and saves them in their own save - only if no-one else has
+   saved the game since it was loaded.
+"""
+import logging
+
+import common_db
+from cards import Card_Types
+from game import Move, describe_card_at
+
+logger = logging.getLogger(__name__)
+
+# the most moves played for bots in one go, in case a game of bots never ends
+MAX_BOT_MOVES = 500
+
+# what a bot is called on the game page
+BOT_NAME = "Computer"
+
+# player ID --> whether they're a bot. This never changes for a player, so
+# each worker only needs to look a player up once
+__bot_players = {}
+
+
+def add_bot_player(session):
+    """creates a new bot user, returning its player ID (or None if it can't).
+       Bots have no username or password, so no-one can log in as one"""
+    c = common_db.Common_DB()
+    bot_id = c.execute(session, "INSERT INTO users (player_name, is_bot) VALUES (:player_name, :is_bot)",
+                       player_name=BOT_NAME, is_bot=True)
+    if not bot_id or bot_id is True:
+        logger.error("unable to create bot player")
+        return None
+    __bot_players[bot_id] = True
+    return bot_id
+
+
+def forget_player(player_id):
+    """forgets whether player_id is a bot, e.g. if the bot's creation was rolled back"""
+    __bot_players.pop(player_id, None)
+
+
+def forget_all_players():
+    __bot_players.clear()
+
+
+def get_bot_ids(session, player_ids):
+    """returns the set of player_ids which are bots"""
+    unknown = [player_id for player_id in player_ids if player_id not in __bot_players]
+    if unknown:
+        c = common_db.Common_DB()
+        rows = c.execute(session, "SELECT player_id, is_bot FROM users WHERE player_id IN :player_ids",
+                         player_ids=unknown)
+        for row in rows:
+            __bot_players[row["player_id"]] = bool(row["is_bot"])
+    return {player_id for player_id in player_ids if __bot_players.get(player_id)}
+
+
+class Heuristic_Policy(object):
+    """a quick rule of thumb policy for bots:
+        - swaps so its best cards are face up, counting the play on anything
+          cards as better than any other
+        - plays all the cards it holds of the lowest rank it can, keeping its
+          play on anything cards until they're all it can play
+        - picks up when it has to"""
+
+    def card_value(self, game, card):
+        if card.rank in game.state.play_on_anything_cards:
+            return 100 + card.rank
+        return card.rank
+
+    def choose_swap(self, game, player):
+        """returns the swap Move which puts player's best cards face up, or None if
+           they already are"""
+        cards = [(self.card_value(game, card), Card_Types.CARD_HAND, i) for i, card in enumerate(player.hand)]
+        cards.extend((self.card_value(game, card), Card_Types.CARD_FACE_UP, i) for i, card in enumerate(player.face_up))
+        # on a tie keep the card that's already face up
+        cards.sort(key=lambda held: (held[0], held[1] == Card_Types.CARD_FACE_UP), reverse=True)
+        wanted_face_up = cards[:len(player.face_up)]
+        to_face_up = [describe_card_at(card_type, i) for _, card_type, i in wanted_face_up
+                      if card_type == Card_Types.CARD_HAND]
+        to_hand = [describe_card_at(card_type, i) for _, card_type, i in cards[len(player.face_up):]
+                   if card_type == Card_Types.CARD_FACE_UP]
+        if not to_face_up:
+            return None
+        return Move("swap", tuple(to_face_up + to_hand))
+
+    def choose_move(self, game, player, moves):
+        """chooses one of moves (from Game.iter_legal_moves), or None if there aren't any"""
+        first_move = next(moves, None)
+        if first_move is None:
+            return None
+        if first_move.action == "no_swap":
+            # the other moves are every possible swap - work out the one we want instead
+            return self.choose_swap(game, player) or first_move
+        if first_move.action != "play":
+            return first_move
+        card_type = Card_Types.Card_Type_From_Code[first_move.cards[0][0]]
+        if card_type == Card_Types.CARD_FACE_DOWN:
+            return first_move
+        cards = player.get_cards(card_type)
+
+        def lowest_and_most(move):
+            return -self.card_value(game, cards[int(move.cards[0][2:])]), len(move.cards)
+        return max([first_move, *moves], key=lowest_and_most)
+
+
+def next_bot(game, bot_ids):
+    """returns the ID of the bot who can move next, or None if it's not a bot's move"""
+    if not bot_ids or not game.state.deal_done or game.state.game_finished:
+        return None
+    seated = [player.ID for player in game.players]
+    still_to_swap = [player_id for player_id in seated if player_id not in game.state.players_ready_to_start]
+    if still_to_swap:
+        # everyone swaps at once, so bots can swap while humans think
+        return next((player_id for player_id in still_to_swap if player_id in bot_ids), None)
+    if len(game.state.play_order) < 2:
+        return None
+    next_player = game.state.play_order[0]
+    return next_player if next_player in bot_ids else None
+
+
+def play_bot_turns(game, bot_ids, policy=None, max_moves=MAX_BOT_MOVES):
+    """plays moves for the bots in bot_ids until it's a human's turn or the game ends.
+       Only game in memory changes - the caller saves it once afterwards.
+       Returns the number of moves played"""
+    policy = policy or Heuristic_Policy()
+    this_player_id = game.state.this_player_id
+    moves_played = 0
+    try:
+        while moves_played < max_moves:
+            bot_id = next_bot(game, bot_ids)
+            if bot_id is None:
+                break
+            game.set_this_player(bot_id)
+            move = policy.choose_move(game, game.this_player, game.iter_legal_moves())
+            if move is None:
+                logger.error("bot %s has no move in game %s", bot_id, game.state.game_id)
+                break
+            response = game.play_action(*move)
+            if not response["action_result"]:
+                logger.error("bot %s move %s rejected in game %s: %s", bot_id, move,
+                             game.state.game_id, response.get("action_message"))
+                break
+            moves_played += 1
+    finally:
+        game.set_this_player(this_player_id)
+    logger.debug("played %s bot moves in game %s", moves_played, game.state.game_id)
+    return moves_played
@@ -0,0 +1,64 @@
+"""Packs piles of cards into compact byte strings, for games stored with the
+   'packed' card storage mode rather than one game_cards row per card.
+
+   Each card is a single byte - the deck in the top bit, then the suit, then
+   the rank in the low four bits. A set of piles is stored as, for each pile, one byte for the
+   pile's location (a Card_Types value), one byte for the number of cards,
+   then the cards themselves in order.
+"""
+import os
+
+from cards import Card
+
+
+class Card_Storage(object):
+    ROWS = "rows"
+    PACKED = "packed"
+
+    All = [ROWS, PACKED]
+
+
+# which storage mode new saves use; set CARD_STORAGE=packed to switch over.
+# Games are always loaded from whichever mode they were last saved with.
+DEFAULT_STORAGE = os.environ.get("CARD_STORAGE", Card_Storage.ROWS)
+if DEFAULT_STORAGE not in Card_Storage.All:
+    raise ValueError(f"Unknown CARD_STORAGE '{DEFAULT_STORAGE}' - expected one of {Card_Storage.All}")
+
+MAX_PILE_SIZE = 255
+
+
+def card_to_code(card):
+    """returns the single byte code for a card"""
+    return card.code
+
+
+def card_from_code(code):
+    """returns the card for a single byte code"""
+    return Card.from_code(code)
+
+
+def pack_piles(piles):
+    """packs a dict of {location: list of cards} into bytes"""
+    packed = bytearray()
+    for location, cards in piles.items():
+        if len(cards) > MAX_PILE_SIZE:
+            raise ValueError(f"Cannot pack pile {location} with {len(cards)} cards - maximum is {MAX_PILE_SIZE}")
+        packed.append(location)
+        packed.append(len(cards))
+        packed.extend(card_to_code(card) for card in cards)
+    return bytes(packed)
+
+
+def unpack_piles(packed):
+    """unpacks bytes created by pack_piles into a dict of {location: list of cards}"""
+    piles = {}
+    packed = bytes(packed)
+    i = 0
+    while i < len(packed):
+        location, length = packed[i], packed[i + 1]
+        i += 2
+        if i + length > len(packed):
+            raise ValueError(f"Packed cards truncated in pile {location}")
+        piles[location] = [card_from_code(code) for code in packed[i:i + length]]
+        i += length
+    return piles
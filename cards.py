@@ -1,3 +1,4 @@
+from hashlib import blake2b
 from random import shuffle
 
 
@@ -31,7 +32,21 @@ class Card_Types(object):
 
 
 class Card(object):
-    """defines a playing card"""
+    """defines a playing card.
+
+       Cards are immutable flyweights: Card(suit, rank, deck) always returns the same
+       interned instance, so a game holds references rather than copies. deck is
+       which copy of the card this is in a game played with more than one deck, so
+       the two queens of hearts in a two deck game are different cards. Each card
+       carries a small integer code (deck << 7 | suit << 4 | rank) which is also its
+       hash, and its key is worked out once when the card is first created.
+       zobrist is a random looking 64 bit number for the card (the same in every
+       process), which Card_Pile combines to identify what's in a pile"""
+
+    __slots__ = ("suit", "rank", "deck", "code", "key", "zobrist")
+
+    # the most decks a game can be played with - the deck has to fit in the code's top bit
+    max_decks = 2
 
     suits = {1: "hearts", 2: "diamonds", 3: "clubs", 4: "spades"}
     suits_short = {0: "B", 1: "H", 2: "D", 3: "C", 4: "S"}
@@ -40,12 +55,51 @@ class Card(object):
              10: "ten", 11: "jack", 12: "queen", 13: "king", 14: "ace"}
     rank_short = {10: "T", 11: "J", 12: "Q", 13: "K", 14: "A"}
 
-    def __init__(self, suit, rank):
-        self.rank = rank
-        self.suit = suit
+    # code --> the one Card with that code
+    __interned = {}
+
+    def __new__(cls, suit, rank, deck=0):
+        code = (deck << 7) | (suit << 4) | rank
+        card = cls.__interned.get(code)
+        if card is None:
+            if suit not in cls.suits_short or not 0 <= rank <= 14 or not 0 <= deck < cls.max_decks:
+                raise ValueError(f"Invalid card: suit {suit}, rank {rank}, deck {deck}")
+            card = object.__new__(cls)
+            object.__setattr__(card, "suit", suit)
+            object.__setattr__(card, "rank", rank)
+            object.__setattr__(card, "deck", deck)
+            object.__setattr__(card, "code", code)
+            object.__setattr__(card, "key", str(cls.rank_short.get(rank, rank)) + cls.suits_short[suit])
+            object.__setattr__(card, "zobrist", int.from_bytes(blake2b(bytes([code]), digest_size=8).digest(), "big"))
+            # another thread may have created it first - use theirs
+            card = cls.__interned.setdefault(code, card)
+        return card
+
+    @classmethod
+    def from_code(cls, code):
+        """returns the card with the given code"""
+        card = cls.__interned.get(code)
+        return card if card is not None else cls((code >> 4) & 0x07, code & 0x0F, code >> 7)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("cards can't be changed")
 
     def __hash__(self):
-        return(hash(str(self)))
+        return self.code
+
+    def __reduce__(self):
+        # pickle (and so multiprocessing) gets the interned card back
+        return (Card, (self.suit, self.rank, self.deck))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getstate__(self):
+        # what jsonpickle sends to the browser
+        return {"rank": self.rank, "suit": self.suit}
 
     def same_rank(self, other):
         return self.rank == other.rank
@@ -56,11 +110,7 @@ class Card(object):
 
     def card_key(self):
         """returns a 2 character key for the card"""
-        card_rank = self.rank
-        if card_rank > 9:
-            card_rank = Card.rank_short[card_rank]
-        card_image_name = str(card_rank) + Card.suits_short[self.suit]
-        return str(card_image_name)
+        return self.key
 
     def __str__(self):
         """Return a description of the card name"""
@@ -75,26 +125,40 @@ class Card(object):
 
     def __eq__(self, other):
         """equal to"""
-        return self.rank == other.rank and self.suit == other.suit
+        if self is other:
+            return True
+        if not isinstance(other, Card):
+            return NotImplemented
+        return self.code == other.code
+
+
+# what other players see instead of a hidden card
+CARD_BACK = Card(0, 1)
 
 
 class Deck(object):
     """defines a deck of playing cards.
-       by default a new deck is shuffled but optionally can be empty"""
+       by default a new deck is shuffled but optionally can be empty.
+       Pass a random.Random as rng for a repeatable shuffle"""
+
+    cards_per_deck = len(Card.suits) * len(Card.ranks)
 
-    def __init__(self, newgame=True, number_of_decks=1):
+    def __init__(self, newgame=True, number_of_decks=1, rng=None):
         self.cards = []
         self.current = 0
 
         if (newgame):
             # we're asking for a newly shuffled deck for a new game
-            for _ in range(number_of_decks):
-                self.cards.extend([Card(s, r) for s in Card.suits for r in Card.ranks])
-            self.shuffle()
+            for deck in range(number_of_decks):
+                self.cards.extend([Card(s, r, deck) for s in Card.suits for r in Card.ranks])
+            self.shuffle(rng)
 
-    def shuffle(self):
+    def shuffle(self, rng=None):
         """shuffle the current deck"""
-        shuffle(self.cards)
+        if rng:
+            rng.shuffle(self.cards)
+        else:
+            shuffle(self.cards)
 
     def deal(self):
         """deal one card, returning the card and removing it from the deck"""
@@ -116,3 +180,202 @@ class Deck(object):
             card = self.cards[self.current]
             self.current += 1
             return card
+
+
+class Card_Pile(list):
+    """a list of cards which keeps the zobrist numbers of its cards XORed together
+       as they're added and removed, so what's in the pile can be compared or
+       hashed without looking through it. Order doesn't change it - a pile holds
+       each card at most once, so it identifies the set of cards in the pile"""
+
+    def __init__(self, cards=()):
+        super().__init__(cards)
+        self.__zobrist = 0
+        self.__toggle(self)
+
+    @property
+    def zobrist(self):
+        return self.__zobrist
+
+    def __toggle(self, cards):
+        for card in cards:
+            self.__zobrist ^= card.zobrist
+
+    def append(self, card):
+        super().append(card)
+        self.__zobrist ^= card.zobrist
+
+    def extend(self, cards):
+        cards = list(cards)
+        super().extend(cards)
+        self.__toggle(cards)
+
+    def __iadd__(self, cards):
+        self.extend(cards)
+        return self
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = list(value)
+            self.__toggle(self[index])
+            self.__toggle(value)
+        else:
+            self.__zobrist ^= self[index].zobrist ^ value.zobrist
+        super().__setitem__(index, value)
+
+    def __delitem__(self, index):
+        self.__toggle(self[index] if isinstance(index, slice) else (self[index],))
+        super().__delitem__(index)
+
+    def __imul__(self, times):
+        result = super().__imul__(times)
+        self.__zobrist = 0
+        self.__toggle(self)
+        return result
+
+    def insert(self, index, card):
+        super().insert(index, card)
+        self.__zobrist ^= card.zobrist
+
+    def pop(self, *args):
+        card = super().pop(*args)
+        self.__zobrist ^= card.zobrist
+        return card
+
+    def remove(self, card):
+        super().remove(card)
+        self.__zobrist ^= card.zobrist
+
+    def clear(self):
+        super().clear()
+        self.__zobrist = 0
+
+    def __reduce__(self):
+        # copies and pickles work out their own zobrist
+        return (type(self), (list(self),))
+
+    def __getstate__(self):
+        # what jsonpickle sends to the browser - just the cards
+        return list(self)
+
+
+def card_pile_property(attribute):
+    """a property which keeps whatever's assigned to it in attribute as a Card_Pile"""
+    def get_pile(self):
+        return getattr(self, attribute)
+
+    def set_pile(self, cards):
+        setattr(self, attribute, Card_Pile(cards))
+    return property(get_pile, set_pile)
+
+
+class Played_Pile(Card_Pile):
+    """the pile of cards played since the last burn or pick up.
+
+       As cards are added it keeps a short summary of the top of the pile: the
+       top card's rank, how many cards of that rank are on top in a row, and
+       the rank to beat - the top card's rank, or if that's transparent the
+       first card below it which isn't - so that checking a move or a burn
+       doesn't mean looking back through the pile.
+
+       Cards are only ever added to the pile and then it's replaced when it's
+       burnt or picked up, so the summary is kept up to date as cards are
+       added; any other change to the pile means it's worked out again the
+       next time it's needed"""
+
+    def __init__(self, cards=()):
+        super().__init__(cards)
+        self.__known = False
+        self.__transparent_rank = None
+        self.__rank_to_beat = None
+        self.__top_rank = None
+        self.__run_length = 0
+
+    def __push(self, card):
+        if card.rank == self.__top_rank:
+            self.__run_length += 1
+        else:
+            self.__top_rank = card.rank
+            self.__run_length = 1
+        if card.rank != self.__transparent_rank:
+            self.__rank_to_beat = card.rank
+
+    def __forget(self):
+        self.__known = False
+
+    def rank_to_beat(self, transparent_rank):
+        """the rank of the top card, ignoring transparent_rank cards, or None if
+           there are no cards or they're all transparent"""
+        if not self.__known or transparent_rank != self.__transparent_rank:
+            self.__summarise(transparent_rank)
+        return self.__rank_to_beat
+
+    def top_run(self):
+        """returns (rank of the top card, how many cards of that rank are on top in a row),
+           or (None, 0) if there are no cards"""
+        if not self.__known:
+            self.__summarise(self.__transparent_rank)
+        return self.__top_rank, self.__run_length
+
+    def __summarise(self, transparent_rank):
+        self.__transparent_rank = transparent_rank
+        self.__rank_to_beat = None
+        self.__top_rank = None
+        self.__run_length = 0
+        for card in self:
+            self.__push(card)
+        self.__known = True
+
+    def append(self, card):
+        super().append(card)
+        if self.__known:
+            self.__push(card)
+
+    def extend(self, cards):
+        cards = list(cards)
+        super().extend(cards)
+        if self.__known:
+            for card in cards:
+                self.__push(card)
+
+    def __iadd__(self, cards):
+        self.extend(cards)
+        return self
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.__forget()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.__forget()
+
+    def __imul__(self, times):
+        result = super().__imul__(times)
+        self.__forget()
+        return result
+
+    def insert(self, index, card):
+        super().insert(index, card)
+        self.__forget()
+
+    def pop(self, *args):
+        card = super().pop(*args)
+        self.__forget()
+        return card
+
+    def remove(self, card):
+        super().remove(card)
+        self.__forget()
+
+    def clear(self):
+        super().clear()
+        self.__forget()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.__forget()
+
+    def reverse(self):
+        super().reverse()
+        self.__forget()
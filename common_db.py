@@ -1,10 +1,11 @@
-import datetime
 import decimal
 import logging
 import os
 import re
 import sys
+import threading
 import warnings
+from collections import OrderedDict, namedtuple
 
 import requests
 import sqlalchemy
@@ -15,6 +16,20 @@ from sqlalchemy.orm import sessionmaker
 
 import models
 
+# maximum number of distinct SQL texts held in each Common_DB statement cache
+STATEMENT_CACHE_SIZE = 256
+
+# the parsed form of a SQL text, reused on every call with the same text
+Prepared_Statement = namedtuple("Prepared_Statement", ["clause", "statement_type", "log"])
+
+
+class Statement_Types(object):
+    SELECT = 1
+    INSERT = 2
+    UPDATE_OR_DELETE = 3
+    OTHER = 4
+
+
 class Common_DB():
     """A singleton Common_DB object which contains a link to a DB connection
 
@@ -22,6 +37,8 @@ class Common_DB():
         .engine() --> return an instance of sqlalchemy.engine.Engine, connected to the database
         .common_Session() --> return a sqlalchemy.orm.session.sessionmaker bound to .engine
         .execute(statement, param1=param1 ...) --> executes a statement without session
+        .insert_many(engine_or_session, table, columns, rows) --> single multi-row INSERT with bound values
+        .statement_cache_info() --> hits, misses and size of the prepared statement cache
 
     """
 
@@ -41,6 +58,8 @@ class Common_DB():
         __sqalchemy_database_uri = None
         __secret_key = None
         __logger = None
+        __is_postgres = False
+        __last_value_clause = sqlalchemy.text("SELECT LASTVAL()")
         def __init__(self):
             """initiates Controller to fetch SQL connection details and instantiate a single engine connection.
             
@@ -59,6 +78,13 @@ class Common_DB():
             self.__logger.debug("creating common_engine")
             self.__common_engine = create_engine(self.__sqalchemy_database_uri)
             self.__logger.info("Created engine %s", self.__common_engine)
+            self.__is_postgres = self.__common_engine.url.get_backend_name() in ["postgres", "postgresql"]
+
+            # parsed statements, keyed by SQL text - see __prepare_statement
+            self.__statement_cache = OrderedDict()
+            self.__statement_cache_lock = threading.Lock()
+            self.__statement_cache_hits = 0
+            self.__statement_cache_misses = 0
 
             # Log statements to standard error
             logging.basicConfig(level=logging.DEBUG)
@@ -103,28 +129,58 @@ class Common_DB():
             """Initialises models in the DB using sqlalchemy.schema.MetaData.create_all()"""
             self.__logger.debug("calling models.Base.metata.create_all")
             models.Base.metadata.create_all(self.__common_engine)
+            self.add_missing_columns()
+
+        def add_missing_columns(self):
+            """adds any columns defined in models which are missing from tables that already
+            exist - create_all only creates tables which don't exist yet"""
+            inspector = sqlalchemy.inspect(self.__common_engine)
+            dialect = self.__common_engine.dialect
+            existing_tables = inspector.get_table_names()
+            for table in models.Base.metadata.sorted_tables:
+                if table.name not in existing_tables:
+                    continue
+                existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing_columns:
+                        continue
+                    ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=dialect)}"
+                    if column.server_default is not None:
+                        default = column.server_default.arg
+                        if isinstance(default, str):
+                            default = "'" + default.replace("'", "''") + "'"
+                        else:
+                            default = str(default.compile(dialect=dialect))
+                        ddl += f" DEFAULT {default}"
+                    self.__logger.info("adding missing column: %s", ddl)
+                    self.__common_engine.execute(ddl)
 
         def execute(self, engine_or_session, text, **params):
             """
             Execute a SQL statement.
             modified from https://github.com/cs50/python-cs50
+
+            The statement is prepared once per distinct SQL text (see __prepare_statement)
+            and values are passed to the driver as bound parameters rather than
+            being rendered into the SQL as literals.
             """
             # Raise exceptions for warnings
             warnings.filterwarnings("error")
 
             # Prepare, execute statement
+            log = text
             try:
 
-                statement = self.__parse_sql_statement(text = text, **params)
-
-                # Statement for logging
-                log = re.sub(r"\n\s*", " ", sqlparse.format(statement, reindent=True))
+                # lists are bound as expanding parameters, e.g. "WHERE x IN :values"
+                expanding = tuple(sorted(key for key, value in params.items() if type(value) is list))
+                prepared = self.__prepare_statement(text, expanding)
+                log = prepared.log
 
                 # Execute statement
-                result = engine_or_session.execute(statement)
-                
+                result = engine_or_session.execute(prepared.clause, params)
+
                 # If SELECT (or INSERT with RETURNING), return result set as list of dict objects
-                if re.search(r"^\s*SELECT", statement, re.I):
+                if prepared.statement_type == Statement_Types.SELECT:
 
                     # Coerce any decimal.Decimal objects to float objects
                     # https://groups.google.com/d/msg/sqlalchemy/0qXMYJvq8SA/oqtvMD9Uw-kJ
@@ -136,9 +192,9 @@ class Common_DB():
                     ret = rows
 
                 # If INSERT, return primary key value for a newly inserted row
-                elif re.search(r"^\s*INSERT", statement, re.I):
-                    if self.__common_engine.url.get_backend_name() in ["postgres", "postgresql"]:
-                        result = engine_or_session.execute(sqlalchemy.text("SELECT LASTVAL()"))
+                elif prepared.statement_type == Statement_Types.INSERT:
+                    if self.__is_postgres:
+                        result = engine_or_session.execute(self.__last_value_clause)
                         ret = result.first()[0]
                     else:
                         ret = result.lastrowid
@@ -149,7 +205,7 @@ class Common_DB():
                         ret = True
 
                 # If DELETE or UPDATE, return number of rows matched
-                elif re.search(r"^\s*(?:DELETE|UPDATE)", statement, re.I):
+                elif prepared.statement_type == Statement_Types.UPDATE_OR_DELETE:
                     ret = result.rowcount
 
                 # If some other statement, return True unless exception
@@ -170,73 +226,40 @@ class Common_DB():
 
             # Return value
             else:
-                self.logger.debug(termcolor.colored(log, "green"))
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug("%s %s", termcolor.colored(log, "green"), params)
                 return ret
 
-        def __parse_sql_statement(self, text, **params):
+        def insert_many(self, engine_or_session, table, columns, rows):
             """
-            Parse and bind paramaters to create a SQL statement.
+            Inserts rows (a list of tuples in the same order as columns) into table with a
+            single multi-row INSERT, binding every value as a parameter.
+            Returns the result of execute, or True if there were no rows to insert.
+            """
+            if not rows:
+                return True
+            values = []
+            params = {}
+            for i, row in enumerate(rows):
+                values.append("(" + ", ".join(f":{column}_{i}" for column in columns) + ")")
+                params.update({f"{column}_{i}": value for column, value in zip(columns, row)})
+            text = f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join(values)}"
+            return self.execute(engine_or_session, text, **params)
+
+        def __prepare_statement(self, text, expanding=()):
+            """
+            returns a Prepared_Statement for the SQL text, building and caching it
+            the first time a given text is seen. The cache is a bounded LRU, so
+            statements which embed literal values don't grow it without limit.
             adapted from https://github.com/cs50/python-cs50
             """
-
-            class UserDefinedType(sqlalchemy.TypeDecorator):
-                """
-                Add support for expandable values, a la https://bitbucket.org/zzzeek/sqlalchemy/issues/3953/expanding-parameter.
-                """
-
-                impl = sqlalchemy.types.UserDefinedType
-
-                def process_literal_param(self, value, dialect):
-                    """Receive a literal parameter value to be rendered inline within a statement."""
-                    def process(value):
-                        """Render a literal value, escaping as needed."""
-
-                        # bool
-                        if isinstance(value, bool):
-                            return sqlalchemy.types.Boolean().literal_processor(dialect)(value)
-
-                        # datetime.date
-                        elif isinstance(value, datetime.date):
-                            return sqlalchemy.types.String().literal_processor(dialect)(value.strftime("%Y-%m-%d"))
-
-                        # datetime.datetime
-                        elif isinstance(value, datetime.datetime):
-                            return sqlalchemy.types.String().literal_processor(dialect)(value.strftime("%Y-%m-%d %H:%M:%S"))
-
-                        # datetime.time
-                        elif isinstance(value, datetime.time):
-                            return sqlalchemy.types.String().literal_processor(dialect)(value.strftime("%H:%M:%S"))
-
-                        # float
-                        elif isinstance(value, float):
-                            return sqlalchemy.types.Float().literal_processor(dialect)(value)
-
-                        # int
-                        elif isinstance(value, int):
-                            return sqlalchemy.types.Integer().literal_processor(dialect)(value)
-
-                        # long - modified to use int instead of long in py3 so i dont need this
-                        # - see https://docs.python.org/3.3/whatsnew/3.0.html#integers
-                        # elif sys.version_info.major != 3 and isinstance(value, long):
-                        #    return sqlalchemy.types.Integer().literal_processor(dialect)(value)
-
-                        # str
-                        elif isinstance(value, str):
-                            return sqlalchemy.types.String().literal_processor(dialect)(value)
-
-
-                        # None
-                        elif isinstance(value, sqlalchemy.sql.elements.Null):
-                            return sqlalchemy.types.NullType().literal_processor(dialect)(value)
-
-                        # Unsupported value
-                        raise RuntimeError("unsupported value")
-
-                    # Process value(s), separating with commas as needed
-                    if type(value) is list:
-                        return ", ".join([process(v) for v in value])
-                    else:
-                        return process(value)
+            key = (text, expanding)
+            with self.__statement_cache_lock:
+                prepared = self.__statement_cache.get(key)
+                if prepared:
+                    self.__statement_cache.move_to_end(key)
+                    self.__statement_cache_hits += 1
+                    return prepared
 
             # Allow only one statement at a time
             # SQLite does not support executing many statements
@@ -245,47 +268,45 @@ class Common_DB():
                 self.__common_engine.url.get_backend_name() == "sqlite"):
                 raise RuntimeError("too many statements at once")
 
-            # Raise exceptions for warnings
-            warnings.filterwarnings("error")
-            log = re.sub(r"\n\s*", " ", text)
-
-            # Prepare, execute statement
             try:
-
-                # Construct a new TextClause clause
-                statement = sqlalchemy.text(text)
-                
-
-                # Iterate over parameters
-                for key, value in params.items():
-
-                    # Translate None to NULL
-                    if value is None:
-                        value = sqlalchemy.sql.null()
-
-                    if self.__common_engine.url.get_backend_name() == "sqlite":
-                        # for some reason, bool isnt being converted to int
-                        if value == True:
-                            value = 1
-                        elif value == False:
-                            value = 0
-
-                    # Bind parameters before statement reaches database, so that bound parameters appear in exceptions
-                    # http://docs.sqlalchemy.org/en/latest/core/sqlelement.html#sqlalchemy.sql.expression.text
-                    statement = statement.bindparams(sqlalchemy.bindparam(
-                        key, value=value, type_=UserDefinedType()))
-
-                # Stringify bound parameters
-                # http://docs.sqlalchemy.org/en/latest/faq/sqlexpressions.html#how-do-i-render-sql-expressions-as-strings-possibly-with-bound-parameters-inlined
-                statement = str(statement.compile(compile_kwargs={"literal_binds": True}))
-                log = re.sub(r"\n\s*", " ", sqlparse.format(statement, reindent=True))
-                return statement
+                # Construct a new TextClause clause, with any lists bound as expanding parameters
+                # http://docs.sqlalchemy.org/en/latest/core/sqlelement.html#sqlalchemy.sql.expression.text
+                clause = sqlalchemy.text(text)
+                if expanding:
+                    clause = clause.bindparams(*[sqlalchemy.bindparam(name, expanding=True) for name in expanding])
             except:
-                self.logger.debug(termcolor.colored(log, "red"))
+                self.logger.debug(termcolor.colored(re.sub(r"\n\s*", " ", text), "red"))
                 self.logger.debug(termcolor.colored(sys.exc_info()[0], "red"))
-                
                 raise
-       
+
+            if re.search(r"^\s*SELECT", text, re.I):
+                statement_type = Statement_Types.SELECT
+            elif re.search(r"^\s*INSERT", text, re.I):
+                statement_type = Statement_Types.INSERT
+            elif re.search(r"^\s*(?:DELETE|UPDATE)", text, re.I):
+                statement_type = Statement_Types.UPDATE_OR_DELETE
+            else:
+                statement_type = Statement_Types.OTHER
+
+            # Statement for logging
+            log = re.sub(r"\n\s*", " ", sqlparse.format(text, reindent=True))
+
+            prepared = Prepared_Statement(clause, statement_type, log)
+            with self.__statement_cache_lock:
+                self.__statement_cache_misses += 1
+                self.__statement_cache[key] = prepared
+                while len(self.__statement_cache) > STATEMENT_CACHE_SIZE:
+                    self.__statement_cache.popitem(last=False)
+            return prepared
+
+        def statement_cache_info(self):
+            """returns a dict of hits, misses and current size of the prepared statement cache"""
+            with self.__statement_cache_lock:
+                return {"hits": self.__statement_cache_hits,
+                        "misses": self.__statement_cache_misses,
+                        "size": len(self.__statement_cache),
+                        "max_size": STATEMENT_CACHE_SIZE}
+
         def _parse(self, e):
             """Parses an exception, returns its message.
             from https://github.com/cs50/python-cs50
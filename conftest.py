@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy import event
+
+import bots
+import common_db
+import game_cache
+import game_events
+import view_deltas
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    '''return a Common_DB connected to a throwaway sqlite database with the models created'''
+    monkeypatch.setenv("SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'poohead.db'}")
+    monkeypatch.setenv("SQLALCHEMY_DATABASE_USERNAME", "test")
+    monkeypatch.setenv("SQLALCHEMY_DATABASE_PASSWORD", "test")
+    monkeypatch.setenv("SECRET_KEY", "test")
+    common_db.Common_DB.instance = None
+    game_cache.cache.clear()
+    bots.forget_all_players()
+    view_deltas.history.clear()
+    c = common_db.Common_DB()
+    c.initialise_models()
+    yield c
+    game_events.close_notifier()
+    c.common_engine.dispose()
+    common_db.Common_DB.instance = None
+
+
+@pytest.fixture
+def count_statements(db):
+    '''returns a function which calls function and returns what it returned and the list of
+       SQL statements it executed'''
+    def count_statements(function):
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.common_engine, "before_cursor_execute", count_statement)
+        try:
+            result = function()
+        finally:
+            event.remove(db.common_engine, "before_cursor_execute", count_statement)
+        return result, statements
+    return count_statements
@@ -1,6 +1,7 @@
 import json
 import logging
 import os
+import time
 from urllib.parse import quote_plus
 
 import jsonpickle
@@ -8,15 +9,24 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from werkzeug.security import check_password_hash, generate_password_hash
 
+import bot_executor
+import bots
 import common_db
+import game_cache
+import game_events
 from cards import Card, Card_Types, Deck
-from game import Game, get_users_for_game
+from bot_executor import Job_Results
+from game import (SAVE_CONFLICT, Game, get_database_checksum, get_stored_version,
+                  get_users_for_game)
 from models import (Base, Model_Card, Model_Game, Model_Player,
                     Model_Player_Game)
 from player import Model_Player, Player, get_player_for_username
 
 logger = logging.getLogger(__name__)
 
+# how many times do_playcards plays a move again when someone else saved the game first
+SAVE_ATTEMPTS = 3
+
 
 def do_login(username, password):
     """checks the username and password. If valid returns the user's ID and whether they have admin rights or not"""
@@ -34,30 +44,92 @@ def do_login(username, password):
         return query["player_id"], query["is_admin"]
 
 
+def notify_game_change(session, game):
+    """tells anything waiting on this game (see do_wait_for_game_change) that it has been saved.
+    Call before committing session - the notification is only sent if the commit succeeds"""
+    game_events.get_notifier().notify(session, game.state.game_id, game.checksum())
+
+
+def __database_poll_interval():
+    """how often waiters need to re-check the database - rarely, if the notifier
+    hears about changes made by other workers"""
+    if game_events.get_notifier().covers_other_workers:
+        return game_events.EVENT_STREAM_HEARTBEAT
+    return game_events.DATABASE_POLL_INTERVAL
+
+
+def do_wait_for_game_change(game_id, known_checksum):
+    """holds until the checksum of the game in the database differs from known_checksum,
+    or game_events.LONG_POLL_TIMEOUT passes, and returns the latest checksum"""
+    return game_events.broadcaster.wait_for_change(game_id, known_checksum,
+                                                   lambda: get_database_checksum(game_id),
+                                                   poll_interval=__database_poll_interval())
+
+
+def do_subscribe_to_game(game_id, known_checksum):
+    """generator of game changes for an event stream: yields each new checksum for the
+    game as it is saved, or None every game_events.EVENT_STREAM_HEARTBEAT seconds"""
+    return game_events.broadcaster.subscribe(game_id, known_checksum,
+                                             lambda: get_database_checksum(game_id),
+                                             poll_interval=__database_poll_interval())
+
+
+def __saved(game):
+    """call once a save of game is committed - the game now matches the database"""
+    game_cache.cache.put(game)
+
+
+def __not_saved(game):
+    """call when a save of game is rolled back - we no longer know if the game
+    matches the database"""
+    game_cache.cache.invalidate(game.state.game_id)
+
+
+def __queue_bot_turns(game):
+    """queues a bot job (see do_bot_turns) if game, as saved or loaded, is waiting on a bot's move"""
+    c = common_db.Common_DB()
+    bot_ids = bots.get_bot_ids(c.common_engine, [player.ID for player in game.players])
+    if bots.next_bot(game, bot_ids) is not None:
+        bot_jobs.submit(game.state.game_id, game.database_checksum)
+
+
 def do_save_game(game):
     c = common_db.Common_DB()
     s = c.common_Sessionmaker()
-    if game.save(s):
+    saved, message = game.save(s)
+    if saved:
+        notify_game_change(s, game)
         s.commit()
         s.close()
+        __saved(game)
         return True
     else:
         s.rollback()
         s.close()
+        __not_saved(game)
         return False
 
 
 def do_reload_game(game):
     c = common_db.Common_DB()
     s = c.common_Sessionmaker()
-    game.load(s)
+    loaded = game.load(s)
     s.close()
+    return loaded
 
 
 def do_load_game(game_id, this_player_id):
-    """loads a game object"""
+    """loads a game object - from the game cache if the game hasn't changed
+    since it was cached, otherwise from the database. Returns None if it can't be loaded"""
     c = common_db.Common_DB()
 
+    stored_version = get_stored_version(game_id)
+    game = game_cache.cache.get(game_id, stored_version)
+    if game:
+        logger.debug(f"game {game_id} loaded from cache")
+        game.set_this_player(this_player_id)
+        return game
+
     logger.info(f"Starting to load game for ID '{game_id}'")
     game = Game()
     game.state.game_id = game_id
@@ -76,6 +148,10 @@ def do_load_game(game_id, this_player_id):
 
     if not game.load(c.common_engine):
         logger.error(f"Failed to load game {game_id}")
+        return None
+    if game.stored_version() == stored_version:
+        # only cache the game if nothing was saved while we were loading it
+        game_cache.cache.put(game)
 
     logger.info(f"do_load_game complete for game {game_id}")
     return game
@@ -89,24 +165,55 @@ def do_add_to_game(game):
     # check whether this is allowed.
     c = common_db.Common_DB()
     this_session = c.common_Sessionmaker()
-   
+    return __add_player_and_save(this_session, game, game.state.this_player_id,
+                                 "Added you to the game. Now sit tight and wait for enough other players to join.")
+
+
+def do_add_bot_to_game(game):
+    """creates a bot player and adds it to game"""
+    if not game:
+        raise ValueError("Tried to do_add_bot_to_game without game")
+    c = common_db.Common_DB()
+    this_session = c.common_Sessionmaker()
+    bot_id = bots.add_bot_player(this_session)
+    if not bot_id:
+        this_session.rollback()
+        this_session.close()
+        return False, "Unable to create a computer player"
+    action_result, message = __add_player_and_save(this_session, game, bot_id,
+                                                   "Added a computer player. Now wait for enough other players to join.")
+    if not action_result:
+        # the bot was rolled back, and its ID may be given to someone else
+        bots.forget_player(bot_id)
+    return action_result, message
 
-    action_result, message = game.add_players_to_game(game.state.this_player_id)
+
+def __add_player_and_save(this_session, game, player_id, waiting_message):
+    """adds player_id to game, dealing (and playing any bot moves) if that fills it, and
+    saves the game in this_session, which is then closed"""
+    action_result, message = game.add_players_to_game(player_id)
     if action_result:
         # added to the game. Check if the game is ready
         if game.ready_to_start:
             # do the deal
             game.deal()
-            action_result, message = game.save(this_session)
+            action_result, message = game.save(this_session, expected_checksum=game.database_checksum)
         else:
-            action_result, message = game.save(this_session)
+            action_result, message = game.save(this_session, expected_checksum=game.database_checksum)
             if action_result:
-                message = "Added you to the game. Now sit tight and wait for enough other players to join."
+                message = waiting_message
+        if message == SAVE_CONFLICT:
+            message = "Someone else joined the game at the same time - please try again."
     if action_result:
+        notify_game_change(this_session, game)
         this_session.commit()
+        __saved(game)
     else:
         this_session.rollback()
+        __not_saved(game)
     this_session.close()
+    if action_result:
+        __queue_bot_turns(game)
 
     return action_result, message
 
@@ -130,6 +237,7 @@ def do_start_new_game(request_json, this_player_user_id):
         else:
             logger.info("do_start_new_game save ok, committing")
             this_session.commit()
+            __saved(game)
             msg = quote_plus(f"Game created successfully with ID {game.state.game_id}"
                              ". Now let's wait for some other players to join.")
             response = {"startnewgame": True,
@@ -170,51 +278,114 @@ def do_playcards(request_json, game):
                     'action_message': "no cards specified"}
         return response
 
-    # at least we've got a candidate action - let's reload the game state from teh database
+    # at least we've got a candidate action - make sure we have the latest game state
     c = common_db.Common_DB()
-    s = c.common_Sessionmaker()
-    game.load(s)
+    reload = game.database_checksum is None or game.database_checksum != get_database_checksum(game.state.game_id)
+    cards_before = None
+    for attempt in range(SAVE_ATTEMPTS):
+        s = c.common_Sessionmaker()
+        if reload and not game.load(s):
+            s.close()
+            logger.error("do_playcards unable to load game %s", game.state.game_id)
+            return {'action': action, 'action_result': False,
+                    'action_message': "Unable to load game"}
+        if attempt and game.this_player.current_piles() != cards_before:
+            # this player's cards changed - e.g. the same move sent twice - so the
+            # move they chose may not mean the same thing any more
+            s.close()
+            logger.info("do_playcards %s conflicts with a change to player %s's cards", action, game.this_player.ID)
+            return __conflict_response(action)
+        cards_before = game.this_player.current_piles()
+        loaded_checksum = game.database_checksum
+
+        response = game.play_action(action, cards)
+
+        logger.debug("do_playcards %s: %s", action, response)
+        if not response["action_result"]:
+            logger.error(response["action_message"])
+            s.rollback()
+            s.close()
+            return response
+
+        # only save over the version of the game the move was played on
+        saved, message = game.save(s, expected_checksum=loaded_checksum)
+        if saved:
+            notify_game_change(s, game)
+            s.commit()
+            s.close()
+            logger.debug("do_playcards saved game")
+            __saved(game)
+            __queue_bot_turns(game)
+            return response
+
+        s.rollback()
+        s.close()
+        __not_saved(game)
+        if message != SAVE_CONFLICT:
+            logger.error("do_playcards unable to save, transaction rolled back")
+            return {'action': action, 'action_result': False,
+                    'action_message': "Unable to save game"}
+        # someone else saved first - play the move again on their version of the game
+        logger.info("do_playcards save conflict on game %s, attempt %s", game.state.game_id, attempt + 1)
+        reload = True
 
-    if action == "swap":
-        # we have a action_cards object - submit to game
-        response = game.swap_cards(cards, game.this_player)
+    return __conflict_response(action)
 
-    elif action == "no_swap":
-        # player has opted to play without swapping
-        logger.debug("do_playcards starting game without swap")
-        response = game.play_no_swap()
-    elif action == "play":
-        # play these cards
-        logger.debug("do_playcards starting play")
-        response = game.play_move(cards)
 
-    elif action == "pick":
-        # player has to pick up the cards
-        response = game.play_pick_up()
+def __conflict_response(action):
+    return {'action': action, 'action_result': False, 'conflict': True,
+            'action_message': "The game changed while your move was being made - check the cards and try again."}
 
-    else:
-        # now set this as default action in case it fails to match any action below
-        response = {'action': action, 'action_result': False,
-                    'action_message': "unknown action :" + action}
 
-    logger.debug("do_playcards %s: %s", action, response)
-    if not response["action_result"]:
-        logger.error(response["action_message"])
-        s.rollback()
-        s.close
-        return response
-        
-    if game.save(s):
+def do_bot_turns(game_id, checksum):
+    """runs a bot job from bot_jobs: loads the game, plays every bot move which is due and
+    saves them, as long as no-one else has saved the game since it was loaded.
+    Returns (one of Job_Results, number of moves played, seconds spent playing them)"""
+    c = common_db.Common_DB()
+    bot_ids = bots.get_bot_ids(c.common_engine, get_users_for_game(game_id, c.common_engine))
+    if not bot_ids:
+        return Job_Results.NOTHING_TO_DO, 0, 0.0
+    game = do_load_game(game_id, min(bot_ids))
+    if not game:
+        return Job_Results.FAILED, 0, 0.0
+    s = c.common_Sessionmaker()
+    if bots.next_bot(game, bot_ids) is None:
+        s.close()
+        # a later save may have moved the game on already
+        return (Job_Results.NOTHING_TO_DO if game.database_checksum == checksum else Job_Results.STALE), 0, 0.0
+
+    started = time.perf_counter()
+    moves = bots.play_bot_turns(game, bot_ids)
+    move_seconds = time.perf_counter() - started
+
+    saved, message = game.save(s, expected_checksum=game.database_checksum)
+    if saved:
+        notify_game_change(s, game)
         s.commit()
-        logger.debug("do_playcards saved game")
+        __saved(game)
+        result = Job_Results.SAVED
     else:
         s.rollback()
-        logger.error("do_playcards unable to save, transaction rolled back")
-        response = {'action': action, 'action_result': False,
-                    'action_message': "Unable to save game"}
-
+        __not_saved(game)
+        # if someone else saved first, their save queued its own job
+        result = Job_Results.CONFLICT if message == SAVE_CONFLICT else Job_Results.FAILED
     s.close()
-    return response
+    if saved:
+        # in case the bots stopped early
+        __queue_bot_turns(game)
+    return result, moves, move_seconds
+
+
+# bot moves are played in the background, off the request threads
+bot_jobs = bot_executor.Bot_Executor(do_bot_turns)
+
+
+def game_state_etag(game_id, database_checksum, player_id):
+    """the ETag for a player's view of a game returned by get_game_state: the
+    view only changes when the game's checksum does. Every game is served from
+    the same URL, and different games can have the same checksum, so the game
+    ID is part of it too"""
+    return f"{game_id}-{database_checksum}-{player_id}"
 
 
 def get_game_state(game):
@@ -227,10 +398,13 @@ def get_game_state(game):
     if not game.this_player:
         raise ValueError(
             "Tried to get game state but dont know current player")
+    # picks up bot moves which were due when a worker stopped before playing them
+    __queue_bot_turns(game)
+    return game_view(game)
 
-    # always reload in case other users have caused a state change
 
-    do_reload_game(game)
+def game_view(game):
+    """the game as game.this_player sees it - see get_game_state"""
     game_state = {'active-game': True,
                   "state": game.state}
     # calculate the allowed moves at this stage of teh game for this player
@@ -251,7 +425,8 @@ def get_game_state(game):
     total_state = {'game': game_state,
                    'allowed_moves': allowed_moves,
                    'players_state': players_state,
-                   "checksum": game.checksum()}
+                   "checksum": game.database_checksum}
 
-    logger.debug("get_game_state total_state: %s", jsonpickle.dumps(total_state, unpicklable=False))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("get_game_state total_state: %s", jsonpickle.dumps(total_state, unpicklable=False))
     return total_state
@@ -1,18 +1,25 @@
+import copy
 import json
 import logging
+import os
+import random
 import sys
 from collections import namedtuple
+from functools import lru_cache
+from itertools import combinations
 from enum import Enum
 from random import shuffle
 from typing import List
-from zlib import crc32
+from hashlib import blake2b
 import jsonpickle
 
 import jsonpickle
 from sqlalchemy.ext.declarative import declarative_base
 
+import card_storage
 import common_db
-from cards import Card, Card_Types, Deck
+from card_storage import Card_Storage
+from cards import Card, Card_Types, Deck, Played_Pile, card_pile_property
 from models import Model_Card, Model_Game, Model_Player, Model_Player_Game
 from player import Player
 
@@ -21,6 +28,44 @@ logger = logging.getLogger(__name__)
 Base = declarative_base()
 
 
+@lru_cache(maxsize=None)
+def play_legality_table(play_on_anything_cards, less_than_card):
+    """works out, for a game config, which ranks can be played on which:
+       table[rank to beat][rank played] is True if the move is allowed.
+       There are only a handful of configs, so each is worked out once"""
+    ranks = range(max(Card.ranks) + 1)
+    return tuple(tuple(rank in play_on_anything_cards or
+                       (rank_to_beat == less_than_card and rank <= rank_to_beat) or
+                       rank >= rank_to_beat
+                       for rank in ranks)
+                 for rank_to_beat in ranks)
+
+
+# what Game.save returns as its message if the game changed since it was loaded
+SAVE_CONFLICT = "game changed since it was loaded"
+
+# a move a player can make: action is "swap", "no_swap", "play" or "pick" and cards
+# is a tuple of card descriptions (see describe_card_at) or None - the arguments
+# Game.play_action takes
+Move = namedtuple("Move", ["action", "cards"])
+
+# an action as it's written to the game_moves table (see move_log). cards is a tuple of
+# (card location short name, card code) for each card the action moved, or for a deal
+# the codes of the shuffled deck
+Logged_Move = namedtuple("Logged_Move", ["move_number", "player_id", "action", "cards"])
+
+# a snapshot of the whole game is written to game_snapshots after the deal and then
+# every this many moves, so that move_log never replays more than this many moves.
+# The cards are only written to game_cards (or packed_cards) along with a snapshot -
+# in between, a save is the games row and the moves (see Game.save)
+SNAPSHOT_INTERVAL = int(os.environ.get("GAME_SNAPSHOT_INTERVAL", 20))
+
+
+def describe_card_at(card_type, index):
+    """the description play_move and swap_cards expect for a player's card, e.g. h-0"""
+    return f"{Card_Types.Short_Name[card_type]}-{index}"
+
+
 class Game(object):
 
     class Card_Pile_ID(Enum):
@@ -84,11 +129,32 @@ class Game(object):
         self.state.this_player_id = this_player_id
         self.players = []
         self.this_player = None
+        # what was last loaded from or saved to the database, so that save
+        # only writes what has changed. None means unknown - write everything
+        self.__saved_state = None
+        self.__saved_piles = None
+        # how cards are written on save (a Card_Storage mode), and how they were last loaded
+        self.card_storage = card_storage.DEFAULT_STORAGE
+        self.__loaded_storage = None
+        # the game_checksum column as of the last load or save, so callers can
+        # tell cheaply whether the database has moved on since
+        self.database_checksum = None
+        # actions played since the last load or save, written to game_moves on save,
+        # and (move number, checksum, snapshot) of each deal since, for game_snapshots
+        self.__unsaved_moves = []
+        self.__unsaved_snapshots = []
+        # the move the cards stored in the database are as of, or None if unknown
+        self.__cards_move_number = None
         if this_player_id:
             this_player = Player(this_player_id)
             self.this_player = this_player
             self.add_player(this_player)
 
+    def set_this_player(self, player_id):
+        """makes player_id the player whose moves are played and whose view is calculated"""
+        self.state.this_player_id = player_id
+        self.this_player = next((player for player in self.players if player.ID == player_id), None)
+
     def add_player(self, player):
         self.players.append(player)
         self.state.number_of_players_joined = len(self.players)
@@ -194,12 +260,17 @@ class Game(object):
             list_of_play_on_anything_cards.remove(0)
 
         self.state.play_on_anything_cards = list_of_play_on_anything_cards
-        message = "parsed successfully"
-        print(list_of_special_cards)
-        no_duplicates = len(list_of_special_cards) == len(set(list_of_special_cards))
-        if not no_duplicates:
-            message = "Special cards can only be assigned once."
-        return no_duplicates, message
+        logger.debug("special cards: %s", list_of_special_cards)
+        if len(list_of_special_cards) != len(set(list_of_special_cards)):
+            return False, "Special cards can only be assigned once."
+
+        cards_needed = self.state.number_of_players_requested * (
+            2 * self.state.number_face_down_cards + self.state.number_hand_cards)
+        cards_available = self.state.number_of_decks * Deck.cards_per_deck
+        if cards_needed > cards_available:
+            return False, (f"Not enough cards: dealing to {self.state.number_of_players_requested} players "
+                           f"needs {cards_needed} cards but {self.state.number_of_decks} deck(s) have {cards_available}.")
+        return True, "parsed successfully"
 
     def __are_there_enough_players_to_start(self):
         """have enough players joined this game yet?"""
@@ -251,27 +322,116 @@ class Game(object):
             self.pile_played = []
             self.pile_deck = []
 
+        # the piles are Card_Piles, which keep track of what's in them for Game.checksum
+        pile_burn = card_pile_property("_pile_burn")
+        pile_pick = card_pile_property("_pile_pick")
+        pile_deck = card_pile_property("_pile_deck")
+
+        @property
+        def pile_played(self):
+            return self.__pile_played
+
+        @pile_played.setter
+        def pile_played(self, cards):
+            # whatever's assigned is kept as a Played_Pile, which tracks the rank to beat
+            self.__pile_played = Played_Pile(cards)
+
     def get_database_checksum(self):
         """loads the 'checksum' field from teh database for the current game and returns it"""
-        c = common_db.Common_DB()
-        config = c.execute(c.common_engine, 'SELECT game_checksum FROM games WHERE gameid = :game_id',
-                           game_id=self.state.game_id)
-        database_checksum = config[0]["game_checksum"]
-        return database_checksum
+        return get_database_checksum(self.state.game_id)
+
+    def stored_version(self):
+        """identifies what's in the database as of the last load or save - the game_checksum
+           column and the card storage mode - or None if that isn't known"""
+        if self.database_checksum is None or self.__loaded_storage is None:
+            return None
+        return self.database_checksum, self.__loaded_storage
 
     def checksum(self):
-        """calculates a CRC32 checksum for the current state based on an arbitrary but static representative set of game objects"""
-        state_summary = jsonpickle.dumps({"play_order": self.state.play_order,
-                                          "cards": self.cards,
-                                          "players_ready_to_start": self.state.players_ready_to_start,
-                                          "players_finished": self.state.players_finished,
-                                          "play_list": self.state.play_list})
-        return str(crc32(state_summary.encode()))
-
-    def deal(self):
-        """creates a new deck of cards, deals to each player, then puts the remaining cards in the pick stack"""
+        """a hash of the current state: the zobrist number of every pile (see Card_Pile),
+           which is kept up to date as cards move, plus the turn number - which goes up with
+           every action, so a game never goes back to an earlier checksum - and the short
+           lists of players. No pile is looked through, so it costs the same all game"""
+        state_summary = json.dumps([self.state.current_turn_number,
+                                    self.state.play_order,
+                                    self.state.players_ready_to_start,
+                                    self.state.players_finished,
+                                    [getattr(self.cards, self.Pile_Objects[pile_id]).zobrist
+                                     for pile_id in self.Card_Pile_ID],
+                                    [[player.ID, [getattr(player, player.Pile_Objects[pile_id]).zobrist for pile_id in player.Card_Pile_ID]]
+                                     for player in self.players]])
+        return blake2b(state_summary.encode(), digest_size=8).hexdigest()
+
+    # the State fields a snapshot stores - the rest are worked out from the cards
+    Snapshot_State = ["game_finished", "number_of_players_requested", "players_finished",
+                      "play_on_anything_cards", "play_order", "less_than_card", "transparent_card",
+                      "burn_card", "reset_card", "number_of_decks", "number_face_down_cards",
+                      "number_hand_cards", "current_turn_number", "last_player",
+                      "players_ready_to_start", "deal_done"]
+
+    def snapshot(self):
+        """returns the whole state of the game - its config, and every pile with the cards
+           in the order they're in - as a dict which can be stored as JSON and passed to
+           from_snapshot"""
+        # lists are copied, so the snapshot doesn't change as the game goes on
+        return {"state": {field: copy.copy(getattr(self.state, field, None)) for field in self.Snapshot_State},
+                "game_piles": [[pile_id.value, [card.code for card in getattr(self.cards, self.Pile_Objects[pile_id])]]
+                               for pile_id in self.Card_Pile_ID],
+                "players": [[player.ID, [[pile_id.value, [card.code for card in getattr(player, player.Pile_Objects[pile_id])]]
+                                         for pile_id in player.Card_Pile_ID]]
+                            for player in self.players]}
+
+    @classmethod
+    def from_snapshot(cls, game_id, snapshot, this_player_id=None):
+        """returns a new Game for game_id in the state captured by snapshot"""
+        game = cls()
+        game.state.game_id = game_id
+        for field, value in snapshot["state"].items():
+            setattr(game.state, field, copy.copy(value))
+        for location, codes in snapshot["game_piles"]:
+            setattr(game.cards, cls.Pile_Objects[cls.Card_Pile_ID(location)],
+                    [Card.from_code(code) for code in codes])
+        for player_id, piles in snapshot["players"]:
+            player = Player(player_id)
+            for location, codes in piles:
+                setattr(player, player.Pile_Objects[player.Card_Pile_ID(location)],
+                        [Card.from_code(code) for code in codes])
+            game.add_player(player)
+        game.__update_pile_sizes()
+        game.set_this_player(this_player_id)
+        return game
+
+    def __log_move(self, action, player_id, cards=()):
+        """counts a successful action as the next turn, and keeps it to be written to
+           game_moves on the next save"""
+        self.state.current_turn_number += 1
+        self.__unsaved_moves.append(Logged_Move(self.state.current_turn_number, player_id,
+                                                action, tuple(cards)))
+
+    def __logged_cards(self, player, cards):
+        """returns (card location short name, card code) for each of cards (descriptions such
+           as "h-0" of player's cards), so the move log doesn't depend on the order of the pile"""
+        return [(card[0], player.get_cards(Card_Types.Card_Type_From_Code[card[0]])[int(card[2:])].code)
+                for card in cards]
+
+    def unsaved_moves(self):
+        """the Logged_Moves played since the game was last loaded or saved"""
+        return tuple(self.__unsaved_moves)
+
+    def deal(self, rng=None, deck=None):
+        """creates a new deck of cards, deals to each player, then puts the remaining cards in the pick stack.
+           Pass a random.Random as rng for a repeatable deal, or an already shuffled Deck as deck
+           to deal exactly that (e.g. to replay a game from its move log)"""
         logger.debug("starting deal")
-        new_deck = Deck()
+        if deck is not None:
+            new_deck = deck
+        else:
+            if rng is None:
+                # the deck order mustn't be guessable from the cards a player is dealt;
+                # the move log keeps the order it was shuffled into, which is all a replay needs
+                rng = random.SystemRandom()
+            new_deck = Deck(number_of_decks=self.state.number_of_decks, rng=rng)
+        self.__log_move("deal", None, [card.code for card in new_deck.cards])
 
         # cards are shuffled so we just issue them sequentially
         for _ in range(self.state.number_face_down_cards):
@@ -286,98 +446,137 @@ class Game(object):
         self.cards.pile_deck = new_deck.cards
         self.__update_pile_sizes()
         self.state.deal_done = True
+        # every deal is snapshotted, so a replay knows who was dealt what
+        self.__unsaved_snapshots.append((self.state.current_turn_number, self.checksum(), self.snapshot()))
         logger.debug("Deal done")
 
-    def __write_state_to_database(self, session):
+    def __state_to_store(self, with_cards=True):
+        """returns the values of the columns in the games table which represent this game -
+           without the game's cards unless with_cards"""
+        if not with_cards:
+            state_to_store = self.__state_to_store()
+            del state_to_store["packed_cards"], state_to_store["cards_move_number"]
+            return state_to_store
+        return {"game_finished": self.state.game_finished,
+                "number_of_players_requested": self.state.number_of_players_requested,
+                "game_ready_to_start": self.ready_to_start,
+                "game_checksum": self.checksum(),
+                "players_finished": json.dumps(self.state.players_finished),
+                "play_on_anything_cards": json.dumps(self.state.play_on_anything_cards),
+                "play_order": json.dumps(self.state.play_order),
+                "less_than_card": self.state.less_than_card,
+                "transparent_card": self.state.transparent_card,
+                "burn_card": self.state.burn_card,
+                "reset_card": self.state.reset_card,
+                "number_of_decks": self.state.number_of_decks,
+                "number_face_down_cards": self.state.number_face_down_cards,
+                "number_hand_cards": self.state.number_hand_cards,
+                "current_turn_number": self.state.current_turn_number,
+                "players_ready_to_start": json.dumps(self.state.players_ready_to_start),
+                "deal_done": self.state.deal_done,
+                "packed_cards": self.__packed_game_cards(),
+                "cards_move_number": self.state.current_turn_number}
+
+    def __packed_game_cards(self):
+        """returns the game piles packed for the games row, or None if cards are stored as rows"""
+        if self.card_storage != Card_Storage.PACKED:
+            return None
+        return card_storage.pack_piles({pile_id.value: getattr(self.cards, self.Pile_Objects[pile_id])
+                                        for pile_id in self.Card_Pile_ID})
+
+    def __write_state_to_database(self, session, expected_checksum=None, with_cards=True):
         c = common_db.Common_DB()
+        state_to_store = self.__state_to_store(with_cards or not self.state.game_id)
         if not self.state.game_id:
             logger.debug("save - no current game_id")
-            querystring = "INSERT INTO games (game_finished, players_requested, game_ready_to_start, game_checksum, players_finished, play_on_anything_cards, play_order, less_than_card, transparent_card, burn_card, reset_card, number_of_decks, number_face_down_cards, number_hand_cards, current_turn_number, players_ready_to_start, deal_done) VALUES (:game_finished, :number_of_players_requested, :game_ready_to_start, :game_checksum, :players_finished, :play_on_anything_cards,:play_order,:less_than_card,:transparent_card,:burn_card,:reset_card,:number_of_decks,:number_face_down_cards,:number_hand_cards,:current_turn_number,:players_ready_to_start, :deal_done)"
-            result = c.execute(session, querystring,
-                               game_finished=self.state.game_finished,
-                               number_of_players_requested=self.state.number_of_players_requested,
-                               game_ready_to_start=self.ready_to_start,
-                               game_checksum=self.checksum(),
-                               players_finished=json.dumps(self.state.players_finished),
-                               play_on_anything_cards=json.dumps(self.state.play_on_anything_cards),
-                               play_order=json.dumps(self.state.play_order),
-                               less_than_card=self.state.less_than_card,
-                               transparent_card=self.state.transparent_card,
-                               burn_card=self.state.burn_card,
-                               reset_card=self.state.reset_card,
-                               number_of_decks=self.state.number_of_decks,
-                               number_face_down_cards=self.state.number_face_down_cards,
-                               number_hand_cards=self.state.number_hand_cards,
-                               current_turn_number=self.state.current_turn_number,
-                               players_ready_to_start=json.dumps(self.state.players_ready_to_start),
-                               deal_done=self.state.deal_done)
+            querystring = "INSERT INTO games (game_finished, players_requested, game_ready_to_start, game_checksum, players_finished, play_on_anything_cards, play_order, less_than_card, transparent_card, burn_card, reset_card, number_of_decks, number_face_down_cards, number_hand_cards, current_turn_number, players_ready_to_start, deal_done, packed_cards, cards_move_number) VALUES (:game_finished, :number_of_players_requested, :game_ready_to_start, :game_checksum, :players_finished, :play_on_anything_cards,:play_order,:less_than_card,:transparent_card,:burn_card,:reset_card,:number_of_decks,:number_face_down_cards,:number_hand_cards,:current_turn_number,:players_ready_to_start, :deal_done, :packed_cards, :cards_move_number)"
+            result = c.execute(session, querystring, **state_to_store)
+        elif state_to_store == self.__saved_state:
+            logger.debug("save - games row unchanged, skipping update")
+            return True, "Game state unchanged"
         else:
             logger.debug("save - with game_id")
-            querystring = "UPDATE games SET game_finished = :game_finished, players_requested = :number_of_players_requested, game_ready_to_start = :game_ready_to_start, game_checksum = :game_checksum, players_finished = :players_finished, play_on_anything_cards = :play_on_anything_cards, play_order = :play_order, less_than_card = :less_than_card, transparent_card = :transparent_card, burn_card = :burn_card, reset_card = :reset_card, number_of_decks = :number_of_decks, number_face_down_cards = :number_face_down_cards ,number_hand_cards = :number_hand_cards,current_turn_number = :current_turn_number, players_ready_to_start = :players_ready_to_start, deal_done = :deal_done WHERE gameid = :game_id"
-            result = c.execute(session, querystring,
-                               game_finished=self.state.game_finished,
-                               number_of_players_requested=self.state.number_of_players_requested,
-                               game_ready_to_start=self.ready_to_start,
-                               game_checksum=self.checksum(),
-                               players_finished=json.dumps(self.state.players_finished),
-                               play_on_anything_cards=json.dumps(self.state.play_on_anything_cards),
-                               play_order=json.dumps(self.state.play_order),
-                               less_than_card=self.state.less_than_card,
-                               transparent_card=self.state.transparent_card,
-                               burn_card=self.state.burn_card,
-                               reset_card=self.state.reset_card,
-                               number_of_decks=self.state.number_of_decks,
-                               number_face_down_cards=self.state.number_face_down_cards,
-                               number_hand_cards=self.state.number_hand_cards,
-                               current_turn_number=self.state.current_turn_number,
-                               players_ready_to_start=json.dumps(self.state.players_ready_to_start),
-                               deal_done=self.state.deal_done,
-                               game_id=self.state.game_id)
+            querystring = "UPDATE games SET game_finished = :game_finished, players_requested = :number_of_players_requested, game_ready_to_start = :game_ready_to_start, game_checksum = :game_checksum, players_finished = :players_finished, play_on_anything_cards = :play_on_anything_cards, play_order = :play_order, less_than_card = :less_than_card, transparent_card = :transparent_card, burn_card = :burn_card, reset_card = :reset_card, number_of_decks = :number_of_decks, number_face_down_cards = :number_face_down_cards ,number_hand_cards = :number_hand_cards,current_turn_number = :current_turn_number, players_ready_to_start = :players_ready_to_start, deal_done = :deal_done"
+            if "packed_cards" in state_to_store:
+                querystring += ", packed_cards = :packed_cards, cards_move_number = :cards_move_number"
+            querystring += " WHERE gameid = :game_id"
+            if expected_checksum is None:
+                result = c.execute(session, querystring, game_id=self.state.game_id, **state_to_store)
+            else:
+                # only overwrite the version of the game this one was loaded from
+                result = c.execute(session, querystring + " AND game_checksum = :expected_checksum",
+                                   game_id=self.state.game_id, expected_checksum=expected_checksum,
+                                   **state_to_store)
+                if not result:
+                    logger.info("game %s changed since it was loaded from checksum %s",
+                                self.state.game_id, expected_checksum)
+                    return False, SAVE_CONFLICT
 
         if result:
             message = f"Game saved with ID {int(result)}"
             if not(self.state.game_id):
                 self.state.game_id = int(result)
+            self.__saved_state = state_to_store
+            self.database_checksum = state_to_store["game_checksum"]
+            if "cards_move_number" in state_to_store:
+                self.__cards_move_number = state_to_store["cards_move_number"]
         else:
             message = "Unable to save game state"
 
         return result, message
 
-    def __get_list_of_game_cards_to_store(self):
-        cards_to_store = []
-        for pile_id in self.Card_Pile_ID:
-            # iterate through each pile ID
-            # append the list of cards
-            logger.debug("saving pile_id %s", pile_id)
-            relevant_pile = getattr(self.cards, self.Pile_Objects[pile_id])
-
-            cards_to_store.extend([ f"({self.state.game_id}, NULL, {pile_id.value}, {card.suit}, {card.rank})" for card in relevant_pile])
-            logger.debug("cards_to_store now includes: %s", cards_to_store)
-        return cards_to_store
+    def __current_piles(self):
+        """returns the contents of each game pile, in a form which can be compared with __saved_piles"""
+        return {pile_id: tuple(getattr(self.cards, self.Pile_Objects[pile_id]))
+                for pile_id in self.Card_Pile_ID}
 
-    def __store_game_cards(self, session):
+    def __save_game_cards(self, session):
+        """rewrites the game_cards rows for the game piles which have changed since
+           the game was last loaded or saved, leaving the others alone"""
         c = common_db.Common_DB()
-        cards_to_store = self.__get_list_of_game_cards_to_store()
-        if not cards_to_store:
-            logger.debug("no cards to store")
-            return True,  "no cards to store"
-
-        logger.debug("starting to save game cards")
-        cards_to_store = ", ".join(cards_to_store)
-        result = c.execute(
-            session, f"INSERT INTO game_cards (game_id, player_id, card_location, card_suit, card_rank) VALUES {cards_to_store};")
-        if not result:
-            message = "failed to store game gards, rolling back"
-            retval = False
+        if self.card_storage == Card_Storage.PACKED:
+            # the game piles are written with the games row
+            if self.__loaded_storage == Card_Storage.ROWS:
+                # switching storage - remove the rows for every pile in this game
+                result = c.execute(session, "DELETE FROM game_cards WHERE game_id = :game_id",
+                                   game_id=self.state.game_id)
+                if result == None:
+                    return False, "unable to delete existing game cards"
+            return True, "game cards packed in games row"
+
+        current_piles = self.__current_piles()
+        if self.__saved_piles is None:
+            dirty_piles = list(self.Card_Pile_ID)
         else:
-            message = "saved game cards"
-            retval = True
-        return retval, message
+            dirty_piles = [pile_id for pile_id in self.Card_Pile_ID
+                           if current_piles[pile_id] != self.__saved_piles[pile_id]]
+        if not dirty_piles:
+            return True, "no game cards changed"
+
+        logger.debug("saving game piles %s", dirty_piles)
+        result = c.execute(session, "DELETE FROM game_cards WHERE game_id = :game_id AND player_id IS NULL AND card_location IN :card_locations",
+                           game_id=self.state.game_id,
+                           card_locations=[pile_id.value for pile_id in dirty_piles])
+        if result == None:
+            # some kind of exception
+            return False, "unable to delete existing game cards"
+
+        cards_to_store = [(self.state.game_id, None, pile_id.value, card.suit, card.rank, card.deck)
+                          for pile_id in dirty_piles
+                          for card in current_piles[pile_id]]
+        result = c.insert_many(session, "game_cards",
+                               ["game_id", "player_id", "card_location", "card_suit", "card_rank", "card_deck"],
+                               cards_to_store)
+        if not result:
+            return False, "failed to store game gards, rolling back"
+
+        self.__saved_piles = current_piles
+        return True, f"saved {len(cards_to_store)} cards in {len(dirty_piles)} game piles"
 
     def __save_players(self, session):
         for player in self.players:
-            logger.debug("saving player: %s", jsonpickle.dumps(player, unpicklable=True))
-            save_result, message = player.save(session, self.state.game_id)
+            logger.debug("saving player %s", player.ID)
+            save_result, message = player.save(session, self.state.game_id, self.card_storage)
             if not save_result:
                 return False, message
             # store a reference to this player's object on the game itself
@@ -385,55 +584,103 @@ class Game(object):
                 self.this_player = player
         return True, "Players all saved successfully"
 
-    def __delete_existing_game_cards(self, session):
+    def __snapshots_due(self):
+        """the (move number, checksum, snapshot)s to store with the moves played since the last
+           save: each deal since, and the game as it is now if it's passed another SNAPSHOT_INTERVAL moves
+           or it's not known which move the stored cards are as of - a game saved before
+           cards_move_number was added may have no snapshot for load to replay from"""
+        snapshots = list(self.__unsaved_snapshots)
+        if self.__unsaved_moves:
+            first_move, last_move = self.__unsaved_moves[0].move_number, self.__unsaved_moves[-1].move_number
+            if ((last_move // SNAPSHOT_INTERVAL > (first_move - 1) // SNAPSHOT_INTERVAL or
+                 self.state.game_id and self.__cards_move_number is None) and
+                    not (snapshots and snapshots[-1][0] == last_move)):
+                snapshots.append((last_move, self.checksum(), self.snapshot()))
+        return snapshots
+
+    def __cards_due(self, snapshots):
+        """whether a save writes the cards. They're left as they are when everything which
+           has changed since they were written is in the move log (see load)"""
+        return (not self.state.game_id or
+                self.__cards_move_number is None or
+                self.__loaded_storage != self.card_storage or
+                # changes which aren't moves, such as players joining
+                not self.__unsaved_moves or
+                bool(snapshots))
+
+    def __save_moves(self, session, snapshots):
+        """appends the actions played since the last save to game_moves, and snapshots to game_snapshots"""
+        if not self.__unsaved_moves:
+            return True, "no moves to log"
         c = common_db.Common_DB()
-        result = c.execute(session, f"DELETE FROM game_cards WHERE game_id = {self.state.game_id} and player_id is null;")
-        if result == None:
-            # some kind of exception
-            message = "unable to delete existing game cards"
-            return False, message
-        return True, f"Old game cards removed from DB, {result} records affected"
+        result = c.insert_many(session, "game_moves",
+                               ["game_id", "move_number", "player_id", "action", "cards"],
+                               [(self.state.game_id, move.move_number, move.player_id, move.action,
+                                 json.dumps(move.cards))
+                                for move in self.__unsaved_moves])
+        if not result:
+            return False, "unable to log moves"
+
+        first_move, last_move = self.__unsaved_moves[0].move_number, self.__unsaved_moves[-1].move_number
+        result = c.insert_many(session, "game_snapshots",
+                               ["game_id", "move_number", "game_checksum", "snapshot"],
+                               [(self.state.game_id, move_number, checksum, json.dumps(snapshot))
+                                for move_number, checksum, snapshot in snapshots])
+        if not result:
+            return False, "unable to store snapshot"
+        message = f"logged moves {first_move} to {last_move}"
+        self.__unsaved_moves = []
+        self.__unsaved_snapshots = []
+        return True, message
+
+    def __forget_saved_state(self):
+        """after a failed save we can't know what's in the database, so the next
+           save rewrites everything"""
+        self.__saved_state = None
+        self.__saved_piles = None
+        self.__cards_move_number = None
+        self.database_checksum = None
+        for player in self.players:
+            player.forget_saved_cards()
 
-    def save(self, session):
+    def save(self, session, expected_checksum=None):
         """saves the current state of the game, using a transaction to ensure
            that we can roll back if not successful. If this is a new game
-           without an ID, it creates one, otherwise it updates the existing one"""
+           without an ID, it creates one, otherwise it updates the existing one.
+           Only the games row and card piles which have changed since the game
+           was loaded or last saved are written.
+           If expected_checksum is given the save only goes ahead if the game's
+           checksum in the database still matches it, otherwise it returns
+           (False, SAVE_CONFLICT) and the session should be rolled back.
+           The actions played since the last load or save are appended to game_moves.
+           Between snapshots (see SNAPSHOT_INTERVAL) the cards aren't written at all:
+           a move is saved as the games row and its game_moves row, and load replays
+           the moves made since the cards were written."""
         logger.info("beginning game save")
 
-        write_state_result, message = self.__write_state_to_database(session)
-
-        if not write_state_result:
-            logger.error(message)
-            return False, message
-        
-        # stored ok - log for debug
-        logger.debug(message)
-
-        delete_cards, message = self.__delete_existing_game_cards(session)
-
-        if not delete_cards:
-            logger.error(message)
-            return False, message
-        
-        # stored ok - log for debug
-        logger.debug(message)
-
-        store_cards, message = self.__store_game_cards(session)
-        if not store_cards:
-            logger.error(message)
-            return False, message
-        
-        # stored ok - log for debug
-        logger.debug(message)
-
-        player_save, message = self.__save_players(session)
-        if not player_save:
-            logger.error(message)
-            return False, message
-
-        # stored ok - log for debug
-        logger.debug(message)
+        if self.__loaded_storage and self.__loaded_storage != self.card_storage:
+            logger.info("changing card storage from %s to %s", self.__loaded_storage, self.card_storage)
+            self.__saved_state = None
+            self.__saved_piles = None
+            for player in self.players:
+                player.forget_saved_cards()
+
+        snapshots = self.__snapshots_due()
+        with_cards = self.__cards_due(snapshots)
+        save_steps = [lambda session: self.__write_state_to_database(session, expected_checksum, with_cards)]
+        if with_cards:
+            save_steps += [self.__save_game_cards, self.__save_players]
+        save_steps.append(lambda session: self.__save_moves(session, snapshots))
+        for save_step in save_steps:
+            step_result, message = save_step(session)
+            if not step_result:
+                logger.error(message)
+                self.__forget_saved_state()
+                return False, message
+            # stored ok - log for debug
+            logger.debug(message)
 
+        self.__loaded_storage = self.card_storage
         # return the game_id for future use
         logger.debug("game saved successfully")
         return True, "game saved successfully"
@@ -445,7 +692,9 @@ class Game(object):
         self.state.play_order.append(last_player)
 
     def load(self, session):
-        """loads the configuration of the game defined by state.game_id"""
+        """loads the configuration of the game defined by state.game_id. Returns False if
+           its cards can't be brought up to date from the move log, in which case the game
+           mustn't be played or saved"""
         logger.debug("starting game load")
         if not self.state.game_id:
             logger.error("tried to load game without setting game_id")
@@ -456,14 +705,17 @@ class Game(object):
             raise ValueError(
                 'tried to load game without setting ID of current player or it doesnt exist in current instantiation.')
 
+        self.__unsaved_moves = []
+        self.__unsaved_snapshots = []
+
         # load game config
-        # fields not retrieved: `last_move_at`, `gameid`,`checksum`,`game_ready_to_start`
+        # fields not retrieved: `last_move_at`, `gameid`, `game_ready_to_start`
         c = common_db.Common_DB()
 
-        config = c.execute(session, 'SELECT "game_finished", "players_requested", "players_finished", "play_on_anything_cards", "play_order", "less_than_card","transparent_card","burn_card","reset_card","number_of_decks","number_face_down_cards","number_hand_cards","current_turn_number","last_player", "players_ready_to_start", "deal_done" FROM games WHERE gameid = :game_id',
+        config = c.execute(session, 'SELECT "game_finished", "players_requested", "players_finished", "play_on_anything_cards", "play_order", "less_than_card","transparent_card","burn_card","reset_card","number_of_decks","number_face_down_cards","number_hand_cards","current_turn_number","last_player", "players_ready_to_start", "deal_done", "packed_cards", "game_checksum", "cards_move_number" FROM games WHERE gameid = :game_id',
                            game_id=self.state.game_id)
         config = config[0]
-        logger.debug("config loaded from db: %s", jsonpickle.dumps(config, unpicklable=False))
+        logger.debug("config loaded from db: %s", {key: value for key, value in config.items() if key != "packed_cards"})
         self.state.game_finished = config["game_finished"]
         self.state.number_of_players_requested = config["players_requested"]
         self.state.players_finished = json.loads(config["players_finished"])
@@ -476,29 +728,102 @@ class Game(object):
         self.state.number_of_decks = config["number_of_decks"]
         self.state.number_face_down_cards = config["number_face_down_cards"]
         self.state.number_hand_cards = config["number_hand_cards"]
-        self.state.current_turn_number = config["current_turn_number"]
+        self.state.current_turn_number = config["current_turn_number"] or 0
         self.state.players_ready_to_start = json.loads(config["players_ready_to_start"])
         self.state.deal_done = config["deal_done"]
+        self.database_checksum = config["game_checksum"]
 
-        # load decks
         logger.debug("reconstructing decks")
+        if config["packed_cards"] is not None:
+            self.__loaded_storage = Card_Storage.PACKED
+            game_piles, player_piles = self.__load_packed_cards(session, config["packed_cards"])
+        else:
+            self.__loaded_storage = Card_Storage.ROWS
+            game_piles, player_piles = self.__load_card_rows(session)
+
         for pile_id in self.Card_Pile_ID:
-            setattr(self.cards, self.Pile_Objects[pile_id], self.__load_cards_from_database(
-                pile_id.value, self.state.game_id, session))
+            setattr(self.cards, self.Pile_Objects[pile_id], game_piles.get(pile_id.value, []))
+        self.__saved_piles = self.__current_piles()
 
         self.__update_pile_sizes()
 
         logger.debug("loading players, if any")
         for player in self.players:
-            if not player.load(session, self.state.game_id):
-                logger.error("Unable to load player: %s", player.ID)
-                return False
+            player.set_cards(player_piles.get(player.ID, {}))
             # store a reference to this player's object on the game itself
             if player.ID == self.state.this_player_id:
                 self.this_player = player
+
+        # games saved before cards_move_number was added have their cards as of the last move,
+        # and it's left as None so that the next save writes them (see __cards_due)
+        self.__cards_move_number = config["cards_move_number"]
+        if self.__cards_move_number is not None and self.__cards_move_number < self.state.current_turn_number:
+            if not self.__replay_cards(session):
+                # so that nothing can be saved over the game on the strength of these cards
+                self.database_checksum = None
+                return False
+        self.__saved_state = self.__state_to_store(self.__cards_move_number in (None, self.state.current_turn_number))
         logger.debug("completed game load")
         return True
 
+    def __replay_cards(self, session):
+        """replaces the cards just loaded, which are as of move __cards_move_number, with the
+           cards as they are after the moves since. What was loaded stays as what's saved, so
+           the next save which writes cards writes the piles which have changed since"""
+        # move_log imports this module
+        import move_log
+        logger.debug("replaying game %s from move %s to %s", self.state.game_id,
+                     self.__cards_move_number, self.state.current_turn_number)
+        try:
+            replayed = move_log.rebuild_game(session, self.state.game_id)
+        except ValueError as e:
+            logger.error("unable to replay the cards of game %s: %s", self.state.game_id, e)
+            return False
+        for pile_id in self.Card_Pile_ID:
+            setattr(self.cards, self.Pile_Objects[pile_id], list(getattr(replayed.cards, self.Pile_Objects[pile_id])))
+        replayed_players = {player.ID: player for player in replayed.players}
+        for player in self.players:
+            replayed_player = replayed_players[player.ID]
+            saved_piles = player.saved_piles
+            # sorted as if they'd been loaded
+            player.set_cards({pile_id.value: getattr(replayed_player, player.Pile_Objects[pile_id])
+                              for pile_id in player.Card_Pile_ID})
+            player.saved_piles = saved_piles
+        self.__update_pile_sizes()
+        if self.checksum() != self.database_checksum:
+            logger.error("replaying game %s to move %s doesn't give its stored checksum",
+                         self.state.game_id, self.state.current_turn_number)
+            return False
+        return True
+
+    def __load_card_rows(self, session):
+        """loads every card for this game - the game piles and all the players' piles - in one
+           query, returning dicts of {location: cards} for the game and {player ID: {location: cards}}"""
+        c = common_db.Common_DB()
+        cards = c.execute(session,
+                          "SELECT player_id, card_location, card_suit, card_rank, card_deck FROM game_cards WHERE game_id = :game_id ORDER BY id",
+                          game_id=self.state.game_id)
+        logger.debug(f"found {len(cards)} cards")
+        game_piles = {}
+        player_piles = {}
+        for card in cards:
+            if card["player_id"] is None:
+                piles = game_piles
+            else:
+                piles = player_piles.setdefault(card["player_id"], {})
+            piles.setdefault(card["card_location"], []).append(Card(card["card_suit"], card["card_rank"], card["card_deck"] or 0))
+        return game_piles, player_piles
+
+    def __load_packed_cards(self, session, packed_game_cards):
+        """unpacks the game piles from the games row and loads each player's packed piles, returning
+           the same as __load_card_rows"""
+        c = common_db.Common_DB()
+        players = c.execute(session, "SELECT player_id, packed_cards FROM player_game WHERE game_id = :game_id",
+                            game_id=self.state.game_id)
+        player_piles = {player["player_id"]: card_storage.unpack_piles(player["packed_cards"])
+                        for player in players if player["packed_cards"] is not None}
+        return card_storage.unpack_piles(packed_game_cards), player_piles
+
     def __update_pile_sizes(self):
         """updates the summary count of each pile size, and copies the played pile to the active state"""
         for pile_id in self.Card_Pile_ID:
@@ -628,6 +953,48 @@ class Game(object):
             raise ValueError("Unable to calculate game allowed moves")
         return response
 
+    def legal_moves(self):
+        """lists every Move this player can make right now - see iter_legal_moves"""
+        return list(self.iter_legal_moves())
+
+    def iter_legal_moves(self):
+        """generates every Move this player can make right now, each of which can be
+           played with play_action(*move):
+            - while swapping: no_swap, and every way of swapping some of their hand
+              cards with the same number of face up cards
+            - on their turn: every set of same rank cards they can play from the
+              cards they're playing from, or any single face down card, or else pick
+            - otherwise nothing"""
+        allowed_actions = self.calculate_player_allowed_actions()
+        action = allowed_actions["allowed_action"]
+        player = self.this_player
+        if action == "swap":
+            yield Move("no_swap", None)
+            for number in range(1, min(len(player.hand), len(player.face_up)) + 1):
+                for hand_indexes in combinations(range(len(player.hand)), number):
+                    hand = tuple(describe_card_at(Card_Types.CARD_HAND, i) for i in hand_indexes)
+                    for face_up_indexes in combinations(range(len(player.face_up)), number):
+                        yield Move("swap", hand + tuple(describe_card_at(Card_Types.CARD_FACE_UP, i)
+                                                        for i in face_up_indexes))
+        elif action == "pick" and allowed_actions["is_next_player"]:
+            yield Move("pick", None)
+        elif action == "play" and allowed_actions["is_next_player"]:
+            card_type = Card_Types.Card_Type_From_Code[allowed_actions["allowed_cards"]]
+            cards = player.get_cards(card_type)
+            if card_type == Card_Types.CARD_FACE_DOWN:
+                for i in range(len(cards)):
+                    yield Move("play", (describe_card_at(card_type, i),))
+                return
+            indexes_by_rank = {}
+            for i, card in enumerate(cards):
+                indexes_by_rank.setdefault(card.rank, []).append(i)
+            for indexes in indexes_by_rank.values():
+                if not self.__can_play_cards([cards[indexes[0]]]):
+                    continue
+                for number in range(1, len(indexes) + 1):
+                    for played_indexes in combinations(indexes, number):
+                        yield Move("play", tuple(describe_card_at(card_type, i) for i in played_indexes))
+
     def work_out_who_plays_first(self):
         """ looks at all the players 'hand' cards and finds the one with the lowest rank.
             that player starts the game, the others proceed in numerical order from them.
@@ -649,6 +1016,21 @@ class Game(object):
 
         logger.debug(f"Set player {lowest_player} to start")
 
+    def play_action(self, action, cards=None):
+        """plays action ("swap", "no_swap", "play" or "pick") for this player,
+           with cards (a list of card descriptions such as "h-0") where needed.
+           Returns the response from the action"""
+        if action == "swap":
+            return self.swap_cards(cards, self.this_player)
+        elif action == "no_swap":
+            return self.play_no_swap()
+        elif action == "play":
+            return self.play_move(cards)
+        elif action == "pick":
+            return self.play_pick_up()
+        return {'action': action, 'action_result': False,
+                'action_message': "unknown action :" + action}
+
     def play_no_swap(self):
         """plays the move 'dont swap, ready to start' at the beginning of the game"""
         if self.state.this_player_id in self.state.players_ready_to_start:
@@ -659,6 +1041,7 @@ class Game(object):
         logger.debug("play_no_swap -> adding user to players_ready_to_start")
 
         self.state.players_ready_to_start.append(self.state.this_player_id)
+        self.__log_move("no_swap", self.state.this_player_id)
         if self.ready_to_start:
             logger.debug("play_no_swap -> ready_to_start")
             self.work_out_who_plays_first()
@@ -677,6 +1060,7 @@ class Game(object):
             # we're allowed to pick up cards right now
             logger.debug("allowed_actions ok - execute __pick_up_cards")
             response = self.__pick_up_cards()
+            self.__log_move("pick", self.state.this_player_id)
         else:
             logger.debug("Not allowed to pick up right now")
             response = {'action': 'pick', 'action_result': False,
@@ -686,8 +1070,9 @@ class Game(object):
     def __pick_up_cards(self):
             # --> not relevant?? card_type, cards  = self.this_player.which_player_cards_can_player_use()
             # when we pick up cards, they always go in our hand from the played pile
-        logger.debug("Picking up cards %s", jsonpickle.encode(
-            self.cards.pile_played, unpicklable=False))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Picking up cards %s", jsonpickle.encode(
+                self.cards.pile_played, unpicklable=False))
         self.this_player.add_cards_to_player_cards(self.cards.pile_played, Card_Types.CARD_HAND)
         self.cards.pile_played = []
         self.__update_pile_sizes()
@@ -712,7 +1097,7 @@ class Game(object):
                     allowed_actions["allowed_cards"])
 
                 # validate that these cards are in this user's hand and are all the same type (face down, up, hand)
-                response, message, validated_cards, card_type = self.__validate_cards_exist_in_type(cards_to_play, allowed_card_type)
+                response, message, validated_cards, card_type, card_indexes = self.__validate_cards_exist_in_type(cards_to_play, allowed_card_type)
                 if not response:
                     logger.debug("Cannot play: %s", message)
                     return {'action': 'play',
@@ -728,16 +1113,20 @@ class Game(object):
                 can_play_cards = self.__can_play_cards(validated_cards)
 
                 if can_play_cards:
-                    response = self.__play_validated_cards(validated_cards, card_type)
+                    self.__log_move("play", self.state.this_player_id,
+                                    self.__logged_cards(self.this_player, cards_to_play))
+                    response = self.__play_validated_cards(validated_cards, card_type, card_indexes)
                 else:
                     if card_type == Card_Types.CARD_FACE_DOWN:
                         # tried to play a face down card but lost
+                        self.__log_move("play", self.state.this_player_id,
+                                        self.__logged_cards(self.this_player, cards_to_play))
                         # move this card to the player's hand
                         self.this_player.add_cards_to_player_cards(
                             validated_cards, Card_Types.CARD_HAND)
                         # pick up the rest of the played cards
                         self.__pick_up_cards()
-                        self.this_player.remove_cards_from_player_cards(validated_cards, card_type)
+                        self.this_player.remove_cards_at_positions(card_indexes, card_type)
                         response = {'action': 'play',
                                     'action_result': True,
                                     'action_message': 'You played a face down card but lost'}
@@ -752,18 +1141,20 @@ class Game(object):
         self.__update_pile_sizes()
         return response
 
-    def __play_validated_cards(self, validated_cards, card_type):
-        """plays a set of validated_cards of type card_type for the current player"""
+    def __play_validated_cards(self, validated_cards, card_type, card_indexes):
+        """plays a set of validated_cards of type card_type, found at card_indexes in
+           that pile, for the current player"""
         # great - play teh cards!
         response = {'action': 'play',
                     'action_result': True}
         just_run_out_of_cards = False
         self.cards.pile_played.extend(validated_cards)
         # remove these cards from teh player's hand/hidden/up cards and refill their hand if there are cards left in teh deck
-        self.this_player.remove_cards_from_player_cards(validated_cards, card_type)
-        logger.debug("Moved cards %s from player's pile %s",
-                     jsonpickle.encode(validated_cards, unpicklable=False),
-                     card_type)
+        self.this_player.remove_cards_at_positions(card_indexes, card_type)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Moved cards %s from player's pile %s",
+                         jsonpickle.encode(validated_cards, unpicklable=False),
+                         card_type)
         if card_type == Card_Types.CARD_HAND:
             # replenish the player's hand from the deck
             # while there are still cards in the pile, and
@@ -840,6 +1231,14 @@ class Game(object):
             response = False,
             message = f'You can only play one face down card at a time'
 
+        elif len(set(card_indexes)) != len(card_indexes):
+            response = False
+            message = 'You can only play each card once in a move.'
+
+        elif min(card_indexes) < 0:
+            response = False
+            message = 'Attempted to play card with a negative index.'
+
         elif self.__check_card_index_over_deck_length(max(card_indexes), card_type):
             response = False,
             message = f'Attempted to play card which is above face card count in __validate_cards_exist_in_type.'
@@ -853,24 +1252,14 @@ class Game(object):
                 cards_being_played_from[card_location] for card_location in card_indexes)
         else:
             validated_cards = None
-        return response, message, validated_cards, card_type
+        return response, message, validated_cards, card_type, card_indexes
 
     def __clears_deck(self, played_pile):
-        all_match = False
-        if len(played_pile) > 3:
-            pile_played = played_pile[-4:]
-            logger.debug("card1 %s, card2 %s, card3 %s, card4 %s", 
-                        pile_played[0], 
-                        pile_played[1],
-                        pile_played[2],
-                        pile_played[3])
-            all_match = (pile_played[0].rank == pile_played[1].rank) and (
-                pile_played[1].rank == pile_played[2].rank) and (pile_played[2].rank == pile_played[3].rank)
-        logger.debug("self.cards.pile_played[0].rank: %s, self.state.burn_card, %s",
-                     self.cards.pile_played[0].rank,
-                     self.state.burn_card)
-        return ((self.cards.pile_played[-1].rank == self.state.burn_card) or
-                all_match)
+        """the played pile is burnt by a burn card or by four cards of the same rank in a row"""
+        top_rank, run_length = played_pile.top_run()
+        logger.debug("top of played pile: %s card(s) of rank %s, burn card %s",
+                     run_length, top_rank, self.state.burn_card)
+        return top_rank == self.state.burn_card or run_length >= 4
 
     def __are_all_cards_same_rank(self, cards):
         """checks whether all the cards in a given set are all of the same value"""
@@ -882,27 +1271,26 @@ class Game(object):
             last_card = card
         return True
 
+    def can_play_cards(self, cards_to_check):
+        """whether any of cards_to_check can be played on the played pile"""
+        return self.__can_play_cards(cards_to_check)
+
     def __can_play_cards(self, cards_to_check):
         """checks whether the card/cards can be played e.g. does
            the user have ANY cards in the set cards_to_check which can be played
            on the current played stack, or can the cards in the user's play
            list be played on teh current played stack"""
-        logger.debug("__can_play_cards -> cards to check: %s",
-                     jsonpickle.encode(cards_to_check, unpicklable=False))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("__can_play_cards -> cards to check: %s",
+                         jsonpickle.encode(cards_to_check, unpicklable=False))
 
-        if not self.cards.pile_played:
+        # a transparent card takes the rank of the card below it
+        rank_to_beat = self.cards.pile_played.rank_to_beat(self.state.transparent_card)
+        if rank_to_beat is None:
             return True
-        else:
-            last_played_card = self.cards.pile_played[-1]
-            if last_played_card.rank == self.state.transparent_card:
-                return self.__can_play_cards(self.cards.pile_played[:-1])
-            else:
-                for card in cards_to_check:
-                    if (card.rank in self.state.play_on_anything_cards) or \
-                         (last_played_card.rank == self.state.less_than_card and card.rank <= last_played_card.rank) or \
-                         (card.rank >= last_played_card.rank):
-                        return True
-            return False
+        can_play_on = play_legality_table(tuple(self.state.play_on_anything_cards),
+                                          self.state.less_than_card)[rank_to_beat]
+        return any(can_play_on[card.rank] for card in cards_to_check)
 
     def __check_card_index_over_deck_length(self, card_index, card_type):
         """checks that the card at a given index actually exists in the given hand"""
@@ -968,6 +1356,7 @@ class Game(object):
                 response = {'action': 'swap', 'action_result': False,
                             'action_message': 'Select the face up and hand cards you want to swap.'}
             else:
+                self.__log_move("swap", player.ID, self.__logged_cards(player, cards_to_swap))
                 for i in range(len(hand_cards)):
                     player.hand[hand_cards[i]], player.face_up[face_cards[i]
                                                                ] = player.face_up[face_cards[i]], player.hand[hand_cards[i]]
@@ -979,18 +1368,24 @@ class Game(object):
         logger.debug("swap response: %s", jsonpickle.dumps(response, unpicklable=False))
         return response
 
-    def __load_cards_from_database(self, deck_type, game_id, session):
-        """load a set of cards and return them in a sorted list"""
-        c = common_db.Common_DB()
-        logger.debug(f"deck_type {deck_type}, game_id {game_id}")
-        cards = c.execute(session,
-                          "SELECT card_suit, card_rank FROM game_cards WHERE game_id = :game_id AND card_location = :deck_type",
-                          game_id=game_id, deck_type=deck_type)
-        cards_to_return = []
-        if len(cards) > 0:
-            logger.debug(f"found {len(cards)} cards")
-            cards_to_return.extend([Card(card["card_suit"], card["card_rank"]) for card in cards])
-        return cards_to_return
+
+def get_database_checksum(game_id):
+    """loads the 'checksum' field from the database for a given game and returns it"""
+    c = common_db.Common_DB()
+    config = c.execute(c.common_engine, 'SELECT game_checksum FROM games WHERE gameid = :game_id',
+                       game_id=game_id)
+    database_checksum = config[0]["game_checksum"]
+    return database_checksum
+
+
+def get_stored_version(game_id):
+    """returns what Game.stored_version() would be for a freshly loaded copy of a game,
+       with a single cheap query"""
+    c = common_db.Common_DB()
+    config = c.execute(c.common_engine, 'SELECT game_checksum, packed_cards IS NOT NULL AS packed FROM games WHERE gameid = :game_id',
+                       game_id=game_id)
+    storage = Card_Storage.PACKED if config[0]["packed"] else Card_Storage.ROWS
+    return config[0]["game_checksum"], storage
 
 
 def get_users_for_game(game_id, session):
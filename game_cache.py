@@ -0,0 +1,99 @@
+"""An in-process cache of loaded games, so that requests for a game which
+   hasn't changed since it was last loaded by this worker skip loading its
+   cards. Entries are checked against the cheap games.game_checksum column
+   (and the card storage mode) before use, so a change saved by any worker,
+   instance or migration is picked up.
+"""
+import copy
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# how many games each worker keeps; set GAME_CACHE_SIZE=0 to turn the cache off
+GAME_CACHE_SIZE = int(os.environ.get("GAME_CACHE_SIZE", 128))
+
+
+class Game_Cache(object):
+    """a bounded least-recently-used cache of Game objects, keyed by game_id and
+       validated against the version held in the database (see Game.stored_version).
+
+       The cache holds its own copies: callers always get a copy they are free
+       to change, and changing the game passed to put() doesn't affect the cache.
+
+        methods:
+        .get(game_id, stored_version) --> a copy of the cached game, or None
+            if it isn't cached or the database has changed since
+        .put(game) --> cache a copy of game under game.stored_version()
+        .invalidate(game_id) --> forget game_id
+        .stats() --> dict of size and hit/miss/eviction counters
+    """
+
+    def __init__(self, max_size=GAME_CACHE_SIZE):
+        self.max_size = max_size
+        self.__lock = threading.Lock()
+        # game_id --> (stored version, Game)
+        self.__games = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+        self.__stale = 0
+        self.__evictions = 0
+        self.__invalidations = 0
+
+    def get(self, game_id, stored_version):
+        with self.__lock:
+            entry = self.__games.get(game_id)
+            if entry is None:
+                self.__misses += 1
+                return None
+            version, game = entry
+            if version != stored_version:
+                # changed by someone else since we cached it
+                del self.__games[game_id]
+                self.__misses += 1
+                self.__stale += 1
+                return None
+            self.__games.move_to_end(game_id)
+            self.__hits += 1
+        logger.debug("game cache hit for game %s", game_id)
+        # cached games are never changed, so copying outside the lock is safe
+        return copy.deepcopy(game)
+
+    def put(self, game):
+        stored_version = game.stored_version()
+        if not self.max_size or game.state.game_id is None or stored_version is None:
+            return
+        entry = (stored_version, copy.deepcopy(game))
+        with self.__lock:
+            self.__games[game.state.game_id] = entry
+            self.__games.move_to_end(game.state.game_id)
+            while len(self.__games) > self.max_size:
+                evicted_id, _ = self.__games.popitem(last=False)
+                self.__evictions += 1
+                logger.debug("game cache evicted game %s", evicted_id)
+
+    def invalidate(self, game_id):
+        with self.__lock:
+            if self.__games.pop(game_id, None) is not None:
+                self.__invalidations += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__games.clear()
+
+    def stats(self):
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {"size": len(self.__games),
+                    "max_size": self.max_size,
+                    "hits": self.__hits,
+                    "misses": self.__misses,
+                    "stale": self.__stale,
+                    "evictions": self.__evictions,
+                    "invalidations": self.__invalidations,
+                    "hit_rate": self.__hits / lookups if lookups else None}
+
+
+cache = Game_Cache()
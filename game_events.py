@@ -0,0 +1,293 @@
+import abc
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import common_db
+
+logger = logging.getLogger(__name__)
+
+# the postgres NOTIFY channel used to announce saved games
+NOTIFY_CHANNEL = "game_changed"
+
+# how long a long-poll request is held before returning "no change" - this
+# must stay under the gunicorn worker timeout
+LONG_POLL_TIMEOUT = 20
+# while held, how often to re-check the database for changes made by other
+# workers or instances, when the notifier doesn't tell us about them
+DATABASE_POLL_INTERVAL = 5
+# how often a server-sent event stream sends a keepalive (and re-checks the database)
+EVENT_STREAM_HEARTBEAT = 15
+# how long an event stream stays open before the client has to reconnect, so that
+# abandoned streams don't hold a worker thread for ever
+EVENT_STREAM_LIFETIME = 60
+# each open event stream holds one of a worker's threads (gunicorn --threads in app.yaml).
+# Past this many, /gameevents is refused and the browser long polls instead, so that
+# streams can't take every thread and leave /playcards queueing behind them
+MAX_EVENT_STREAMS = int(os.environ.get("MAX_EVENT_STREAMS", 4))
+
+
+class Game_Change_Broadcaster(object):
+    """tracks the latest checksum saved for each game in this process and wakes
+       any requests which are waiting for that game to change
+
+        methods:
+        .publish(game_id, checksum) --> record a new checksum and wake waiters for that game
+        .wait_for_change(game_id, known_checksum, fetch_checksum, ...) --> block until the checksum
+            differs from known_checksum or the timeout passes
+        .subscribe(game_id, known_checksum, fetch_checksum, ...) --> generator of checksums for an event stream
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # game_id --> (number of publishes, latest checksum) in this process
+        self.__checksums = {}
+        # game_id --> [threading.Condition, number of waiters]
+        self.__waiters = {}
+
+    def publish(self, game_id, checksum):
+        """records checksum as the latest for game_id and wakes everything waiting on it"""
+        logger.debug("publish game %s checksum %s", game_id, checksum)
+        with self.__lock:
+            publishes, _ = self.__checksums.get(game_id, (0, None))
+            self.__checksums[game_id] = (publishes + 1, checksum)
+            waiting = self.__waiters.get(game_id)
+            if waiting:
+                waiting[0].notify_all()
+
+    def latest_checksum(self, game_id):
+        """returns the last checksum published for game_id in this process, or None"""
+        with self.__lock:
+            return self.__checksums.get(game_id, (0, None))[1]
+
+    def wait_for_change(self, game_id, known_checksum, fetch_checksum,
+                        timeout=LONG_POLL_TIMEOUT, poll_interval=DATABASE_POLL_INTERVAL):
+        """returns the current checksum for game_id as soon as it differs from known_checksum,
+           or known_checksum once timeout seconds have passed without a change.
+           fetch_checksum is a callable returning the checksum from the database. It's called
+           once at the start, then every poll_interval seconds while waiting"""
+        deadline = time.monotonic() + timeout
+        next_poll = time.monotonic() + poll_interval
+        with self.__lock:
+            waiting = self.__waiters.setdefault(game_id, [threading.Condition(self.__lock), 0])
+            waiting[1] += 1
+            # only publishes made after we started waiting count - an older one
+            # may be stale if another worker has since changed the game
+            publishes_seen = self.__checksums.get(game_id, (0, None))[0]
+        try:
+            checksum = fetch_checksum()
+            if checksum != known_checksum:
+                return checksum
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    return known_checksum
+                if now >= next_poll:
+                    checksum = fetch_checksum()
+                    if checksum != known_checksum:
+                        return checksum
+                    next_poll = now + poll_interval
+                with self.__lock:
+                    publishes, checksum = self.__checksums.get(game_id, (0, None))
+                    if publishes == publishes_seen:
+                        waiting[0].wait(min(deadline, next_poll) - now)
+                        publishes, checksum = self.__checksums.get(game_id, (0, None))
+                    if publishes != publishes_seen:
+                        publishes_seen = publishes
+                        if checksum != known_checksum:
+                            return checksum
+        finally:
+            with self.__lock:
+                waiting[1] -= 1
+                if not waiting[1]:
+                    del self.__waiters[game_id]
+
+    def subscribe(self, game_id, known_checksum, fetch_checksum,
+                  heartbeat=EVENT_STREAM_HEARTBEAT, poll_interval=DATABASE_POLL_INTERVAL):
+        """generator for an event stream: yields each new checksum for game_id as it
+           changes, or None every heartbeat seconds when nothing has changed"""
+        while True:
+            checksum = self.wait_for_change(game_id, known_checksum, fetch_checksum,
+                                            timeout=heartbeat, poll_interval=poll_interval)
+            if checksum != known_checksum:
+                known_checksum = checksum
+                yield checksum
+            else:
+                yield None
+
+
+broadcaster = Game_Change_Broadcaster()
+
+# the event streams open in this worker - see MAX_EVENT_STREAMS
+event_stream_slots = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+
+
+class Notifier(abc.ABC):
+    """announces saved games to the broadcaster in every worker. notify() is called inside
+       the transaction which saves the game and is only delivered if that transaction commits.
+       A single listener thread per worker receives the notifications and publishes them
+       until close() is called"""
+
+    # whether notifications reach workers other than the one which made the change
+    covers_other_workers = False
+
+    def __init__(self):
+        self.__listener = None
+        self.__listener_lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    @abc.abstractmethod
+    def notify(self, session, game_id, checksum):
+        """queues a notification on session, to be sent if it commits"""
+
+    @abc.abstractmethod
+    def listen(self):
+        """receives notifications and dispatches them until self.stopping is set"""
+
+    def start(self):
+        """starts the listener thread, if it isn't running already"""
+        with self.__listener_lock:
+            if self.__listener is None:
+                self.stopping.clear()
+                self.__listener = threading.Thread(target=self.listen, name=type(self).__name__, daemon=True)
+                self.__listener.start()
+
+    def close(self):
+        """stops the listener thread"""
+        with self.__listener_lock:
+            listener, self.__listener = self.__listener, None
+            self.stopping.set()
+        if listener is not None:
+            self.wake()
+            listener.join(timeout=5)
+
+    def wake(self):
+        """called by close() to interrupt listen(), if it could be blocked for a while"""
+
+    @staticmethod
+    def format_payload(game_id, checksum):
+        return f"{game_id}:{checksum}"
+
+    @staticmethod
+    def dispatch(payload):
+        """publishes a notification payload to the broadcaster"""
+        game_id, _, checksum = payload.partition(":")
+        try:
+            broadcaster.publish(int(game_id), checksum)
+        except ValueError:
+            logger.error("ignoring malformed game change notification '%s'", payload)
+
+
+class Postgres_Notifier(Notifier):
+    """sends notifications with pg_notify, and receives them on one LISTEN connection per worker"""
+
+    covers_other_workers = True
+    reconnect_delay = 5
+    # how long the listener waits for a notification before checking whether it's been closed
+    select_timeout = 5
+
+    def __init__(self, engine):
+        super().__init__()
+        self.__engine = engine
+
+    def notify(self, session, game_id, checksum):
+        c = common_db.Common_DB()
+        c.execute(session, "SELECT pg_notify(:channel, :payload)",
+                  channel=NOTIFY_CHANNEL, payload=self.format_payload(game_id, checksum))
+
+    def listen(self):
+        while not self.stopping.is_set():
+            connection = None
+            try:
+                # a dedicated connection, taken out of the pool for good
+                pooled_connection = self.__engine.raw_connection()
+                pooled_connection.detach()
+                connection = pooled_connection.connection
+                connection.autocommit = True
+                connection.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+                logger.info("listening for %s notifications", NOTIFY_CHANNEL)
+                while not self.stopping.is_set():
+                    if select.select([connection], [], [], self.select_timeout) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self.dispatch(connection.notifies.pop(0).payload)
+            except Exception:
+                logger.exception("lost %s listener connection - reconnecting", NOTIFY_CHANNEL)
+                self.stopping.wait(self.reconnect_delay)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+
+class Local_Notifier(Notifier):
+    """a stand-in for Postgres_Notifier which needs no database support: notifications are
+       held on the session until it commits, then passed to the listener thread through
+       a queue. Only this process hears about changes"""
+
+    def __init__(self):
+        super().__init__()
+        self.__queue = queue.Queue()
+        # Session is global, so these are removed again by close()
+        event.listen(Session, "after_commit", self.__after_commit)
+        event.listen(Session, "after_rollback", self.__after_rollback)
+
+    def notify(self, session, game_id, checksum):
+        session.info.setdefault(NOTIFY_CHANNEL, []).append(self.format_payload(game_id, checksum))
+
+    def __after_commit(self, session):
+        for payload in session.info.pop(NOTIFY_CHANNEL, []):
+            self.__queue.put(payload)
+
+    def __after_rollback(self, session):
+        session.info.pop(NOTIFY_CHANNEL, None)
+
+    def listen(self):
+        while True:
+            payload = self.__queue.get()
+            if payload is None:
+                # from wake()
+                return
+            self.dispatch(payload)
+
+    def wake(self):
+        self.__queue.put(None)
+
+    def close(self):
+        event.remove(Session, "after_commit", self.__after_commit)
+        event.remove(Session, "after_rollback", self.__after_rollback)
+        super().close()
+
+
+__notifier = None
+__notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    """returns this process' notifier, creating and starting it the first time - postgres
+       LISTEN/NOTIFY if the database supports it, otherwise the Local_Notifier stand-in"""
+    global __notifier
+    with __notifier_lock:
+        if __notifier is None:
+            engine = common_db.Common_DB().common_engine
+            if engine.url.get_backend_name() in ["postgres", "postgresql"]:
+                __notifier = Postgres_Notifier(engine)
+            else:
+                __notifier = Local_Notifier()
+            __notifier.start()
+        return __notifier
+
+
+def close_notifier():
+    """stops this process' notifier, if it has one - the next get_notifier() starts a new one"""
+    global __notifier
+    with __notifier_lock:
+        notifier, __notifier = __notifier, None
+    if notifier is not None:
+        notifier.close()
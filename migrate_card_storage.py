@@ -0,0 +1,78 @@
+"""Converts existing games between card storage modes (see card_storage.py).
+
+usage: python migrate_card_storage.py --to packed [--game-id 1 --game-id 2]
+
+Uses the same SQLALCHEMY_DATABASE_URI (and credentials) as the application.
+"""
+import argparse
+import logging
+
+import common_db
+import controller
+from card_storage import Card_Storage
+from game import get_users_for_game
+
+logger = logging.getLogger(__name__)
+
+
+def get_games_to_migrate(storage):
+    """returns the IDs of all games not already stored using storage"""
+    c = common_db.Common_DB()
+    if storage == Card_Storage.PACKED:
+        sql = "SELECT gameid FROM games WHERE packed_cards IS NULL ORDER BY gameid"
+    else:
+        sql = "SELECT gameid FROM games WHERE packed_cards IS NOT NULL ORDER BY gameid"
+    return [game["gameid"] for game in c.execute(c.common_engine, sql)]
+
+
+def migrate_game(game_id, storage):
+    """loads a game and saves it again using storage, in a single transaction"""
+    c = common_db.Common_DB()
+    players = get_users_for_game(game_id, c.common_engine)
+    if not players:
+        return False, f"game {game_id} has no players - skipped"
+
+    game = controller.do_load_game(game_id, players[0])
+    if not game:
+        return False, f"game {game_id} couldn't be loaded - skipped"
+    game.card_storage = storage
+    s = c.common_Sessionmaker()
+    result, message = game.save(s)
+    if result:
+        s.commit()
+        message = f"game {game_id} migrated to {storage}"
+    else:
+        s.rollback()
+        message = f"game {game_id} not migrated: {message}"
+    s.close()
+    return result, message
+
+
+def migrate(storage, game_ids=None):
+    """migrates each game in game_ids (or every game not yet using storage), returning
+       the number migrated and the number which failed"""
+    c = common_db.Common_DB()
+    c.initialise_models()
+    if not game_ids:
+        game_ids = get_games_to_migrate(storage)
+    migrated, failed = 0, 0
+    for game_id in game_ids:
+        result, message = migrate_game(game_id, storage)
+        if result:
+            migrated += 1
+            logger.info(message)
+        else:
+            failed += 1
+            logger.error(message)
+    return migrated, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert games between card storage modes.")
+    parser.add_argument("--to", choices=Card_Storage.All, default=Card_Storage.PACKED,
+                        help="storage mode to convert games to")
+    parser.add_argument("--game-id", type=int, action="append", dest="game_ids",
+                        help="only migrate this game (can be repeated)")
+    args = parser.parse_args()
+    migrated, failed = migrate(args.to, args.game_ids)
+    print(f"migrated {migrated} games to {args.to}, {failed} failed")
@@ -1,7 +1,8 @@
 from sqlalchemy import (TIMESTAMP, Boolean, Column, ForeignKey, Integer,
-                        String, Sequence, UniqueConstraint)
+                        LargeBinary, String, Sequence, UniqueConstraint)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, subqueryload
+from sqlalchemy.sql import func
 from sqlalchemy.sql.expression import false as sql_false
 
 Base = declarative_base()
@@ -14,12 +15,14 @@ class Model_Player(Base):
     hash = Column(String)
     username = Column(String)
     is_admin = Column(Boolean, server_default=sql_false())
+    is_bot = Column(Boolean, server_default=sql_false())
 
 class Model_Player_Game(Base):
     __tablename__ = 'player_game'
     id = Column(Integer, primary_key=True)
     player_id = Column(Integer)
     game_id = Column(Integer)
+    packed_cards = Column(LargeBinary)
     __table_args__ = (UniqueConstraint('player_id', 'game_id', name='uix_player_game'),)
 
 class Model_Card(Base):
@@ -30,6 +33,7 @@ class Model_Card(Base):
     card_location = Column(Integer)
     card_suit = Column(Integer)
     card_rank = Column(Integer)
+    card_deck = Column(Integer, server_default="0")
     belongs_to_game = relationship("Model_Game", back_populates='game_cards')
 
 class Model_Game(Base):
@@ -53,4 +57,33 @@ class Model_Game(Base):
     game_ready_to_start = Column(Boolean)
     game_finished = Column(Boolean)
     deal_done = Column(Boolean)
+    packed_cards = Column(LargeBinary)
+    # the move the cards in game_cards / packed_cards are as of - later moves are
+    # replayed from game_moves when the game is loaded
+    cards_move_number = Column(Integer)
     game_cards = relationship("Model_Card", back_populates="belongs_to_game")
+
+
+# an action in a game, appended when the game is saved and never changed - see move_log
+class Model_Move(Base):
+    __tablename__ = 'game_moves'
+    id = Column(Integer, primary_key=True)
+    game_id = Column(Integer, ForeignKey('games.gameid'))
+    move_number = Column(Integer)
+    player_id = Column(Integer)
+    action = Column(String)
+    # JSON: [card location short name, card code] for each card moved, or the deck's card codes for a deal
+    cards = Column(String)
+    created_at = Column(TIMESTAMP(timezone=False), server_default=func.now())
+    __table_args__ = (UniqueConstraint('game_id', 'move_number', name='uix_game_move'),)
+
+# the whole state of a game after move_number (see Game.snapshot), as JSON
+class Model_Snapshot(Base):
+    __tablename__ = 'game_snapshots'
+    id = Column(Integer, primary_key=True)
+    game_id = Column(Integer, ForeignKey('games.gameid'))
+    move_number = Column(Integer)
+    game_checksum = Column(String)
+    snapshot = Column(String)
+    created_at = Column(TIMESTAMP(timezone=False), server_default=func.now())
+    __table_args__ = (UniqueConstraint('game_id', 'move_number', name='uix_game_snapshot'),)
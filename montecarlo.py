@@ -0,0 +1,107 @@
+"""Runs large batches of simulated games (see simulator.py) across a pool of
+   processes, to compare special card configs - e.g. how often the first
+   player wins, how long games last and how often players pick up.
+
+   Games are split into shards which run in parallel. Shard k plays its games
+   with seeds f"{seed}-{k}-{i}" whichever config is being played, so every
+   config is measured on the same deals and the results are the same however
+   many processes run them.
+
+   usage: python montecarlo.py --games 100000 --players 4 --burn 10 None --reset 2 None
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import simulator
+from game import Game
+
+logger = logging.getLogger(__name__)
+
+# games per shard - small enough to spread evenly across processes, large enough
+# that sending the results back is cheap
+SHARD_SIZE = 500
+
+
+def special_card_configs(args):
+    """returns {name: config} for every combination of the special card values in args,
+       skipping combinations parse_requested_config rejects (e.g. one rank used twice)"""
+    configs = {}
+    for values in itertools.product(args.less_than, args.transparent, args.burn, args.reset):
+        special_cards = dict(zip(simulator.SPECIAL_CARDS, values))
+        config = simulator.config_from_args(args, **special_cards)
+        parsed, message = Game().parse_requested_config(config)
+        if not parsed:
+            logger.warning("skipping %s: %s", special_cards, message)
+            continue
+        name = " ".join(f"{special_card}={value}" for special_card, value in special_cards.items())
+        configs[name] = config
+    return configs
+
+
+def run_shard(task):
+    """plays one shard of games in a worker process, returning (config name, Simulation_Stats)"""
+    name, config, seed, shard, games, policy_names, max_turns = task
+    policies = [simulator.POLICIES[policy_name]() for policy_name in policy_names]
+    return name, simulator.simulate(config, games, f"{seed}-{shard}", policies, max_turns)
+
+
+def shard_tasks(configs, games_per_config, seed, policy_names, max_turns, shard_size=SHARD_SIZE):
+    """splits games_per_config games of each config into shards of at most shard_size"""
+    tasks = []
+    for shard, first_game in enumerate(range(0, games_per_config, shard_size)):
+        games = min(shard_size, games_per_config - first_game)
+        for name, config in configs.items():
+            tasks.append((name, config, seed, shard, games, policy_names, max_turns))
+    return tasks
+
+
+def run_batch(configs, games_per_config, seed=0, processes=None, policy_names=("random",),
+              max_turns=simulator.MAX_TURNS, shard_size=SHARD_SIZE):
+    """plays games_per_config games of each of configs ({name: config}) across processes
+       worker processes (default: one per CPU), returning {name: merged Simulation_Stats}"""
+    tasks = shard_tasks(configs, games_per_config, seed, list(policy_names), max_turns, shard_size)
+    results = {name: simulator.Simulation_Stats() for name in configs}
+    with Pool(processes) as pool:
+        for name, stats in pool.imap_unordered(run_shard, tasks):
+            results[name].merge(stats)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate games of each special card config in parallel")
+    parser.add_argument("--games", type=int, default=10000, help="games per config")
+    parser.add_argument("--seed", default="0")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    simulator.add_config_arguments(parser, several_special_cards=True)
+    args = parser.parse_args(argv)
+    # the engine logs every move at debug level
+    logging.basicConfig(level=logging.WARNING)
+
+    configs = special_card_configs(args)
+    if not configs:
+        parser.error("no valid special card configs")
+
+    start = time.perf_counter()
+    results = run_batch(configs, args.games, args.seed, args.processes, args.policy,
+                        args.max_turns, args.shard_size)
+    elapsed = time.perf_counter() - start
+
+    games = sum(stats.games for stats in results.values())
+    report = {"games": games,
+              "processes": args.processes,
+              "seconds": elapsed,
+              "games_per_second": games / elapsed if elapsed else None,
+              "configs": {name: stats.report() for name, stats in results.items()}}
+    print(json.dumps(report, indent=2))
+    return 1 if any(stats.violations for stats in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""The move log. Every action played in a game - the deal, swaps, no_swaps, plays
+   and pick ups - is appended to game_moves when the game is saved (see Game.save),
+   and a snapshot of the whole game is written to game_snapshots after the deal and
+   then every SNAPSHOT_INTERVAL moves. Cards are logged by their code rather than
+   their position, so moves replay the same way however a pile happens to be ordered.
+
+   rebuild_game uses these to work out what a game looked like after any move: it
+   starts from the nearest snapshot at or before that move and replays the moves since.
+   Games started before the move log existed can only be rebuilt from their first snapshot on.
+"""
+import json
+import logging
+
+import common_db
+from cards import Card, Card_Types
+from game import Game, Logged_Move, Move, describe_card_at
+
+logger = logging.getLogger(__name__)
+
+
+def load_snapshot(session, game_id, move_number=None):
+    """returns (move number, game checksum, snapshot dict) of the latest snapshot of game_id
+       taken at or before move_number (or the latest of all), or None if there isn't one"""
+    c = common_db.Common_DB()
+    if move_number is None:
+        rows = c.execute(session, "SELECT move_number, game_checksum, snapshot FROM game_snapshots WHERE game_id = :game_id ORDER BY move_number DESC LIMIT 1",
+                         game_id=game_id)
+    else:
+        rows = c.execute(session, "SELECT move_number, game_checksum, snapshot FROM game_snapshots WHERE game_id = :game_id AND move_number <= :move_number ORDER BY move_number DESC LIMIT 1",
+                         game_id=game_id, move_number=move_number)
+    if not rows:
+        return None
+    return rows[0]["move_number"], rows[0]["game_checksum"], json.loads(rows[0]["snapshot"])
+
+
+def load_snapshots(session, game_id):
+    """returns {move number: (game checksum, snapshot dict)} for every snapshot of game_id"""
+    c = common_db.Common_DB()
+    rows = c.execute(session, "SELECT move_number, game_checksum, snapshot FROM game_snapshots WHERE game_id = :game_id",
+                     game_id=game_id)
+    return {row["move_number"]: (row["game_checksum"], json.loads(row["snapshot"])) for row in rows}
+
+
+def load_moves(session, game_id, after=0, up_to=None):
+    """returns the Logged_Moves of game_id after move number after, up to and including up_to, in order"""
+    c = common_db.Common_DB()
+    if up_to is None:
+        rows = c.execute(session, "SELECT move_number, player_id, action, cards FROM game_moves WHERE game_id = :game_id AND move_number > :after ORDER BY move_number",
+                         game_id=game_id, after=after)
+    else:
+        rows = c.execute(session, "SELECT move_number, player_id, action, cards FROM game_moves WHERE game_id = :game_id AND move_number > :after AND move_number <= :up_to ORDER BY move_number",
+                         game_id=game_id, after=after, up_to=up_to)
+    return [Logged_Move(row["move_number"], row["player_id"], row["action"],
+                        # a deal's cards are plain card codes
+                        tuple(tuple(card) if isinstance(card, list) else card for card in json.loads(row["cards"])))
+            for row in rows]
+
+
+def move_to_play(game, logged_move):
+    """returns the Move which plays logged_move on game, finding each of its cards in the
+       player's piles as they are now"""
+    player = game.this_player
+    cards = []
+    for short_name, code in logged_move.cards:
+        card_type = Card_Types.Card_Type_From_Code[short_name]
+        pile = player.get_cards(card_type)
+        try:
+            index = pile.index(Card.from_code(code))
+        except ValueError:
+            raise ValueError(f"move {logged_move.move_number} in game {game.state.game_id} played "
+                             f"{Card.from_code(code).describe()}, which player {player.ID} doesn't have")
+        cards.append(describe_card_at(card_type, index))
+    return Move(logged_move.action, cards or None)
+
+
+def replay_move(game, logged_move):
+    """plays logged_move on game, raising ValueError if it can't be played"""
+    if logged_move.action == "deal":
+        raise ValueError(f"can't replay the deal in game {game.state.game_id} - rebuild from its snapshot")
+    game.set_this_player(logged_move.player_id)
+    if game.this_player is None:
+        raise ValueError(f"move {logged_move.move_number} in game {game.state.game_id} was played "
+                         f"by player {logged_move.player_id}, who isn't in the game")
+    response = game.play_action(*move_to_play(game, logged_move))
+    if not response["action_result"]:
+        raise ValueError(f"move {logged_move.move_number} in game {game.state.game_id} could not be "
+                         f"replayed: {response.get('action_message')}")
+
+
+def rebuild_game(session, game_id, move_number=None, this_player_id=None):
+    """returns a Game as game_id was after move_number (or after its latest move), rebuilt
+       from the nearest snapshot and the moves since. Raises ValueError if there's no
+       snapshot to start from or the moves don't replay"""
+    snapshot = load_snapshot(session, game_id, move_number)
+    if snapshot is None:
+        raise ValueError(f"no snapshot of game {game_id} at or before move {move_number}")
+    snapshot_move, _, state = snapshot
+    game = Game.from_snapshot(game_id, state)
+    moves = load_moves(session, game_id, after=snapshot_move, up_to=move_number)
+    logger.debug("rebuilding game %s from snapshot at move %s and %s moves since",
+                 game_id, snapshot_move, len(moves))
+    for logged_move in moves:
+        replay_move(game, logged_move)
+    if move_number is not None and game.state.current_turn_number != move_number:
+        raise ValueError(f"game {game_id} has no move {move_number}")
+    game.set_this_player(this_player_id)
+    return game
@@ -5,8 +5,10 @@ from sqlalchemy import (TIMESTAMP, Boolean, Column, ForeignKey, Integer,
                         String, create_engine)
 from sqlalchemy.ext.declarative import declarative_base
 
+import card_storage
 import common_db
-from cards import Card, Card_Types
+from card_storage import Card_Storage
+from cards import CARD_BACK, Card, Card_Types, card_pile_property
 from models import Model_Card, Model_Player, Model_Player_Game
 
 
@@ -26,6 +28,14 @@ class Player:
         self.face_down = []
         self.face_up = []
         self.hand = []
+        # the piles as last loaded or saved, so save only writes what has changed.
+        # None means this player's cards in the database are unknown
+        self.saved_piles = None
+
+    # the piles are Card_Piles, which keep track of what's in them for Game.checksum
+    face_down = card_pile_property("_face_down")
+    face_up = card_pile_property("_face_up")
+    hand = card_pile_property("_hand")
 
     class Card_Pile_ID(Enum):
         PLAYER_FACE_DOWN = Card_Types.CARD_FACE_DOWN
@@ -45,8 +55,7 @@ class Player:
         hand_cards = []
         if self.ID == player_id:
             hand_cards = self.hand
-        face_down_cards = []
-        face_down_cards.extend([Card(0, 1) for i in range(len(self.face_down))])
+        face_down_cards = [CARD_BACK] * len(self.face_down)
         player_summary = {'player_id': self.ID,
                           'number_face_down': len(self.face_down),
                           'number_face_up': len(self.face_up),
@@ -61,46 +70,111 @@ class Player:
         print("about to load cards for player ID " + str(self.ID) + " for game " + str(game_id) + " with type " + str(deck_type) + ".")
         c = common_db.Common_DB()
 
-        cards = c.execute(session,"SELECT card_suit, card_rank FROM game_cards WHERE player_id = :player_id AND card_location = :card_type AND game_id = :game_id ORDER BY card_rank, card_suit ASC",
+        cards = c.execute(session,"SELECT card_suit, card_rank, card_deck FROM game_cards WHERE player_id = :player_id AND card_location = :card_type AND game_id = :game_id ORDER BY card_rank, card_suit, card_deck ASC",
                                             player_id = self.ID,
                                             card_type = deck_type,
                                             game_id = game_id)
         cards_to_return = []
         if len(cards) > 0:
-            cards_to_return.extend([Card(card["card_suit"],card["card_rank"]) for card in cards])
+            cards_to_return.extend([Card(card["card_suit"],card["card_rank"],card["card_deck"] or 0) for card in cards])
         print("returning " + str(len(cards_to_return)))
         return cards_to_return
 
-    def save(self, session, game_id):
-        """saves the current player's gamew state, including registering this player as playing this game"""
+    def current_piles(self):
+        """returns the contents of each of this player's piles, in a form which can be compared between saves"""
+        return {pile_id: tuple(getattr(self, self.Pile_Objects[pile_id]))
+                for pile_id in self.Card_Pile_ID}
+
+    def forget_saved_cards(self):
+        """marks this player's cards as unknown in the database, so the next save rewrites them all"""
+        self.saved_piles = None
+
+    def save(self, session, game_id, storage=Card_Storage.ROWS):
+        """saves the current player's gamew state, including registering this player as playing this game.
+           Only the piles which have changed since the player was loaded or last saved are rewritten.
+           storage is a Card_Storage mode: ROWS writes game_cards rows, PACKED writes player_game.packed_cards"""
+        current_piles = self.current_piles()
+        if self.saved_piles is None:
+            # never been loaded or saved, so may not be registered in this game yet
+            dirty_piles = list(self.Card_Pile_ID)
+        else:
+            dirty_piles = [pile_id for pile_id in self.Card_Pile_ID
+                           if current_piles[pile_id] != self.saved_piles[pile_id]]
+
+        if not dirty_piles:
+            return True, f"player {self.ID} unchanged"
+
+        if storage == Card_Storage.PACKED:
+            result, message = self.__save_packed_cards(session, game_id)
+        else:
+            result, message = self.__save_card_rows(session, game_id, dirty_piles, current_piles)
+        if not result:
+            return False, message
+
+        self.saved_piles = current_piles
+        return True, f"player {self.ID} saved successfully"
+
+    def __register_in_game(self, session, game_id, packed_cards=None):
+        """adds this player to player_game for this game, or updates their packed cards if they're already there"""
         c = common_db.Common_DB()
-        result = c.execute(session, 'INSERT INTO player_game (player_id, game_id) VALUES (:user_id, :game_id) ON CONFLICT (player_id, game_id) DO UPDATE SET player_id = :user_id, game_id = :game_id;',
+        result = c.execute(session, 'INSERT INTO player_game (player_id, game_id, packed_cards) VALUES (:user_id, :game_id, :packed_cards) ON CONFLICT (player_id, game_id) DO UPDATE SET packed_cards = :packed_cards;',
                     user_id= self.ID,
-                    game_id = game_id)
+                    game_id = game_id,
+                    packed_cards = packed_cards)
         if not result:
             print(f"unable to add or update player in to player_game for player {self.ID} and game {game_id}")
-            return False, f"unable to add or update player in to player_game for player {self.ID} and game {game_id}"        
+            return False, f"unable to add or update player in to player_game for player {self.ID} and game {game_id}"
+        return True, "registered"
 
-        result = c.execute(session, f"DELETE FROM game_cards WHERE game_id = {game_id} AND player_id = {self.ID};")
+    def __save_packed_cards(self, session, game_id):
+        """stores all of this player's piles packed into their player_game row"""
+        packed_cards = card_storage.pack_piles({pile_id.value: getattr(self, self.Pile_Objects[pile_id])
+                                                for pile_id in self.Card_Pile_ID})
+        return self.__register_in_game(session, game_id, packed_cards)
+
+    def __save_card_rows(self, session, game_id, dirty_piles, current_piles):
+        """replaces the game_cards rows for each of dirty_piles"""
+        c = common_db.Common_DB()
+        if self.saved_piles is None:
+            result, message = self.__register_in_game(session, game_id)
+            if not result:
+                return False, message
+
+        result = c.execute(session, "DELETE FROM game_cards WHERE game_id = :game_id AND player_id = :player_id AND card_location IN :card_locations",
+                           game_id=game_id,
+                           player_id=self.ID,
+                           card_locations=[pile_id.value for pile_id in dirty_piles])
         if result == None:
             # some kind of exception
             print("unable to delete existing game cards")
             return False, f"unable to add or update player in to player_game for player {self.ID} and game {game_id}"
 
-        cards_to_store = []
+        cards_to_store = [(game_id, self.ID, pile_id.value, card.suit, card.rank, card.deck)
+                          for pile_id in dirty_piles
+                          for card in current_piles[pile_id]]
+        result = c.insert_many(session, "game_cards",
+                               ["game_id", "player_id", "card_location", "card_suit", "card_rank", "card_deck"],
+                               cards_to_store)
+        if not result:
+            print("failed to save game cards, rolling back")
+            return False, f"unable to save player cards for player {self.ID} and game {game_id}"
+        return True, "saved"
+
+    def set_cards_from_rows(self, rows):
+        """populates each card type for this player from game_cards rows which have
+           already been fetched (see Game.load), in the same order as load_player_cards"""
+        piles = {pile_id.value: [] for pile_id in self.Card_Pile_ID}
+        for row in rows:
+            piles[row["card_location"]].append(Card(row["card_suit"], row["card_rank"], row["card_deck"] or 0))
+        self.set_cards(piles)
+
+    def set_cards(self, piles):
+        """populates each card type for this player from a dict of {card location: list of cards},
+           sorted in the same order as load_player_cards"""
         for pile_id in self.Card_Pile_ID:
-                for card in getattr(self, self.Pile_Objects[pile_id]):
-                    cards_to_store.append(f"({game_id}, {self.ID}, {pile_id.value}, {card.suit}, {card.rank})")
-
-        if cards_to_store:
-            cards_to_store = ", ".join(cards_to_store)
-            result = c.execute(session, f"INSERT INTO game_cards (game_id, player_id, card_location, card_suit, card_rank) VALUES {cards_to_store};")
-            if not result:
-                print("failed to save game cards, rolling back")
-                return False, f"unable to save player cards for player {self.ID} and game {game_id}"
-
-
-        return True, f"player {self.ID} saved successfully"
+            cards = sorted(piles.get(pile_id.value, []), key=lambda card: (card.rank, card.suit, card.deck))
+            setattr(self, self.Pile_Objects[pile_id], cards)
+        self.saved_piles = self.current_piles()
 
     def load(self, session, game_id):
         """loads the cards for each card type for the current player"""
@@ -108,6 +182,7 @@ class Player:
             raise ValueError('tried to load game without setting a player ID.')
         for pile_id in self.Card_Pile_ID:
             setattr(self, self.Pile_Objects[pile_id], self.load_player_cards(session, game_id, pile_id.value))
+        self.saved_piles = self.current_piles()
 
         return True
 
@@ -123,15 +198,29 @@ class Player:
                 f"Tried to add cards to unknown hand '{card_type}'")
 
     def remove_cards_from_player_cards(self, cards_to_remove, card_type):
-        if card_type == Card_Types.CARD_HAND:
-            self.hand = list(set(self.hand) - set(cards_to_remove))
-        elif card_type == Card_Types.CARD_FACE_DOWN:
-            self.face_down = list(set(self.face_down) - set(cards_to_remove))
-        elif card_type == Card_Types.CARD_FACE_UP:
-            self.face_up = list(set(self.face_up) - set(cards_to_remove))
-        else:
+        """removes one of each of cards_to_remove from the pile card_type, keeping the
+           remaining cards in order so that games replay the same way"""
+        cards = self.get_cards(card_type)
+        if cards is None:
             raise ValueError(
                 f"Tried to add cards to unknown hand '{card_type}'")
+        positions = []
+        for card in cards_to_remove:
+            position = next((i for i, held in enumerate(cards) if held == card and i not in positions), None)
+            if position is not None:
+                positions.append(position)
+        self.remove_cards_at_positions(positions, card_type)
+
+    def remove_cards_at_positions(self, positions, card_type):
+        """removes the cards at positions (indexes into the pile card_type) in place,
+           keeping the remaining cards in order. Deleting from the highest position down
+           means only the cards after each one move, rather than rebuilding the pile"""
+        cards = self.get_cards(card_type)
+        if cards is None:
+            raise ValueError(
+                f"Tried to remove cards from unknown hand '{card_type}'")
+        for position in sorted(set(positions), reverse=True):
+            del cards[position]
 
     def get_cards(self, card_type):
         if card_type == Card_Types.CARD_HAND:
@@ -0,0 +1,228 @@
+"""Rebuilds games exactly as they were at any move - e.g. to settle "the burn didn't
+   happen!" - from the move log (see move_log): the deck in the order it was shuffled
+   for the deal, and every action since, in order.
+
+   A Game_Replay loads a game's log once. game_at(move_number) starts from the nearest
+   checkpoint at or before the move - a snapshot stored with the log, or one the replay
+   took itself every CHECKPOINT_INTERVAL moves - so looking at move 400 and then 401
+   doesn't re-run the game from the deal each time.
+
+   verify_all_games replays every logged game from its deal, across a pool of processes,
+   and checks it comes out with the checksum stored for it.
+
+   usage: python replay.py GAME_ID [--move N]
+          python replay.py --verify [--processes N]
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import common_db
+import move_log
+from cards import Card, Deck
+from game import Game
+from player import Player
+
+logger = logging.getLogger(__name__)
+
+# how often a replay keeps a snapshot of the games it rebuilds, in moves
+CHECKPOINT_INTERVAL = 50
+
+
+class Game_Replay(object):
+    """the move log of one game, and the checkpoints taken while replaying it.
+
+        methods:
+        .game_at(move_number) --> a new Game as it was after move_number (default: the last move)
+        .verify(stored_checksum) --> (bool, message): does the game replay from its deal, matching
+            every stored snapshot on the way and stored_checksum at the end?
+        .checkpoints() --> the move numbers a replay can currently start from
+
+       use_snapshots=False ignores the snapshots stored with the log (other than for the game's
+       config and seating at the deal), so that everything is worked out from the deal
+    """
+
+    def __init__(self, session, game_id, use_snapshots=True, checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.game_id = game_id
+        self.checkpoint_interval = checkpoint_interval
+        logged_moves = move_log.load_moves(session, game_id)
+        deal = next((logged_move for logged_move in logged_moves if logged_move.action == "deal"), None)
+        if deal is None:
+            raise ValueError(f"game {game_id} has no logged deal to replay from")
+        self.deal = deal
+        self.moves = [logged_move for logged_move in logged_moves if logged_move.move_number > deal.move_number]
+        self.stored_snapshots = move_log.load_snapshots(session, game_id)
+        if deal.move_number not in self.stored_snapshots:
+            raise ValueError(f"game {game_id} has no snapshot of its deal")
+
+        # move number --> snapshot dict
+        self.__checkpoints = {deal.move_number: self.__redeal().snapshot()}
+        if use_snapshots:
+            self.__checkpoints.update({move_number: snapshot
+                                       for move_number, (_, snapshot) in self.stored_snapshots.items()})
+
+    def __redeal(self):
+        """deals the logged deck again to the players seated at the deal"""
+        _, at_deal = self.stored_snapshots[self.deal.move_number]
+        game = Game()
+        game.state.game_id = self.game_id
+        for field, value in at_deal["state"].items():
+            setattr(game.state, field, copy.copy(value))
+        # as it was just before the deal
+        game.state.current_turn_number = self.deal.move_number - 1
+        game.state.deal_done = False
+        for player_id, _ in at_deal["players"]:
+            game.add_player(Player(player_id))
+        deck = Deck(newgame=False)
+        deck.cards = [Card.from_code(code) for code in self.deal.cards]
+        game.deal(deck=deck)
+        return game
+
+    def last_move_number(self):
+        return self.moves[-1].move_number if self.moves else self.deal.move_number
+
+    def checkpoints(self):
+        return sorted(self.__checkpoints)
+
+    def game_at(self, move_number=None):
+        if move_number is None:
+            move_number = self.last_move_number()
+        if not self.deal.move_number <= move_number <= self.last_move_number():
+            raise ValueError(f"game {self.game_id} has no move {move_number} - "
+                             f"moves since the deal are {self.deal.move_number} to {self.last_move_number()}")
+        start = max(checkpoint for checkpoint in self.__checkpoints if checkpoint <= move_number)
+        game = Game.from_snapshot(self.game_id, self.__checkpoints[start])
+        # move numbers after the deal run on from it one at a time
+        first = start - self.deal.move_number
+        for logged_move in self.moves[first:move_number - self.deal.move_number]:
+            move_log.replay_move(game, logged_move)
+            if logged_move.move_number % self.checkpoint_interval == 0:
+                self.__checkpoints[logged_move.move_number] = game.snapshot()
+        logger.debug("rebuilt game %s at move %s from checkpoint at move %s",
+                     self.game_id, move_number, start)
+        game.set_this_player(None)
+        return game
+
+    def verify(self, stored_checksum):
+        """replays the whole game once, checking the checksum at each stored snapshot on the way"""
+        game = Game.from_snapshot(self.game_id, self.__checkpoints[self.deal.move_number])
+        stored_at_deal, _ = self.stored_snapshots[self.deal.move_number]
+        if game.checksum() != stored_at_deal:
+            return False, f"the logged deck doesn't deal the cards in the snapshot at move {self.deal.move_number}"
+        for logged_move in self.moves:
+            try:
+                move_log.replay_move(game, logged_move)
+            except ValueError as e:
+                return False, str(e)
+            stored_snapshot = self.stored_snapshots.get(logged_move.move_number)
+            if stored_snapshot and game.checksum() != stored_snapshot[0]:
+                return False, f"replay doesn't match the snapshot at move {logged_move.move_number}"
+        if game.checksum() != stored_checksum:
+            return False, f"replay to move {self.last_move_number()} doesn't match the stored checksum"
+        return True, f"replayed {len(self.moves)} moves"
+
+
+def logged_game_ids(session):
+    """the IDs of every game with a logged deal"""
+    c = common_db.Common_DB()
+    rows = c.execute(session, "SELECT game_id FROM game_moves WHERE action = :action ORDER BY game_id",
+                     action="deal")
+    return [row["game_id"] for row in rows]
+
+
+def verify_game(game_id):
+    """replays game_id from its deal in a worker process, returning (game_id, bool, message)"""
+    c = common_db.Common_DB()
+    s = c.common_Sessionmaker()
+    try:
+        rows = c.execute(s, "SELECT game_checksum, current_turn_number FROM games WHERE gameid = :game_id",
+                         game_id=game_id)
+        replay = Game_Replay(s, game_id, use_snapshots=False)
+        if replay.last_move_number() != rows[0]["current_turn_number"]:
+            return game_id, False, (f"move log ends at move {replay.last_move_number()} but the game "
+                                    f"is at move {rows[0]['current_turn_number']}")
+        result, message = replay.verify(rows[0]["game_checksum"])
+    except ValueError as e:
+        result, message = False, str(e)
+    finally:
+        s.close()
+    return game_id, result, message
+
+
+def __connect_worker():
+    # a forked worker mustn't share its parent's database connections
+    common_db.Common_DB.instance = None
+
+
+def verify_all_games(processes=None, game_ids=None):
+    """replays every logged game (or game_ids) across processes worker processes (default:
+       one per CPU), returning {game ID: message} for each game which doesn't replay to its
+       stored checksum, and the number of games checked"""
+    if game_ids is None:
+        c = common_db.Common_DB()
+        s = c.common_Sessionmaker()
+        game_ids = logged_game_ids(s)
+        s.close()
+    failures = {}
+    with Pool(processes, initializer=__connect_worker) as pool:
+        for game_id, result, message in pool.imap_unordered(verify_game, game_ids):
+            if not result:
+                logger.warning("game %s failed to replay: %s", game_id, message)
+                failures[game_id] = message
+    return failures, len(game_ids)
+
+
+def describe_game(game, move_number):
+    """the snapshot of game with each card described, for people to read"""
+    def describe(codes):
+        return [Card.from_code(code).describe() for code in codes]
+    snapshot = game.snapshot()
+    return {"game_id": game.state.game_id,
+            "move_number": move_number,
+            "checksum": game.checksum(),
+            "state": snapshot["state"],
+            "game_piles": {game.Card_Pile_ID(location).name: describe(codes)
+                           for location, codes in snapshot["game_piles"]},
+            "players": {player_id: {location: describe(codes) for location, codes in piles}
+                        for player_id, piles in snapshot["players"]}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild games from their move log")
+    parser.add_argument("game_id", type=int, nargs="?", help="the game to rebuild")
+    parser.add_argument("--move", type=int, help="rebuild the game as it was after this move (default: the last)")
+    parser.add_argument("--verify", action="store_true",
+                        help="check that every logged game replays to its stored checksum")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+    # the engine logs every move at debug level
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.verify:
+        start = time.perf_counter()
+        failures, games = verify_all_games(args.processes)
+        elapsed = time.perf_counter() - start
+        print(json.dumps({"games": games,
+                          "processes": args.processes,
+                          "seconds": elapsed,
+                          "failures": failures}, indent=2))
+        return 1 if failures else 0
+    if args.game_id is None:
+        parser.error("give a game ID, or --verify")
+
+    c = common_db.Common_DB()
+    s = c.common_Sessionmaker()
+    replay = Game_Replay(s, args.game_id)
+    s.close()
+    move_number = args.move if args.move is not None else replay.last_move_number()
+    print(json.dumps(describe_game(replay.game_at(move_number), move_number), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
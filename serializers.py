@@ -0,0 +1,141 @@
+"""Encodes what the gameplay API sends to the browser.
+
+   jsonpickle works out how to encode each object as it goes, by looking at its
+   attributes. The game state is always the same shape, so instead each part of it
+   has a fixed list of fields, read with getters built once when this is imported,
+   and the result is plain dicts and lists which the standard json module encodes
+   directly. Cards are sent as their keys (e.g. "7H", see Card.card_key).
+
+   The game state is sent as:
+   {"game": {"active-game": bool, "state": {each of STATE_FIELDS, "play_list": [card keys]}},
+    "allowed_moves": {whichever of ALLOWED_MOVES_FIELDS calculate_player_allowed_actions gave},
+    "players_state": [{each of PLAYER_FIELDS, "face_up_cards": [card keys], "hand_cards": [card keys]}],
+    "checksum": the game's checksum}
+   Face down cards aren't sent - there are number_face_down of them and they all look the same.
+   Clients which already have a recent view may be sent patches to it instead (see view_deltas).
+
+   Clients which ask for it in their Accept header (see negotiate_wire_format) get the
+   same thing as MessagePack instead, which is smaller to send: each list of cards is a
+   bin with one byte per card - its code (see Card) - and numbers such as player IDs
+   take as few bytes as they need. Everything sent as a bin is a list of cards.
+   msgpack is optional - without it everything is sent as JSON.
+"""
+import json
+from operator import attrgetter, itemgetter
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# the parts of Game.State the browser uses
+STATE_FIELDS = ("game_id", "this_player_id", "number_of_players_requested", "number_of_players_joined",
+                "game_finished", "deal_done", "play_order", "players_ready_to_start", "players_finished",
+                "less_than_card", "transparent_card", "burn_card", "reset_card", "play_on_anything_cards",
+                "number_of_decks", "number_face_down_cards", "number_hand_cards", "current_turn_number",
+                "last_player", "pile_burn_size", "pile_pick_size", "pile_played_size", "pile_deck_size")
+
+# the counts in Player.summarise
+PLAYER_FIELDS = ("player_id", "number_face_down", "number_face_up", "number_in_hand")
+
+# what calculate_player_allowed_actions can return
+ALLOWED_MOVES_FIELDS = ("allowed_action", "action_message", "allowed_cards", "allowed_players", "is_next_player")
+
+__state_values = attrgetter(*STATE_FIELDS)
+__player_values = itemgetter(*PLAYER_FIELDS)
+
+# no spaces after separators
+__encoder = json.JSONEncoder(separators=(",", ":"))
+
+
+class Wire_Formats(object):
+    """the content types the gameplay API can answer with"""
+    JSON = "application/json"
+    MSGPACK = "application/x-msgpack"
+    # the same view in each format is a different representation, so needs a different ETag
+    Etag_Suffix = {JSON: "", MSGPACK: "-msgpack"}
+
+
+def available_wire_formats():
+    """the wire formats this server can send, the default first"""
+    if msgpack is None:
+        return [Wire_Formats.JSON]
+    return [Wire_Formats.JSON, Wire_Formats.MSGPACK]
+
+
+def negotiate_wire_format(accept_mimetypes):
+    """the wire format to answer a request with, given its Accept header (a werkzeug MIMEAccept).
+       Clients which accept anything, or send no Accept header, get JSON"""
+    return accept_mimetypes.best_match(available_wire_formats(), default=Wire_Formats.JSON)
+
+
+def card_keys(cards):
+    return [card.key for card in cards]
+
+
+def card_bytes(cards):
+    """cards as one byte each, which msgpack packs as a bin"""
+    return bytes(card.code for card in cards)
+
+
+def state_to_dict(state, encode_cards=card_keys):
+    encoded = dict(zip(STATE_FIELDS, __state_values(state)))
+    encoded["play_list"] = encode_cards(state.play_list)
+    return encoded
+
+
+def player_summary_to_dict(summary, encode_cards=card_keys):
+    """the parts of a Player.summarise the browser needs"""
+    encoded = dict(zip(PLAYER_FIELDS, __player_values(summary)))
+    encoded["face_up_cards"] = encode_cards(summary["face_up_cards"])
+    encoded["hand_cards"] = encode_cards(summary["hand_cards"])
+    return encoded
+
+
+def allowed_moves_to_dict(allowed_moves):
+    return {field: allowed_moves[field] for field in ALLOWED_MOVES_FIELDS if field in allowed_moves}
+
+
+def game_state_to_dict(game_state, encode_cards=card_keys):
+    """game_state (from controller.get_game_state) as plain dicts and lists, in the schema above,
+       with each list of cards encoded by encode_cards"""
+    if "game" not in game_state:
+        # there's no game, so there's nothing to convert
+        return game_state
+    return {"game": {"active-game": True,
+                     "state": state_to_dict(game_state["game"]["state"], encode_cards)},
+            "allowed_moves": allowed_moves_to_dict(game_state["allowed_moves"]),
+            "players_state": [player_summary_to_dict(summary, encode_cards)
+                              for summary in game_state["players_state"]],
+            "checksum": game_state["checksum"]}
+
+
+def encode_game_state(game_state, wire_format=Wire_Formats.JSON):
+    if wire_format == Wire_Formats.MSGPACK:
+        return msgpack.packb(game_state_to_dict(game_state, card_bytes), use_bin_type=True)
+    return __encoder.encode(game_state_to_dict(game_state))
+
+
+def __encode_cards_in(value, encode_cards):
+    """value with each tuple of cards in it encoded by encode_cards"""
+    if isinstance(value, tuple):
+        return encode_cards(value)
+    if isinstance(value, dict):
+        return {key: __encode_cards_in(item, encode_cards) for key, item in value.items()}
+    if isinstance(value, list):
+        return [__encode_cards_in(item, encode_cards) for item in value]
+    return value
+
+
+def encode_game_state_delta(delta, wire_format=Wire_Formats.JSON):
+    """encodes a delta from view_deltas.delta_since, whose patches hold cards as tuples"""
+    if wire_format == Wire_Formats.MSGPACK:
+        return msgpack.packb(__encode_cards_in(delta, card_bytes), use_bin_type=True)
+    return __encoder.encode(__encode_cards_in(delta, card_keys))
+
+
+def encode_response(response, wire_format=Wire_Formats.JSON):
+    """encodes the response to an action (e.g. from do_playcards), which is already plain values"""
+    if wire_format == Wire_Formats.MSGPACK:
+        return msgpack.packb(response, use_bin_type=True)
+    return __encoder.encode(response)
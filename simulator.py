@@ -0,0 +1,354 @@
+"""Plays complete games in memory, with no database, to measure how fast the
+   rules engine runs and to find rule bugs.
+
+   Each seat is played by a policy which chooses swaps and moves; the game
+   itself is driven through the same Game methods the web app uses. Every
+   turn is checked against the rules (no cards created or lost, the engine
+   accepts the moves it says are allowed, ...) and anything odd is counted
+   as a violation, with the seed needed to replay the game.
+
+   usage: python simulator.py --games 1000 --players 4 --seed 1
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+from collections import Counter, namedtuple
+
+import bots
+from cards import Card_Types
+from game import Game, Move, describe_card_at
+
+logger = logging.getLogger(__name__)
+
+# games which haven't finished after this many turns are abandoned
+MAX_TURNS = 1000
+# how many violations to keep the details of
+MAX_VIOLATION_EXAMPLES = 20
+
+# the new game form's defaults, as the strings it sends
+DEFAULT_CONFIG = {"number_of_players_requested": "2",
+                  "number_of_decks": "1",
+                  "number_face_down_cards": "3",
+                  "number_hand_cards": "3",
+                  "less_than_card": "7",
+                  "transparent_card": "None",
+                  "burn_card": "10",
+                  "reset_card": "2",
+                  "transparent_card_on_anything": "on",
+                  "burn_card_on_anything": "on",
+                  "reset_card_on_anything": "on"}
+
+
+def make_config(**values):
+    """returns a config in the form parse_requested_config expects, from DEFAULT_CONFIG
+       updated with values. A value of None removes that setting"""
+    config = dict(DEFAULT_CONFIG)
+    config.update(values)
+    return [{"name": name, "value": str(value)} for name, value in config.items() if value is not None]
+
+
+class Random_Policy(object):
+    """never swaps, and plays a random choice of the moves available"""
+
+    def choose_swap(self, game, player, rng):
+        return []
+
+    def choose_move(self, game, player, card_type, moves, rng):
+        return rng.choice(moves)
+
+
+class Lowest_Card_Policy(object):
+    """puts its highest cards face up, then plays every card it holds of the lowest rank it can"""
+
+    def choose_swap(self, game, player, rng):
+        cards = [(Card_Types.CARD_HAND, i, card) for i, card in enumerate(player.hand)]
+        cards.extend((Card_Types.CARD_FACE_UP, i, card) for i, card in enumerate(player.face_up))
+        cards.sort(key=lambda held: (held[2].rank, held[2].suit), reverse=True)
+        wanted_face_up = cards[:len(player.face_up)]
+        to_face_up = [describe_card_at(card_type, i) for card_type, i, _ in wanted_face_up
+                      if card_type == Card_Types.CARD_HAND]
+        to_hand = [describe_card_at(card_type, i) for card_type, i, _ in cards[len(player.face_up):]
+                   if card_type == Card_Types.CARD_FACE_UP]
+        return to_face_up + to_hand
+
+    def choose_move(self, game, player, card_type, moves, rng):
+        if card_type == Card_Types.CARD_FACE_DOWN:
+            return rng.choice(moves)
+        cards = player.get_cards(card_type)
+        lowest_rank = min(cards[int(move[0][2:])].rank for move in moves)
+        return max((move for move in moves if cards[int(move[0][2:])].rank == lowest_rank), key=len)
+
+
+class Bot_Policy(object):
+    """plays as the server's bots do (see bots.Heuristic_Policy)"""
+
+    def __init__(self):
+        self.policy = bots.Heuristic_Policy()
+
+    def choose_swap(self, game, player, rng):
+        swap = self.policy.choose_swap(game, player)
+        return list(swap.cards) if swap else []
+
+    def choose_move(self, game, player, card_type, moves, rng):
+        return list(self.policy.choose_move(game, player, iter(Move("play", tuple(move)) for move in moves)).cards)
+
+
+POLICIES = {"random": Random_Policy, "lowest": Lowest_Card_Policy, "bot": Bot_Policy}
+
+Game_Result = namedtuple("Game_Result", ["seed", "turns", "finished", "first_player",
+                                         "finishing_order", "pick_ups", "violations"])
+Violation = namedtuple("Violation", ["seed", "turn", "kind", "detail"])
+
+
+def possible_moves(game, player, card_type):
+    """lists the moves available to player from card_type, each a list of card descriptions.
+       Any face down card may be tried; otherwise, for each rank which can be played,
+       one card of that rank, two cards, and so on. Worked out separately from
+       Game.legal_moves, to check the engine against"""
+    cards = player.get_cards(card_type)
+    if card_type == Card_Types.CARD_FACE_DOWN:
+        return [[describe_card_at(card_type, i)] for i in range(len(cards))]
+    indexes_by_rank = {}
+    for i, card in enumerate(cards):
+        indexes_by_rank.setdefault(card.rank, []).append(i)
+    moves = []
+    for rank, indexes in indexes_by_rank.items():
+        if game.can_play_cards([cards[indexes[0]]]):
+            for number in range(1, len(indexes) + 1):
+                moves.append([describe_card_at(card_type, i) for i in indexes[:number]])
+    return moves
+
+
+def all_cards(game):
+    """counts every card in the game, wherever it is"""
+    cards = Counter()
+    for pile in [game.cards.pile_deck, game.cards.pile_pick, game.cards.pile_played, game.cards.pile_burn]:
+        cards.update((card.suit, card.rank, card.deck) for card in pile)
+    for player in game.players:
+        for pile in [player.face_down, player.face_up, player.hand]:
+            cards.update((card.suit, card.rank, card.deck) for card in pile)
+    return cards
+
+
+def new_game(config, rng):
+    """creates and deals a game for config, with players numbered from 1"""
+    game = Game()
+    parsed, message = game.parse_requested_config(config)
+    if not parsed:
+        raise ValueError(message)
+    for player_id in range(1, game.state.number_of_players_requested + 1):
+        game.add_players_to_game(player_id)
+    game.deal(rng)
+    return game
+
+
+def play_game(config, policies, seed, max_turns=MAX_TURNS):
+    """plays one game of config to the end, with policies[i] playing seat i.
+       Returns a Game_Result"""
+    rng = random.Random(seed)
+    game = new_game(config, rng)
+    violations = []
+    cards_dealt = all_cards(game)
+    seats = {player.ID: policies[i % len(policies)] for i, player in enumerate(game.players)}
+
+    def violation(turn, kind, detail):
+        violations.append(Violation(seed, turn, kind, detail))
+
+    for player in game.players:
+        game.set_this_player(player.ID)
+        swap = seats[player.ID].choose_swap(game, player, rng)
+        if swap:
+            response = game.play_action("swap", swap)
+            if not response["action_result"]:
+                violation(0, "rejected_swap", f"{swap}: {response.get('action_message')}")
+        response = game.play_action("no_swap")
+        if not response["action_result"]:
+            violation(0, "rejected_no_swap", response.get("action_message"))
+
+    first_player = game.state.play_order[0]
+    turns = 0
+    pick_ups = 0
+    while not game.state.game_finished and len(game.state.play_order) > 1 and not violations:
+        if turns >= max_turns:
+            break
+        turns += 1
+        player_id = game.state.play_order[0]
+        game.set_this_player(player_id)
+        player = game.this_player
+        allowed_moves = game.calculate_player_allowed_actions()
+        action = allowed_moves["allowed_action"]
+        card_type, _ = player.which_player_cards_can_player_use()
+        moves = [list(move.cards) for move in game.iter_legal_moves() if move.action == "play"]
+
+        if action == "play":
+            if not moves:
+                violation(turns, "play_without_moves", f"player {player_id} told to play with nothing playable")
+                break
+            cards = seats[player_id].choose_move(game, player, card_type, moves, rng)
+        elif action == "pick":
+            moves = possible_moves(game, player, card_type)
+            if moves:
+                violation(turns, "pick_with_moves", f"player {player_id} told to pick up but could play {moves}")
+            pick_ups += 1
+            cards = None
+        else:
+            violation(turns, "unexpected_action", f"next player {player_id} given action '{action}'")
+            break
+
+        response = game.play_action(action, cards)
+        if not response["action_result"]:
+            violation(turns, "rejected_move", f"{action} {cards}: {response.get('action_message')}")
+            break
+        if response.get("action_message") == "You played a face down card but lost":
+            pick_ups += 1
+
+        cards_now = all_cards(game)
+        if cards_now != cards_dealt:
+            lost = cards_dealt - cards_now
+            gained = cards_now - cards_dealt
+            violation(turns, "cards_changed", f"lost {dict(lost)}, gained {dict(gained)}")
+            break
+        for finished_id in game.state.players_finished:
+            finished_player = next(p for p in game.players if p.ID == finished_id)
+            if finished_player.face_down or finished_player.face_up or finished_player.hand:
+                violation(turns, "finished_with_cards", f"player {finished_id} finished holding cards")
+
+    finished = game.state.game_finished or len(game.state.play_order) < 2
+    return Game_Result(seed, turns, finished and not violations, first_player,
+                       list(game.state.players_finished), pick_ups, violations)
+
+
+class Simulation_Stats(object):
+    """accumulates the results of simulated games. Stats from separate runs
+       can be combined with merge()"""
+
+    def __init__(self):
+        self.games = 0
+        self.finished = 0
+        self.abandoned = 0
+        self.turns = 0
+        self.pick_ups = 0
+        self.first_player_wins = 0
+        self.elapsed = 0.0
+        self.violations = Counter()
+        self.violation_examples = []
+
+    def add(self, result):
+        self.games += 1
+        self.turns += result.turns
+        self.pick_ups += result.pick_ups
+        if result.finished:
+            self.finished += 1
+            if result.finishing_order and result.finishing_order[0] == result.first_player:
+                self.first_player_wins += 1
+        elif not result.violations:
+            self.abandoned += 1
+        for violation in result.violations:
+            self.violations[violation.kind] += 1
+            if len(self.violation_examples) < MAX_VIOLATION_EXAMPLES:
+                self.violation_examples.append(violation)
+
+    def merge(self, other):
+        self.games += other.games
+        self.finished += other.finished
+        self.abandoned += other.abandoned
+        self.turns += other.turns
+        self.pick_ups += other.pick_ups
+        self.first_player_wins += other.first_player_wins
+        self.elapsed += other.elapsed
+        self.violations.update(other.violations)
+        room = MAX_VIOLATION_EXAMPLES - len(self.violation_examples)
+        self.violation_examples.extend(other.violation_examples[:max(room, 0)])
+
+    def report(self):
+        return {"games": self.games,
+                "finished": self.finished,
+                "abandoned": self.abandoned,
+                "games_per_second": self.games / self.elapsed if self.elapsed else None,
+                "turns_per_game": self.turns / self.games if self.games else None,
+                "pick_ups_per_game": self.pick_ups / self.games if self.games else None,
+                "pick_ups_per_turn": self.pick_ups / self.turns if self.turns else None,
+                "first_player_win_rate": self.first_player_wins / self.finished if self.finished else None,
+                "violations": dict(self.violations),
+                "violation_examples": [violation._asdict() for violation in self.violation_examples]}
+
+
+def simulate(config, number_of_games, seed=0, policies=None, max_turns=MAX_TURNS):
+    """plays number_of_games games of config and returns their Simulation_Stats.
+       Game i is played with seed f"{seed}-{i}", so any game can be replayed alone
+       with play_game"""
+    policies = policies or [Random_Policy()]
+    stats = Simulation_Stats()
+    start = time.perf_counter()
+    for i in range(number_of_games):
+        stats.add(play_game(config, policies, f"{seed}-{i}", max_turns))
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+SPECIAL_CARDS = ["less_than_card", "transparent_card", "burn_card", "reset_card"]
+
+
+def config_from_args(args, **special_cards):
+    """builds a config from the options added by add_config_arguments. Special card
+       values can be given as keyword arguments instead, e.g. burn_card=10"""
+    values = {"number_of_players_requested": args.players,
+              "number_of_decks": args.decks,
+              "number_face_down_cards": args.face_down,
+              "number_hand_cards": args.hand,
+              "less_than_card": args.less_than,
+              "transparent_card": args.transparent,
+              "burn_card": args.burn,
+              "reset_card": args.reset}
+    values.update(special_cards)
+    for special_card in SPECIAL_CARDS:
+        values[f"{special_card}_on_anything"] = "on" if special_card in args.on_anything else None
+    return make_config(**values)
+
+
+def add_config_arguments(parser, several_special_cards=False):
+    """adds the game config options to an argparse parser. With several_special_cards,
+       each special card option takes a list of values"""
+    parser.add_argument("--players", default=DEFAULT_CONFIG["number_of_players_requested"])
+    parser.add_argument("--decks", default=DEFAULT_CONFIG["number_of_decks"])
+    parser.add_argument("--face-down", default=DEFAULT_CONFIG["number_face_down_cards"])
+    parser.add_argument("--hand", default=DEFAULT_CONFIG["number_hand_cards"])
+    for option, special_card in [("--less-than", "less_than_card"), ("--transparent", "transparent_card"),
+                                 ("--burn", "burn_card"), ("--reset", "reset_card")]:
+        if several_special_cards:
+            parser.add_argument(option, nargs="+", default=[DEFAULT_CONFIG[special_card]])
+        else:
+            parser.add_argument(option, default=DEFAULT_CONFIG[special_card])
+    parser.add_argument("--on-anything", nargs="*", default=["transparent_card", "burn_card", "reset_card"],
+                        choices=SPECIAL_CARDS,
+                        help="special cards which can be played on anything")
+    parser.add_argument("--policy", nargs="+", default=["random"], choices=sorted(POLICIES),
+                        help="policy for each seat, repeated if there are more seats than policies")
+    parser.add_argument("--max-turns", type=int, default=MAX_TURNS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate games in memory and report engine statistics")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--seed", default="0")
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    # the engine logs every move at debug level
+    logging.basicConfig(level=logging.WARNING)
+
+    config = config_from_args(args)
+    parsed, message = Game().parse_requested_config(config)
+    if not parsed:
+        parser.error(message)
+
+    stats = simulate(config, args.games, args.seed,
+                     [POLICIES[name]() for name in args.policy], args.max_turns)
+    print(json.dumps(stats.report(), indent=2))
+    return 1 if stats.violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,33 +8,99 @@ const card_types = {
     'i': "pick pile"
 };
 
+// cards are sent as keys such as "7H" - rank then suit - which is also the name of their image.
+// Face down cards aren't sent, as they all look like this
+const card_back_key = "1B";
+
 let timer;
+let poll_request = null;
+let event_source = null;
+// set if the event stream fails, after which we long poll instead
+let use_event_stream = !!window.EventSource;
 let this_player_id;
 
 let prior_database_checksum = "";
 
+// /getgamestate can send the game state as MessagePack, which is smaller than JSON.
+// Browsers without TextDecoder get JSON
+const msgpack_type = "application/x-msgpack";
+let use_msgpack = !!window.TextDecoder;
+
+// the last game state rendered. /getgamestate is asked for what's changed since,
+// and may send patches to it rather than the whole state (see view_deltas.py)
+let last_game_state = null;
+
 function enable_refresh_timer() {
-    timer = setInterval(
-        function () {
-            check_state_change();
-        },
-        500  /* 1000 ms = 1 sec */
-    );
+    // prefer the /gameevents stream, which pushes each new checksum as the
+    // game is saved. Otherwise long poll: /checkstate holds the request until
+    // the game's checksum differs from the one we send, or it times out, so
+    // only one request is ever outstanding
+    stop_refresh_timer();
+    if (use_event_stream) {
+        open_event_stream();
+    } else {
+        timer = setTimeout(check_state_change, 0);
+    }
 };
 
-function check_state_change() {
-    // stop timer to avoid race
-    clearInterval(timer);
-    let data = "get_checksum";
-    $.postJSON("/checkstate", data, function (result) {
-        if (result["database_checksum"] != prior_database_checksum) {
+function stop_refresh_timer() {
+    clearTimeout(timer);
+    if (poll_request) {
+        poll_request.abort();
+        poll_request = null;
+    }
+    if (event_source) {
+        event_source.close();
+        event_source = null;
+    }
+};
+
+function open_event_stream() {
+    event_source = new EventSource("/gameevents?checksum=" + encodeURIComponent(prior_database_checksum));
+    event_source.addEventListener("checksum", function (event) {
+        if (event.data != prior_database_checksum) {
             console.log("checksum changed");
-            prior_database_checksum = result["database_checksum"];
+            prior_database_checksum = event.data;
             update_game_state();
-        } else {
-            // not changed; re-enable timer
+        }
+    });
+    event_source.onerror = function () {
+        // the browser reconnects by itself unless the stream was refused
+        if (event_source && event_source.readyState == EventSource.CLOSED) {
+            console.error("event stream closed - falling back to polling");
+            use_event_stream = false;
             enable_refresh_timer();
         }
+    };
+};
+
+function check_state_change() {
+    let data = { "checksum": prior_database_checksum };
+    poll_request = $.ajax({
+        url: "/checkstate",
+        type: "post",
+        data: JSON.stringify(data),
+        dataType: "json",
+        contentType: "application/json",
+        success: function (result) {
+            poll_request = null;
+            if (result["database_checksum"] != prior_database_checksum) {
+                console.log("checksum changed");
+                prior_database_checksum = result["database_checksum"];
+                update_game_state();
+            } else {
+                // timed out without a change; wait again
+                enable_refresh_timer();
+            }
+        },
+        error: function (xhr, status, error) {
+            poll_request = null;
+            if (status != "abort") {
+                console.error("status", status, "error", error);
+                // back off before trying again
+                timer = setTimeout(check_state_change, 5000);
+            }
+        }
     });
 };
 
@@ -100,7 +166,14 @@ function submit_action(action) {
                 update_game_state();
             } else {
                 // got an error back. Shoudl be in action_message
-                display_alert(data.action_message, "alert-danger");
+                if (data.conflict) {
+                    // the game moved on while the move was being made - show the latest cards
+                    update_game_state(function () {
+                        display_alert(data.action_message, "alert-danger");
+                    });
+                } else {
+                    display_alert(data.action_message, "alert-danger");
+                }
             }
         }, 'json');
     };
@@ -126,11 +199,170 @@ function display_alert(alert_message, alert_class = "alert-primary") {
 };
 
 
-function update_game_state() {
-    $.getJSON("/getgamestate", function (result) {
+function get_game_state(success) {
+    let url = "/getgamestate";
+    if (last_game_state) {
+        // checksums can be the same in different games, so the game is sent too
+        url += "?game_id=" + encodeURIComponent(last_game_state.game.state.game_id) +
+            "&since=" + encodeURIComponent(last_game_state.checksum);
+    }
+    if (!use_msgpack) {
+        $.getJSON(url, success);
+        return;
+    }
+    let xhr = new XMLHttpRequest();
+    xhr.open("GET", url);
+    xhr.responseType = "arraybuffer";
+    xhr.setRequestHeader("Accept", msgpack_type + ", application/json;q=0.5");
+    xhr.onload = function () {
+        if (xhr.status != 200) {
+            console.error("status", xhr.status, "error", xhr.statusText);
+            return;
+        }
+        let content_type = xhr.getResponseHeader("Content-Type") || "";
+        if (content_type.startsWith(msgpack_type)) {
+            success(decode_msgpack(xhr.response));
+        } else {
+            // the server doesn't have msgpack
+            success(JSON.parse(new TextDecoder().decode(xhr.response)));
+        }
+    };
+    xhr.send();
+};
+
+function decode_msgpack(buffer) {
+    // decodes the MessagePack the server sends (see serializers.py). Lists of cards are
+    // sent as bin, one byte per card, and come out as card keys like those sent in JSON
+    let bytes = new Uint8Array(buffer);
+    let view = new DataView(buffer);
+    let text_decoder = new TextDecoder();
+    let offset = 0;
+
+    function read_uint(size) {
+        let value = 0;
+        for (let i = 0; i < size; i++) {
+            value = value * 256 + bytes[offset + i];
+        }
+        offset += size;
+        return value;
+    }
+    function read_int(size) {
+        let value = read_uint(size);
+        // two's complement
+        return value >= Math.pow(2, 8 * size - 1) ? value - Math.pow(2, 8 * size) : value;
+    }
+    function read_str(length) {
+        let value = text_decoder.decode(bytes.subarray(offset, offset + length));
+        offset += length;
+        return value;
+    }
+    function read_cards(length) {
+        let value = Array.from(bytes.subarray(offset, offset + length), card_key_from_code);
+        offset += length;
+        return value;
+    }
+    function read_array(length) {
+        let value = [];
+        for (let i = 0; i < length; i++) {
+            value.push(read());
+        }
+        return value;
+    }
+    function read_map(length) {
+        let value = {};
+        for (let i = 0; i < length; i++) {
+            let key = read();
+            value[key] = read();
+        }
+        return value;
+    }
+    function read() {
+        let type = bytes[offset++];
+        if (type < 0x80) return type;                       // positive fixint
+        if (type < 0x90) return read_map(type & 0x0f);      // fixmap
+        if (type < 0xa0) return read_array(type & 0x0f);    // fixarray
+        if (type < 0xc0) return read_str(type & 0x1f);      // fixstr
+        if (type >= 0xe0) return type - 0x100;              // negative fixint
+        let value;
+        switch (type) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return read_cards(read_uint(1));
+            case 0xc5: return read_cards(read_uint(2));
+            case 0xc6: return read_cards(read_uint(4));
+            case 0xca: value = view.getFloat32(offset); offset += 4; return value;
+            case 0xcb: value = view.getFloat64(offset); offset += 8; return value;
+            case 0xcc: return read_uint(1);
+            case 0xcd: return read_uint(2);
+            case 0xce: return read_uint(4);
+            case 0xcf: return read_uint(8);
+            case 0xd0: return read_int(1);
+            case 0xd1: return read_int(2);
+            case 0xd2: return read_int(4);
+            case 0xd3: return read_int(8);
+            case 0xd9: return read_str(read_uint(1));
+            case 0xda: return read_str(read_uint(2));
+            case 0xdb: return read_str(read_uint(4));
+            case 0xdc: return read_array(read_uint(2));
+            case 0xdd: return read_array(read_uint(4));
+            case 0xde: return read_map(read_uint(2));
+            case 0xdf: return read_map(read_uint(4));
+        }
+        throw new Error("can't decode MessagePack type 0x" + type.toString(16));
+    }
+    return read();
+};
+
+function card_key_from_code(code) {
+    // code is deck << 7 | suit << 4 | rank (see Card in cards.py); the key is rank then suit
+    let suits = { 0: "B", 1: "H", 2: "D", 3: "C", 4: "S" };
+    let ranks = { 10: "T", 11: "J", 12: "Q", 13: "K", 14: "A" };
+    let rank = code & 0x0f;
+    return (ranks[rank] || rank.toString()) + suits[(code >> 4) & 0x07];
+};
+
+function apply_patches(game_state, delta) {
+    // each patch is [action, path, value], where path leads from the top of the state
+    // to what's changed: "set" replaces it with value, "extend" adds the cards in value
+    // to the end of it
+    for (const [action, path, value] of delta.patches) {
+        let parent = game_state;
+        for (const key of path.slice(0, -1)) {
+            parent = parent[key];
+        }
+        let key = path[path.length - 1];
+        if (action == "extend") {
+            parent[key] = parent[key].concat(value);
+        } else {
+            parent[key] = value;
+        }
+    }
+    game_state.checksum = delta.checksum;
+    return game_state;
+};
+
+function update_game_state(after_render) {
+    get_game_state(function (result) {
+        if (result.patches) {
+            if (!last_game_state || last_game_state.checksum != result.since) {
+                // patches to a state we no longer have - start again
+                last_game_state = null;
+                update_game_state(after_render);
+                return;
+            }
+            result = apply_patches(last_game_state, result);
+        }
+        last_game_state = (result.game && result.game["active-game"]) ? result : null;
         console.log("state", JSON.stringify(result));
+        if (result.checksum) {
+            prior_database_checksum = result.checksum;
+        };
         if (result.game["active-game"]) {
             render_game(result);
+            if (after_render) {
+                after_render();
+            };
         } else {
             $('#game-id').text('There is NO active game');
         };
@@ -179,7 +411,8 @@ function display_player_cards(current_player, this_player_id, allowed_moves) {
     this_player_div.setAttribute("id", "player" + current_player.player_id.toString());
     let header = document.createTextNode("Player " + current_player.player_id.toString());
     this_player_div.appendChild(header);
-    this_player_div.appendChild(lay_out_cards(current_player.face_down_cards, "d", current_player.player_id, this_player_id, allowed_moves));
+    let face_down_cards = Array(current_player.number_face_down).fill(card_back_key);
+    this_player_div.appendChild(lay_out_cards(face_down_cards, "d", current_player.player_id, this_player_id, allowed_moves));
     this_player_div.appendChild(lay_out_cards(current_player.face_up_cards, "f", current_player.player_id, this_player_id, allowed_moves));
     this_player_div.appendChild(lay_out_cards(current_player.hand_cards, "h", current_player.player_id, this_player_id, allowed_moves, current_player.number_in_hand));
     game_row.append(this_player_div);
@@ -191,7 +424,7 @@ function display_game_actions(allowed_moves, player_id) {
     if (!(allowed_moves === undefined || allowed_moves.length == 0)) {
         // this is this players cards
         // work out what the allowed move is
-        clearInterval(timer);
+        stop_refresh_timer();
         switch (allowed_moves.allowed_action) {
             case "play": {
                 // allow the user to select only the type of card(s) they can play
@@ -247,7 +480,7 @@ function lay_out_cards(cards, card_type, card_player_id, this_player_id, allowed
         // this is this players cards
         // work out what the allowed move is
         let return_value = null;
-        clearInterval(timer);
+        stop_refresh_timer();
         switch (allowed_moves.allowed_action) {
             case "play": {
                 // allow the user to select only the type of card(s) they can play
@@ -318,12 +551,10 @@ function lay_out_cards_div(cards, card_type, player_id, number_in_hand = false,
             select.setAttribute("id", "picker-" + card_type);
             for (let j = 0; j < cards.length; j++) {
                 let card = cards[j];
-                let suit = card.suit;
-                let rank = card.rank;
                 let option = document.createElement("option");
                 // option.setAttribute("data-img-class","flex-card")
-                option.setAttribute("data-img-src", "/static/cards/" + get_card_key(suit, rank) + ".svg");
-                option.setAttribute("data-img-alt", describe_card(suit, rank));
+                option.setAttribute("data-img-src", "/static/cards/" + card + ".svg");
+                option.setAttribute("data-img-alt", describe_card(card));
                 option.setAttribute("value", card_type + "-" + j.toString());
                 select.append(option);
             };
@@ -334,11 +565,9 @@ function lay_out_cards_div(cards, card_type, player_id, number_in_hand = false,
             child_div.className = "flex-div";
             for (let j = 0; j < cards.length; j++) {
                 let card = cards[j];
-                let suit = card.suit;
-                let rank = card.rank;
                 let img = document.createElement("img");
-                img.setAttribute("alt", describe_card(suit, rank));
-                img.setAttribute("src", "/static/cards/" + get_card_key(suit, rank) + ".svg");
+                img.setAttribute("alt", describe_card(card));
+                img.setAttribute("src", "/static/cards/" + card + ".svg");
                 let card_img = document.createElement("div");
                 card_img.className = "card-img-top";
                 card_img.appendChild(img);
@@ -403,11 +632,9 @@ function lay_out_game_cards(number_of_cards, card_type, card_list = null) {
             let card_header = document.createElement("div");
             card_header.appendChild(document.createTextNode((j--).toString()));
             let card = card_list[i];
-            let suit = card.suit;
-            let rank = card.rank;
             let img = document.createElement("img");
-            img.setAttribute("alt", describe_card(suit, rank));
-            img.setAttribute("src", "/static/cards/" + get_card_key(suit, rank) + ".svg");
+            img.setAttribute("alt", describe_card(card));
+            img.setAttribute("src", "/static/cards/" + card + ".svg");
             let card_img = document.createElement("div");
             card_img.className = "card-img-top";
             card_img.appendChild(img);
@@ -441,22 +668,13 @@ function check_card(card_to_check) {
     }
 };
 
-function describe_card(suit, rank) {
-    let suits = { 0: "a card", 1: "hearts", 2: "diamonds", 3: "clubs", 4: "spades" };
+function describe_card(card_key) {
+    // card_key is rank then suit, e.g. "7H" or "TD"
+    let suits = { "B": "a card", "H": "hearts", "D": "diamonds", "C": "clubs", "S": "spades" };
     let ranks = {
-        1: "back", 2: "two", 3: "three", 4: "four", 5: "five",
-        6: "six", 7: "seven", 8: "eight", 9: "nine",
-        10: "ten", 11: "jack", 12: "queen", 13: "king", 14: "ace"
+        "1": "back", "2": "two", "3": "three", "4": "four", "5": "five",
+        "6": "six", "7": "seven", "8": "eight", "9": "nine",
+        "T": "ten", "J": "jack", "Q": "queen", "K": "king", "A": "ace"
     };
-    return (ranks[rank] + " of " + suits[suit]);
+    return (ranks[card_key[0]] + " of " + suits[card_key[1]]);
 };
-
-function get_card_key(suit, rank) {
-    let suits_short = { 0: "B", 1: "H", 2: "D", 3: "C", 4: "S" };
-    let rank_short = { 10: "T", 11: "J", 12: "Q", 13: "K", 14: "A" };
-    if (rank in rank_short) {
-        rank = rank_short[rank];
-    };
-    let card_image_name = rank.toString() + suits_short[suit].toString();
-    return card_image_name;
-};
\ No newline at end of file
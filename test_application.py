@@ -0,0 +1,57 @@
+import json
+import threading
+
+import pytest
+
+import game_events
+
+
+@pytest.fixture
+def client(db):
+    '''a logged in test client for the app, using the db fixture's database'''
+    import application
+    application.app.config["TESTING"] = True
+    client = application.app.test_client()
+    client.post("/register", data={"username": "alice", "password": "pw", "confirmation": "pw"},
+                base_url="https://localhost")
+    client.post("/login", data={"username": "alice", "password": "pw"}, base_url="https://localhost")
+    return client
+
+
+def start_game(client):
+    config = {"number_of_players_requested": "2", "number_face_down_cards": "3", "number_hand_cards": "3",
+              "number_of_decks": "1", "burn_card": "10", "reset_card": "2", "transparent_card": "7",
+              "less_than_card": "6"}
+    response = client.post("/startnewgame", json=[{"name": name, "value": value} for name, value in config.items()],
+                           base_url="https://localhost")
+    return json.loads(response.data)["new_game_id"]
+
+
+def test_etag_differs_between_games_with_the_same_checksum(client):
+    first, second = start_game(client), start_game(client)
+    client.get(f"/load_game?game_id={first}", base_url="https://localhost")
+    response = client.get("/getgamestate", base_url="https://localhost")
+    first_state = json.loads(response.data)
+    etag = response.headers["ETag"]
+
+    client.get(f"/load_game?game_id={second}", base_url="https://localhost")
+    response = client.get("/getgamestate", headers={"If-None-Match": etag}, base_url="https://localhost")
+    assert response.status_code == 200
+    second_state = json.loads(response.data)
+    # nothing has happened in either game, so they look the same apart from their IDs
+    assert second_state["checksum"] == first_state["checksum"]
+    assert second_state["game"]["state"]["game_id"] == second
+    assert first_state["game"]["state"]["game_id"] == first
+
+
+def test_event_streams_are_limited(client, monkeypatch):
+    monkeypatch.setattr(game_events, "event_stream_slots", threading.BoundedSemaphore(1))
+    start_game(client)
+    first = client.get("/gameevents", base_url="https://localhost")
+    assert first.status_code == 200
+    # the browser long polls instead
+    assert client.get("/gameevents", base_url="https://localhost").status_code == 503
+    first.close()
+    second = client.get("/gameevents", base_url="https://localhost")
+    assert second.status_code == 200
+    second.close()
@@ -0,0 +1,54 @@
+import threading
+
+import bot_executor
+from bot_executor import Job_Results
+
+
+def test_jobs_run_and_are_counted():
+    ran = []
+
+    def handler(game_id, checksum):
+        ran.append((game_id, checksum))
+        return Job_Results.SAVED, 2, 0.01
+
+    executor = bot_executor.Bot_Executor(handler, threads=1)
+    assert executor.submit(1, "a")
+    executor.join()
+    assert ran == [(1, "a")]
+    stats = executor.stats()
+    assert stats["jobs"] == 1
+    assert stats["results"][Job_Results.SAVED] == 1
+    assert stats["moves"] == 2
+    assert stats["queue_depth"] == 0
+
+
+def test_one_job_per_game_at_a_time():
+    release = threading.Event()
+    started = threading.Event()
+    ran = []
+
+    def handler(game_id, checksum):
+        started.set()
+        release.wait(5)
+        ran.append(checksum)
+        return Job_Results.SAVED, 1, 0.0
+
+    executor = bot_executor.Bot_Executor(handler, threads=2)
+    executor.submit(1, "a")
+    started.wait(5)
+    # submitted while "a" runs: only the latest is run, once "a" finishes
+    assert not executor.submit(1, "b")
+    assert not executor.submit(1, "c")
+    release.set()
+    executor.join()
+    assert ran == ["a", "c"]
+
+
+def test_failed_jobs_are_counted():
+    def handler(game_id, checksum):
+        raise RuntimeError("boom")
+
+    executor = bot_executor.Bot_Executor(handler, threads=1)
+    executor.submit(1, "a")
+    executor.join()
+    assert executor.stats()["results"][Job_Results.FAILED] == 1
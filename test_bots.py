@@ -0,0 +1,102 @@
+import random
+
+import bots
+import cards
+import controller
+import game
+import simulator
+
+
+def new_human(db, username):
+    return db.execute(db.common_engine, "INSERT INTO users (username, hash) VALUES (:username, :hash)",
+                      username=username, hash="x")
+
+
+def test_swap_puts_best_cards_face_up():
+    g = game.Game(1)
+    player = g.players[0]
+    player.hand = [cards.Card(1, 2), cards.Card(1, 14), cards.Card(2, 4)]
+    player.face_up = [cards.Card(3, 3), cards.Card(3, 13), cards.Card(4, 5)]
+    swap = bots.Heuristic_Policy().choose_swap(g, player)
+    assert swap.action == "swap"
+    # the 2 plays on anything, so is the best card
+    hand = [player.hand[int(d[2:])] for d in swap.cards if d[0] == "h"]
+    assert sorted(card.rank for card in hand) == [2, 14]
+
+
+def test_play_lowest_cards_keeping_special_cards():
+    g = game.Game(1)
+    g.state.number_of_players_requested = 2
+    g.add_players_to_game(2)
+    g.state.players_ready_to_start = [1, 2]
+    g.state.deal_done = True
+    g.set_this_player(1)
+    player = g.this_player
+    player.face_down = [cards.Card(1, 9)]
+    player.hand = [cards.Card(1, 2), cards.Card(1, 8), cards.Card(2, 8), cards.Card(3, 12)]
+    g.players[1].face_down = [cards.Card(2, 9)]
+    g.cards.pile_played = [cards.Card(4, 6)]
+    move = bots.Heuristic_Policy().choose_move(g, player, g.iter_legal_moves())
+    assert move == game.Move("play", ("h-1", "h-2"))
+
+
+def test_bots_play_a_whole_game():
+    g = simulator.new_game(simulator.make_config(number_of_players_requested=4), random.Random(1))
+    moves = bots.play_bot_turns(g, {1, 2, 3, 4})
+    assert 0 < moves < bots.MAX_BOT_MOVES
+    assert g.state.game_finished or len(g.state.play_order) < 2
+
+
+def test_bots_move_until_human_turn(db):
+    human_id = new_human(db, "alice")
+    response, g = controller.do_start_new_game(simulator.make_config(number_of_players_requested=3), human_id)
+    assert response["startnewgame"], response
+    g.set_this_player(human_id)
+    added, message = controller.do_add_bot_to_game(g)
+    assert added, message
+    assert not g.state.deal_done
+    added, message = controller.do_add_bot_to_game(g)
+    assert added, message
+    assert g.state.deal_done
+    bot_ids = bots.get_bot_ids(db.common_engine, [player.ID for player in g.players])
+    assert len(bot_ids) == 2 and human_id not in bot_ids
+
+    # the bots swap in the background as soon as the cards are dealt
+    controller.bot_jobs.join()
+    loaded = controller.do_load_game(g.state.game_id, human_id)
+    assert sorted(loaded.state.players_ready_to_start) == sorted(bot_ids)
+    response = controller.do_playcards({"action": "no_swap"}, loaded)
+    assert response["action_result"], response
+    controller.bot_jobs.join()
+
+    # the bots have played up to the human's turn, and saved it
+    reloaded = controller.do_load_game(g.state.game_id, human_id)
+    assert reloaded.state.play_order[0] == human_id
+    assert bots.next_bot(reloaded, bot_ids) is None
+    assert controller.bot_jobs.stats()["results"]["failed"] == 0
+
+
+def test_save_only_if_checksum_unchanged(db):
+    human_id = new_human(db, "bob")
+    response, g = controller.do_start_new_game(simulator.make_config(), human_id)
+    loaded_checksum = g.database_checksum
+    g.add_players_to_game(human_id + 1)
+    s = db.common_Sessionmaker()
+    assert g.save(s, expected_checksum=loaded_checksum)[0]
+    s.commit()
+    s.close()
+
+    g.state.players_ready_to_start.append(human_id)
+    s = db.common_Sessionmaker()
+    assert g.save(s, expected_checksum=loaded_checksum) == (False, game.SAVE_CONFLICT)
+    s.rollback()
+    s.close()
+
+
+def test_cant_log_in_as_bot(db):
+    s = db.common_Sessionmaker()
+    bot_id = bots.add_bot_player(s)
+    s.commit()
+    s.close()
+    assert bot_id
+    assert controller.do_login(None, "") == (None, None)
@@ -0,0 +1,89 @@
+import pytest
+
+import card_storage
+import cards
+from card_storage import Card_Storage
+
+
+def test_card_codes_round_trip():
+    all_cards = [cards.Card(s, r) for s in range(1, 5) for r in range(2, 15)] + [cards.Card(0, 1)]
+    codes = [card_storage.card_to_code(card) for card in all_cards]
+    assert len(set(codes)) == len(all_cards)
+    assert max(codes) < 256
+    assert [card_storage.card_from_code(code) for code in codes] == all_cards
+
+
+def test_pack_piles_round_trip():
+    piles = {cards.Card_Types.CARD_DECK: [cards.Card(1, 14), cards.Card(4, 2)],
+             cards.Card_Types.CARD_PLAYED: [],
+             cards.Card_Types.CARD_BURN: [cards.Card(3, 10)]}
+    packed = card_storage.pack_piles(piles)
+    assert len(packed) == 2 * len(piles) + 3
+    assert card_storage.unpack_piles(packed) == piles
+
+
+def test_unpack_truncated_piles_fails():
+    packed = card_storage.pack_piles({cards.Card_Types.CARD_DECK: [cards.Card(1, 14), cards.Card(4, 2)]})
+    with pytest.raises(ValueError):
+        card_storage.unpack_piles(packed[:-1])
+
+
+def new_saved_game(db, storage):
+    import game
+    g = game.Game(1)
+    g.card_storage = storage
+    g.state.number_of_players_requested = 3
+    g.add_players_to_game(2)
+    g.add_players_to_game(3)
+    g.deal()
+    s = db.common_Sessionmaker()
+    saved, message = g.save(s)
+    assert saved, message
+    s.commit()
+    s.close()
+    return g
+
+
+def card_rows(db, game_id):
+    return db.execute(db.common_engine, "SELECT id FROM game_cards WHERE game_id = :game_id", game_id=game_id)
+
+
+def assert_same_cards(loaded_game, saved_game):
+    assert loaded_game.checksum() == saved_game.checksum()
+    for loaded_player, saved_player in zip(loaded_game.players, saved_game.players):
+        for pile in ["face_down", "face_up", "hand"]:
+            assert sorted(getattr(loaded_player, pile), key=lambda c: (c.rank, c.suit)) == \
+                sorted(getattr(saved_player, pile), key=lambda c: (c.rank, c.suit))
+
+
+def test_packed_game_saves_without_card_rows(db):
+    import controller
+    saved_game = new_saved_game(db, Card_Storage.PACKED)
+    assert card_rows(db, saved_game.state.game_id) == []
+    assert_same_cards(controller.do_load_game(saved_game.state.game_id, 1), saved_game)
+
+
+def test_migrate_rows_to_packed_and_back(db):
+    import controller
+    import migrate_card_storage
+    saved_game = new_saved_game(db, Card_Storage.ROWS)
+    game_id = saved_game.state.game_id
+    assert len(card_rows(db, game_id)) == 52
+
+    migrated, failed = migrate_card_storage.migrate(Card_Storage.PACKED)
+    assert (migrated, failed) == (1, 0)
+    assert card_rows(db, game_id) == []
+    assert_same_cards(controller.do_load_game(game_id, 1), saved_game)
+
+    migrated, failed = migrate_card_storage.migrate(Card_Storage.ROWS)
+    assert (migrated, failed) == (1, 0)
+    assert len(card_rows(db, game_id)) == 52
+    assert_same_cards(controller.do_load_game(game_id, 2), saved_game)
+
+
+def test_add_missing_columns(db):
+    db.common_engine.execute("CREATE TABLE old_games AS SELECT gameid FROM games")
+    db.common_engine.execute("DROP TABLE games")
+    db.common_engine.execute("ALTER TABLE old_games RENAME TO games")
+    db.add_missing_columns()
+    db.execute(db.common_engine, "UPDATE games SET packed_cards = :packed_cards", packed_cards=b"\x01")
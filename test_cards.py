@@ -116,3 +116,110 @@ def test_description():
     print(descriptions)
     assert descriptions == expected_descriptions
 
+
+
+def test_cards_are_interned():
+    assert cards.Card(2, 5) is cards.Card(2, 5)
+    assert cards.Card.from_code(cards.Card(2, 5).code) is cards.Card(2, 5)
+
+
+def test_cards_are_immutable():
+    card = cards.Card(2, 5)
+    with pytest.raises(AttributeError):
+        card.rank = 6
+    assert not hasattr(card, "__dict__")
+
+
+def test_copied_and_pickled_cards_are_the_same_card():
+    import copy
+    import pickle
+    card = cards.Card(4, 14)
+    assert copy.copy(card) is card
+    assert copy.deepcopy([card])[0] is card
+    assert pickle.loads(pickle.dumps(card)) is card
+
+
+def test_invalid_card():
+    with pytest.raises(ValueError):
+        cards.Card(5, 2)
+    with pytest.raises(ValueError):
+        cards.Card(1, 15)
+
+
+def test_card_encodes_as_rank_and_suit():
+    import jsonpickle
+    assert jsonpickle.encode(cards.Card(3, 12), unpicklable=False) == '{"rank": 12, "suit": 3}'
+
+
+def test_cards_from_different_decks_are_different():
+    first, second = cards.Card(1, 12), cards.Card(1, 12, 1)
+    assert first != second
+    assert first.same_rank(second)
+    assert first.card_key() == second.card_key()
+    assert cards.Card.from_code(second.code) is second
+    assert second.code < 256
+    with pytest.raises(ValueError):
+        cards.Card(1, 12, cards.Card.max_decks)
+
+
+def test_two_deck_deck_has_no_duplicate_cards():
+    deck = cards.Deck(number_of_decks=2)
+    assert len(deck) == 2 * cards.Deck.cards_per_deck
+    assert len(set(deck)) == len(deck)
+
+
+def test_played_pile_tracks_rank_to_beat():
+    import copy
+    import jsonpickle
+    pile = cards.Played_Pile()
+    assert pile.rank_to_beat(7) is None
+    pile.append(cards.Card(1, 5))
+    pile.extend([cards.Card(2, 7), cards.Card(3, 7)])
+    assert pile.rank_to_beat(7) == 5
+    assert pile.rank_to_beat(0) == 7
+    pile.append(cards.Card(1, 9))
+    assert pile.rank_to_beat(7) == 9
+    pile.pop()
+    assert pile.rank_to_beat(7) == 5
+    assert copy.deepcopy(pile).rank_to_beat(0) == 7
+    assert jsonpickle.encode(pile, unpicklable=False) == jsonpickle.encode(list(pile), unpicklable=False)
+
+
+def test_played_pile_tracks_run_of_top_rank():
+    pile = cards.Played_Pile()
+    assert pile.top_run() == (None, 0)
+    pile.extend([cards.Card(1, 9), cards.Card(2, 5), cards.Card(3, 5)])
+    assert pile.top_run() == (5, 2)
+    pile.append(cards.Card(4, 5))
+    pile.append(cards.Card(1, 5, 1))
+    assert pile.top_run() == (5, 4)
+    del pile[-1]
+    assert pile.top_run() == (5, 3)
+
+
+def test_card_pile_tracks_zobrist_of_its_cards():
+    import copy
+    from functools import reduce
+
+    def expected(pile):
+        return reduce(lambda total, card: total ^ card.zobrist, pile, 0)
+    cards_in_deck = list(cards.Deck(number_of_decks=2))
+    pile = cards.Card_Pile(cards_in_deck[:5])
+    assert pile.zobrist == expected(pile) != 0
+    for change in [lambda: pile.append(cards_in_deck[5]),
+                   lambda: pile.extend(cards_in_deck[6:9]),
+                   lambda: pile.pop(),
+                   lambda: pile.pop(0),
+                   lambda: pile.__delitem__(1),
+                   lambda: pile.__delitem__(slice(0, 2)),
+                   lambda: pile.__setitem__(0, cards_in_deck[20]),
+                   lambda: pile.__setitem__(slice(0, 1), cards_in_deck[21:23]),
+                   lambda: pile.insert(1, cards_in_deck[30]),
+                   lambda: pile.remove(cards_in_deck[30]),
+                   lambda: pile.sort(key=lambda card: card.code)]:
+        change()
+        assert pile.zobrist == expected(pile)
+    assert copy.deepcopy(pile).zobrist == pile.zobrist
+    assert cards.Card_Pile(reversed(pile)).zobrist == pile.zobrist
+    pile.clear()
+    assert pile.zobrist == 0
@@ -0,0 +1,55 @@
+import pytest
+
+
+def test_select_returns_list_of_dicts(db):
+    db.execute(db.common_engine, "INSERT INTO users (username, hash) VALUES (:username, :hash)",
+               username="alice", hash="x")
+    rows = db.execute(db.common_engine, "SELECT username, hash FROM users WHERE username = :username",
+                      username="alice")
+    assert rows == [{"username": "alice", "hash": "x"}]
+
+
+def test_insert_returns_new_id(db):
+    first = db.execute(db.common_engine, "INSERT INTO users (username) VALUES (:username)", username="a")
+    second = db.execute(db.common_engine, "INSERT INTO users (username) VALUES (:username)", username="b")
+    assert second == first + 1
+
+
+def test_update_returns_rowcount(db):
+    for name in ["a", "b", "c"]:
+        db.execute(db.common_engine, "INSERT INTO users (username, is_admin) VALUES (:username, :is_admin)",
+                   username=name, is_admin=False)
+    result = db.execute(db.common_engine, "UPDATE users SET is_admin = :is_admin WHERE username != :username",
+                        is_admin=True, username="a")
+    assert result == 2
+
+
+def test_values_are_bound_not_interpolated(db):
+    '''quotes and None should round trip without being rendered into the SQL'''
+    name = "o'brien; DROP TABLE users; --"
+    db.execute(db.common_engine, "INSERT INTO users (username, hash) VALUES (:username, :hash)",
+               username=name, hash=None)
+    rows = db.execute(db.common_engine, "SELECT username, hash FROM users")
+    assert rows == [{"username": name, "hash": None}]
+
+
+def test_list_parameters_expand(db):
+    for name in ["a", "b", "c"]:
+        db.execute(db.common_engine, "INSERT INTO users (username) VALUES (:username)", username=name)
+    rows = db.execute(db.common_engine, "SELECT username FROM users WHERE username IN :names ORDER BY username",
+                      names=["a", "c"])
+    assert [row["username"] for row in rows] == ["a", "c"]
+
+
+def test_statement_prepared_once_per_text(db):
+    before = db.statement_cache_info()
+    for i in range(5):
+        db.execute(db.common_engine, "SELECT player_id FROM users WHERE username = :username", username=str(i))
+    after = db.statement_cache_info()
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 4
+
+
+def test_multiple_statements_rejected_on_sqlite(db):
+    with pytest.raises(RuntimeError):
+        db.execute(db.common_engine, "SELECT 1; SELECT 2")
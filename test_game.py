@@ -626,3 +626,255 @@ def test_play_move():
 
 def test_swap_cards():
     assert True
+
+
+def save_new_game(db, number_of_players):
+    '''create, deal and save a game for player IDs 1..number_of_players, returning its ID'''
+    g = game.Game(1)
+    g.state.number_of_players_requested = number_of_players
+    g.state.number_hand_cards = 2
+    for player_id in range(2, number_of_players + 1):
+        g.add_players_to_game(player_id)
+    g.deal()
+    s = db.common_Sessionmaker()
+    saved, message = g.save(s)
+    assert saved, message
+    s.commit()
+    s.close()
+    return g
+
+
+@pytest.mark.parametrize("number_of_players", [2, 6])
+def test_load_uses_constant_number_of_queries(db, count_statements, number_of_players):
+    '''loading a game costs the same number of queries however many players there are'''
+    import controller
+
+    saved_game = save_new_game(db, number_of_players)
+    loaded_game, statements = count_statements(lambda: controller.do_load_game(saved_game.state.game_id, 1))
+
+    # the cache's version check, the players, the games row and the cards
+    assert len(statements) == 4, statements
+    assert loaded_game.checksum() == saved_game.checksum()
+    for saved_player, loaded_player in zip(saved_game.players, loaded_game.players):
+        assert loaded_player.hand == sorted(saved_player.hand, key=lambda card: (card.rank, card.suit))
+        assert len(loaded_player.face_down) == len(saved_player.face_down)
+
+
+def test_load_unchanged_game_from_cache(db, count_statements):
+    import controller
+    saved_game = save_new_game(db, 3)
+    controller.do_load_game(saved_game.state.game_id, 1)
+    _, statements = count_statements(lambda: controller.do_load_game(saved_game.state.game_id, 2))
+    # only the version check
+    assert len(statements) == 1, statements
+    cached_game = controller.do_load_game(saved_game.state.game_id, 2)
+    assert cached_game.this_player.ID == 2
+    assert cached_game.checksum() == saved_game.checksum()
+
+
+def test_cached_game_reloaded_after_change(db):
+    import controller
+    saved_game = save_new_game(db, 3)
+    cached_game = controller.do_load_game(saved_game.state.game_id, 1)
+    # another worker's save
+    saved_game.players[0].hand.append(saved_game.cards.pile_deck.pop())
+    s = db.common_Sessionmaker()
+    saved_game.save(s)
+    s.commit()
+    s.close()
+    reloaded_game = controller.do_load_game(saved_game.state.game_id, 1)
+    assert reloaded_game.checksum() != cached_game.checksum()
+    assert len(reloaded_game.this_player.hand) == 3
+
+
+def test_save_unchanged_game_writes_nothing(db, count_statements):
+    import controller
+    saved_game = save_new_game(db, 3)
+    loaded_game = controller.do_load_game(saved_game.state.game_id, 1)
+    s = db.common_Sessionmaker()
+    _, statements = count_statements(lambda: loaded_game.save(s))
+    s.commit()
+    s.close()
+    assert statements == []
+
+
+def test_save_writes_only_changed_piles(db, count_statements):
+    import controller
+    saved_game = save_new_game(db, 3)
+    loaded_game = controller.do_load_game(saved_game.state.game_id, 1)
+    loaded_game.this_player.hand.append(loaded_game.cards.pile_deck.pop())
+    s = db.common_Sessionmaker()
+    _, statements = count_statements(lambda: loaded_game.save(s))
+    s.commit()
+    s.close()
+
+    card_writes = [statement for statement in statements if "game_cards" in statement]
+    # one delete and one insert for the deck, and the same for player 1's hand
+    assert len(card_writes) == 4, card_writes
+    reloaded_game = controller.do_load_game(saved_game.state.game_id, 1)
+    assert reloaded_game.checksum() == loaded_game.checksum()
+    assert len(reloaded_game.this_player.hand) == 3
+    assert [len(p.hand) for p in reloaded_game.players[1:]] == [2, 2]
+
+
+def test_transparent_card_takes_rank_of_card_below():
+    g = game.Game(1)
+    g.state.transparent_card = 7
+    g.state.play_on_anything_cards = []
+    g.state.less_than_card = 0
+    g.cards.pile_played = [cards.Card(1, 5), cards.Card(2, 7), cards.Card(3, 7)]
+    assert not g.can_play_cards([cards.Card(1, 4)])
+    assert g.can_play_cards([cards.Card(1, 6)])
+    g.cards.pile_played = [cards.Card(2, 7)]
+    assert g.can_play_cards([cards.Card(1, 2)])
+
+
+def test_cannot_play_the_same_card_twice(game_three_players_one_card_each):
+    g = game_three_players_one_card_each
+    g.state.number_of_players_requested = 3
+    g.state.deal_done = True
+    g.state.players_ready_to_start = [1, 2, 3]
+    g.state.play_order = [1, 2, 3]
+    g.state.this_player_id = 1
+    g.this_player = g.players[0]
+    g.players[0].hand = [cards.Card(1, 9), cards.Card(2, 9)]
+    response = g.play_move(["h_0", "h_0"])
+    assert not response['action_result']
+    assert len(g.players[0].hand) == 2
+    response = g.play_move(["h_-1"])
+    assert not response['action_result']
+    response = g.play_move(["h_1", "h_0"])
+    assert response['action_result'], response['action_message']
+    assert g.cards.pile_played == [cards.Card(2, 9), cards.Card(1, 9)]
+
+
+def test_play_legality_table():
+    table = game.play_legality_table((2, 10), 7)
+    assert table[5][6] and not table[5][4]
+    # lower cards can go on the less than card
+    assert table[7][3] and table[7][7] and not table[8][3]
+    # play on anything cards go on anything
+    assert table[14][2] and table[14][10]
+
+
+def test_four_of_a_kind_burns_played_pile(game_three_players_one_card_each):
+    g = game_three_players_one_card_each
+    g.state.number_of_players_requested = 3
+    g.state.deal_done = True
+    g.state.players_ready_to_start = [1, 2, 3]
+    g.state.play_order = [1, 2, 3]
+    g.state.this_player_id = 1
+    g.this_player = g.players[0]
+    g.players[0].hand = [cards.Card(1, 6), cards.Card(2, 6), cards.Card(3, 8)]
+    g.cards.pile_played = [cards.Card(1, 4), cards.Card(3, 6), cards.Card(4, 6)]
+    response = g.play_move(["h_0", "h_1"])
+    assert response['action_result'], response['action_message']
+    assert g.cards.pile_played == []
+    assert len(g.cards.pile_burn) == 5
+    # burning gives the player another go, on an empty pile
+    assert g.state.play_order[0] == 1
+
+
+def test_legal_moves_while_swapping(game_with_three_players):
+    g = game_with_three_players
+    g.state.play_order = [1, 2, 3]
+    g.state.number_of_players_requested = 3
+    g.deal()
+    g.set_this_player(1)
+    moves = g.legal_moves()
+    assert moves[0] == game.Move("no_swap", None)
+    # 3 hand and 3 face up cards: 9 ways to swap one, 9 to swap two, 1 to swap all three
+    assert len(moves) == 1 + 9 + 9 + 1
+    assert game.Move("swap", ("h-0", "h-2", "f-1", "f-2")) in moves
+    for move in moves:
+        assert g.play_action(*move)["action_result"], move
+        break
+
+
+def test_legal_moves_on_turn(game_three_players_one_card_each):
+    g = game_three_players_one_card_each
+    g.state.number_of_players_requested = 3
+    g.state.deal_done = True
+    g.state.players_ready_to_start = [1, 2, 3]
+    g.state.play_order = [1, 2, 3]
+    g.set_this_player(1)
+    g.players[0].hand = [cards.Card(1, 3), cards.Card(1, 9), cards.Card(2, 9)]
+    g.cards.pile_played = [cards.Card(3, 8)]
+    moves = g.legal_moves()
+    assert sorted(moves) == sorted([game.Move("play", ("h-1",)), game.Move("play", ("h-2",)),
+                                    game.Move("play", ("h-1", "h-2"))])
+    assert g.play_action(*moves[-1])["action_result"]
+
+    # player 2's turn now
+    g.set_this_player(3)
+    assert g.legal_moves() == []
+    g.set_this_player(1)
+    g.state.play_order = [1, 2, 3]
+    g.cards.pile_played = [cards.Card(3, 14)]
+    assert g.legal_moves() == [game.Move("pick", None)]
+
+
+def play_during(game_being_played, other_move):
+    '''makes other_move happen just as game_being_played's next move is played, as if
+       another request saved at the same time'''
+    play_action = game_being_played.play_action
+
+    def play_action_after_other_move(action, cards=None):
+        if other_move:
+            other_move.pop()()
+        return play_action(action, cards)
+    game_being_played.play_action = play_action_after_other_move
+
+
+def test_concurrent_moves_are_both_saved(db):
+    import controller
+    saved_game = save_new_game(db, 3)
+    player_one = controller.do_load_game(saved_game.state.game_id, 1)
+    player_two = controller.do_load_game(saved_game.state.game_id, 2)
+    play_during(player_two, [lambda: controller.do_playcards({"action": "no_swap"}, player_one)])
+
+    response = controller.do_playcards({"action": "no_swap"}, player_two)
+    assert response["action_result"], response
+    reloaded = controller.do_load_game(saved_game.state.game_id, 3)
+    assert sorted(reloaded.state.players_ready_to_start) == [1, 2]
+
+
+def test_same_move_sent_twice_is_a_conflict(db):
+    import controller
+    saved_game = save_new_game(db, 3)
+    first_tab = controller.do_load_game(saved_game.state.game_id, 1)
+    second_tab = controller.do_load_game(saved_game.state.game_id, 1)
+    swap = {"action": "swap", "action_cards": ["h-0", "f-0"]}
+    play_during(second_tab, [lambda: controller.do_playcards(dict(swap), first_tab)])
+
+    response = controller.do_playcards(dict(swap), second_tab)
+    assert not response["action_result"]
+    assert response["conflict"]
+    reloaded = controller.do_load_game(saved_game.state.game_id, 1)
+    assert reloaded.checksum() == first_tab.checksum()
+
+
+def test_checksum_follows_state_not_order_of_hand():
+    import random
+    g = game.Game(1)
+    g.state.number_of_players_requested = 2
+    g.add_players_to_game(2)
+    g.deal(random.Random(4))
+    dealt = g.checksum()
+    g.players[0].hand.reverse()
+    assert g.checksum() == dealt
+
+    # a move which doesn't move any cards still changes it
+    g.set_this_player(2)
+    assert g.play_action("no_swap")["action_result"]
+    after_no_swap = g.checksum()
+    assert after_no_swap != dealt
+
+    # as does moving a card - the piles are compared by what's in them
+    g.cards.pile_burn.append(g.cards.pile_deck.pop())
+    assert g.checksum() != after_no_swap
+    g.cards.pile_deck.append(g.cards.pile_burn.pop())
+    assert g.checksum() == after_no_swap
+    # the turn number means a game never goes back to an earlier checksum
+    g.state.current_turn_number += 1
+    assert g.checksum() not in (dealt, after_no_swap)
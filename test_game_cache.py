@@ -0,0 +1,67 @@
+import game
+import game_cache
+
+
+def make_game(game_id, checksum="1"):
+    g = game.Game(1)
+    g.state.game_id = game_id
+    # as if loaded from the database with cards stored as rows
+    g.stored_version = lambda: None if checksum is None else (checksum, "rows")
+    return g
+
+
+def test_miss_then_hit():
+    cache = game_cache.Game_Cache(max_size=2)
+    g = make_game(1)
+    assert cache.get(1, ("1", "rows")) is None
+    cache.put(g)
+    cached = cache.get(1, ("1", "rows"))
+    assert cached is not g
+    assert cached.state.game_id == 1
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+
+
+def test_changed_version_is_a_miss():
+    cache = game_cache.Game_Cache(max_size=2)
+    cache.put(make_game(1, checksum="1"))
+    assert cache.get(1, ("2", "rows")) is None
+    assert cache.get(1, ("1", "packed")) is None
+    stats = cache.stats()
+    assert (stats["stale"], stats["size"]) == (1, 0)
+
+
+def test_cached_games_are_copies():
+    cache = game_cache.Game_Cache(max_size=2)
+    g = make_game(1)
+    cache.put(g)
+    g.state.play_order = [99]
+    first = cache.get(1, ("1", "rows"))
+    first.state.play_order = [98]
+    assert cache.get(1, ("1", "rows")).state.play_order is None
+
+
+def test_least_recently_used_evicted():
+    cache = game_cache.Game_Cache(max_size=2)
+    cache.put(make_game(1))
+    cache.put(make_game(2))
+    cache.get(1, ("1", "rows"))
+    cache.put(make_game(3))
+    assert cache.get(2, ("1", "rows")) is None
+    assert cache.get(1, ("1", "rows")) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate():
+    cache = game_cache.Game_Cache(max_size=2)
+    cache.put(make_game(1))
+    cache.invalidate(1)
+    assert cache.get(1, ("1", "rows")) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_unsaved_game_not_cached():
+    cache = game_cache.Game_Cache(max_size=2)
+    cache.put(make_game(None))
+    cache.put(make_game(1, checksum=None))
+    assert cache.stats()["size"] == 0
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import game_events
+
+
+def test_returns_immediately_if_database_differs():
+    b = game_events.Game_Change_Broadcaster()
+    start = time.monotonic()
+    assert b.wait_for_change(1, "old", lambda: "new", timeout=5) == "new"
+    assert time.monotonic() - start < 1
+
+
+def test_times_out_without_change():
+    b = game_events.Game_Change_Broadcaster()
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        return "same"
+
+    start = time.monotonic()
+    assert b.wait_for_change(1, "same", fetch, timeout=0.3, poll_interval=0.1) == "same"
+    assert time.monotonic() - start >= 0.3
+    # one fetch at the start, then one per poll interval - not a busy loop
+    assert 2 <= len(fetches) <= 5
+
+
+def test_wakes_on_publish():
+    b = game_events.Game_Change_Broadcaster()
+    threading.Timer(0.1, b.publish, args=(1, "new")).start()
+    start = time.monotonic()
+    assert b.wait_for_change(1, "old", lambda: "old", timeout=5, poll_interval=5) == "new"
+    assert time.monotonic() - start < 2
+
+
+def test_ignores_publish_for_other_games():
+    b = game_events.Game_Change_Broadcaster()
+    threading.Timer(0.05, b.publish, args=(2, "new")).start()
+    assert b.wait_for_change(1, "old", lambda: "old", timeout=0.3, poll_interval=5) == "old"
+
+
+def test_stale_publish_does_not_end_wait():
+    '''a checksum published before the wait started may be out of date'''
+    b = game_events.Game_Change_Broadcaster()
+    b.publish(1, "older")
+    assert b.wait_for_change(1, "current", lambda: "current", timeout=0.2, poll_interval=5) == "current"
+
+
+def test_subscribe_yields_changes_and_heartbeats():
+    b = game_events.Game_Change_Broadcaster()
+    events = b.subscribe(1, "old", lambda: "old", heartbeat=0.2, poll_interval=5)
+    assert next(events) is None
+    threading.Timer(0.05, b.publish, args=(1, "new")).start()
+    assert next(events) == "new"
+    events.close()
+
+
+@pytest.fixture
+def local_notifier(db):
+    notifier = game_events.Local_Notifier()
+    notifier.start()
+    yield notifier
+    notifier.close()
+
+
+def test_local_notifier_publishes_on_commit(db, local_notifier):
+    notifier = local_notifier
+    s = db.common_Sessionmaker()
+    notifier.notify(s, 1001, "committed")
+    # nothing is sent until the transaction commits
+    assert game_events.broadcaster.latest_checksum(1001) is None
+    s.commit()
+    s.close()
+    # delivered by the listener thread
+    deadline = time.monotonic() + 5
+    while game_events.broadcaster.latest_checksum(1001) is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert game_events.broadcaster.latest_checksum(1001) == "committed"
+
+
+def test_local_notifier_drops_notification_on_rollback(db, local_notifier):
+    notifier = local_notifier
+    s = db.common_Sessionmaker()
+    notifier.notify(s, 1002, "rolled back")
+    s.rollback()
+    s.commit()
+    s.close()
+    time.sleep(0.2)
+    assert game_events.broadcaster.latest_checksum(1002) is None
+
+
+def test_get_notifier_without_postgres(db):
+    assert isinstance(game_events.get_notifier(), game_events.Local_Notifier)
+
+
+def test_closed_notifier_stops_listening(db):
+    before = threading.active_count()
+    notifier = game_events.get_notifier()
+    assert event.contains(Session, "after_commit", notifier._Local_Notifier__after_commit)
+    game_events.close_notifier()
+    assert not event.contains(Session, "after_commit", notifier._Local_Notifier__after_commit)
+    assert threading.active_count() <= before
+    assert game_events.get_notifier() is not notifier
+
+
+def test_notifier_must_implement_notify_and_listen():
+    with pytest.raises(TypeError):
+        game_events.Notifier()
@@ -0,0 +1,25 @@
+import argparse
+
+import montecarlo
+import simulator
+
+
+def test_parallel_batch_matches_sequential_shards():
+    configs = {"default": simulator.make_config()}
+    results = montecarlo.run_batch(configs, 7, seed="s", processes=2, max_turns=100, shard_size=3)
+    expected = simulator.Simulation_Stats()
+    for shard, games in enumerate([3, 3, 1]):
+        expected.merge(simulator.simulate(configs["default"], games, f"s-{shard}", max_turns=100))
+    merged = results["default"]
+    assert merged.games == 7
+    assert (merged.turns, merged.pick_ups, merged.first_player_wins) == \
+        (expected.turns, expected.pick_ups, expected.first_player_wins)
+
+
+def test_special_card_configs_skip_invalid_combinations():
+    parser = argparse.ArgumentParser()
+    simulator.add_config_arguments(parser, several_special_cards=True)
+    args = parser.parse_args(["--burn", "10", "7", "--less-than", "7"])
+    configs = montecarlo.special_card_configs(args)
+    # burn_card=7 clashes with less_than_card=7
+    assert list(configs) == ["less_than_card=7 transparent_card=None burn_card=10 reset_card=2"]
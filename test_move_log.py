@@ -0,0 +1,173 @@
+import random
+
+import pytest
+
+import bots
+import cards
+import controller
+import game
+import game_cache
+import move_log
+
+
+def new_saved_game(db, number_of_players=3):
+    '''create, deal and save a game for player IDs 1..number_of_players'''
+    g = game.Game(1)
+    g.state.number_of_players_requested = number_of_players
+    for player_id in range(2, number_of_players + 1):
+        g.add_players_to_game(player_id)
+    g.deal(random.Random(3))
+    save(db, g)
+    return g
+
+
+def save(db, g):
+    s = db.common_Sessionmaker()
+    saved, message = g.save(s, expected_checksum=g.database_checksum)
+    assert saved, message
+    s.commit()
+    s.close()
+
+
+def test_every_action_is_logged(db):
+    g = new_saved_game(db, 2)
+    assert g.state.current_turn_number == 1
+    g.set_this_player(1)
+    assert g.play_action("swap", ["h-0", "f-0"])["action_result"]
+    swapped_into_face_up = g.this_player.face_up[0]
+    assert not g.play_action("play", ["h-0"])["action_result"]
+    assert g.state.current_turn_number == 2
+    assert g.unsaved_moves() == (game.Logged_Move(2, 1, "swap", (("h", g.this_player.face_up[0].code),
+                                                                   ("f", g.this_player.hand[0].code))),)
+    save(db, g)
+    assert g.unsaved_moves() == ()
+
+    s = db.common_Sessionmaker()
+    logged = move_log.load_moves(s, g.state.game_id)
+    s.close()
+    assert [move.action for move in logged] == ["deal", "swap"]
+    assert logged[1].cards[0] == ("h", swapped_into_face_up.code)
+    # the deal lists the deck as shuffled, so 52 cards
+    assert len(logged[0].cards) == 52
+
+
+def test_logged_deck_deals_the_same_cards():
+    g = game.Game(1)
+    g.state.number_of_players_requested = 2
+    g.add_players_to_game(2)
+    g.deal()
+    deal = g.unsaved_moves()[0]
+    assert deal.action == "deal"
+
+    again = game.Game(1)
+    again.state.number_of_players_requested = 2
+    again.add_players_to_game(2)
+    deck = cards.Deck(newgame=False)
+    deck.cards = [cards.Card.from_code(code) for code in deal.cards]
+    again.deal(deck=deck)
+    assert again.checksum() == g.checksum()
+
+
+def test_rebuild_game_at_every_move(db, monkeypatch):
+    monkeypatch.setattr(game, "SNAPSHOT_INTERVAL", 5)
+    g = new_saved_game(db)
+    checksums = {g.state.current_turn_number: g.checksum()}
+    # save after every move, and now and then after a few, so snapshots fall both ways
+    while not g.state.game_finished:
+        played = bots.play_bot_turns(g, {1, 2, 3}, max_moves=random.Random(g.state.current_turn_number).choice([1, 1, 3]))
+        assert played
+        save(db, g)
+        checksums[g.state.current_turn_number] = g.checksum()
+
+    s = db.common_Sessionmaker()
+    snapshots = db.execute(s, "SELECT move_number FROM game_snapshots WHERE game_id = :game_id",
+                           game_id=g.state.game_id)
+    assert len(snapshots) > 2
+    for move_number, checksum in checksums.items():
+        assert move_log.rebuild_game(s, g.state.game_id, move_number).checksum() == checksum
+    latest = move_log.rebuild_game(s, g.state.game_id)
+    assert latest.state.game_finished
+    assert latest.snapshot() == g.snapshot()
+    with pytest.raises(ValueError):
+        move_log.rebuild_game(s, g.state.game_id, g.state.current_turn_number + 1)
+    s.close()
+
+
+def test_snapshot_round_trip():
+    g = game.Game(1)
+    g.state.number_of_players_requested = 3
+    g.add_players_to_game(2)
+    g.add_players_to_game(3)
+    g.deal(random.Random(5))
+    restored = game.Game.from_snapshot(7, g.snapshot(), 2)
+    assert restored.checksum() == g.checksum()
+    assert restored.this_player.ID == 2
+    assert restored.state.pile_deck_size == g.state.pile_deck_size
+    assert restored.snapshot() == g.snapshot()
+
+
+def test_moves_between_snapshots_save_no_cards(db, count_statements, monkeypatch):
+    monkeypatch.setattr(game, "SNAPSHOT_INTERVAL", 5)
+    g = new_saved_game(db)
+    assert bots.play_bot_turns(g, {1, 2, 3}, max_moves=1)
+    assert g.state.current_turn_number % game.SNAPSHOT_INTERVAL
+    _, statements = count_statements(lambda: save(db, g))
+    writes = [statement.split()[0:3] for statement in statements if not statement.lstrip().startswith("SELECT")]
+    assert writes == [["UPDATE", "games", "SET"], ["INSERT", "INTO", "game_moves"]]
+
+    # the cards are replayed from the moves when the game's loaded
+    game_cache.cache.clear()
+    loaded = controller.do_load_game(g.state.game_id, 1)
+    assert loaded.checksum() == g.checksum()
+    assert loaded.this_player.hand == sorted(g.players[0].hand, key=lambda card: (card.rank, card.suit, card.deck))
+
+    # and written with the next snapshot
+    while loaded.state.current_turn_number % game.SNAPSHOT_INTERVAL:
+        assert bots.play_bot_turns(loaded, {1, 2, 3}, max_moves=1)
+    _, statements = count_statements(lambda: save(db, loaded))
+    assert any("game_snapshots" in statement for statement in statements)
+    assert any("game_cards" in statement and not statement.lstrip().startswith("SELECT") for statement in statements)
+
+
+def test_cards_saved_before_cards_move_number(db, monkeypatch):
+    monkeypatch.setattr(game, "SNAPSHOT_INTERVAL", 5)
+    g = new_saved_game(db)
+    # as a game saved before the column was added, with no deal snapshot either
+    db.execute(db.common_engine, "UPDATE games SET cards_move_number = NULL")
+    db.execute(db.common_engine, "DELETE FROM game_snapshots")
+
+    game_cache.cache.clear()
+    loaded = controller.do_load_game(g.state.game_id, 1)
+    assert loaded.checksum() == loaded.database_checksum
+    assert bots.play_bot_turns(loaded, {1, 2, 3}, max_moves=1)
+    assert loaded.state.current_turn_number % game.SNAPSHOT_INTERVAL
+    save(db, loaded)
+    assert db.execute(db.common_engine, "SELECT cards_move_number FROM games")[0]["cards_move_number"] == \
+        loaded.state.current_turn_number
+
+    # and the moves after that replay from the snapshot saved with the cards
+    assert bots.play_bot_turns(loaded, {1, 2, 3}, max_moves=1)
+    save(db, loaded)
+    for _ in range(2):
+        game_cache.cache.clear()
+        reloaded = controller.do_load_game(g.state.game_id, 1)
+        assert reloaded.checksum() == reloaded.database_checksum == loaded.checksum()
+
+
+def test_game_which_doesnt_replay_isnt_played(db, monkeypatch):
+    monkeypatch.setattr(game, "SNAPSHOT_INTERVAL", 5)
+    g = new_saved_game(db, 2)
+    assert bots.play_bot_turns(g, {1, 2}, max_moves=1)
+    save(db, g)
+    db.execute(db.common_engine, "DELETE FROM game_moves WHERE move_number > 1")
+
+    game_cache.cache.clear()
+    assert controller.do_load_game(g.state.game_id, 1) is None
+    # a game already in memory is reloaded before the move is played
+    g.set_this_player(g.players[0].ID)
+    g.database_checksum = None
+    checksum = g.checksum()
+    response = controller.do_playcards({"action": "pick"}, g)
+    assert response["action_message"] == "Unable to load game"
+    assert g.database_checksum is None
+    assert db.execute(db.common_engine, "SELECT game_checksum FROM games")[0]["game_checksum"] == checksum
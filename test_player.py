@@ -156,3 +156,16 @@ def test_player_correctly_summarised(test_player_one_card_each_deck):
 
     assert jsonpickle.encode(p.summarise(1), unpicklable=False) == expected_summary
 
+
+def test_remove_cards_at_positions_keeps_order(test_player_one_card_each_deck):
+    p = test_player_one_card_each_deck
+    p.hand = [cards.Card(1, 5), cards.Card(2, 9), cards.Card(3, 5), cards.Card(1, 5, 1)]
+    p.remove_cards_at_positions([2, 0], cards.Card_Types.CARD_HAND)
+    assert p.hand == [cards.Card(2, 9), cards.Card(1, 5, 1)]
+
+def test_remove_one_of_two_matching_cards(test_player_one_card_each_deck):
+    '''in a two deck game only the copy played leaves the pile'''
+    p = test_player_one_card_each_deck
+    p.hand = [cards.Card(1, 5), cards.Card(1, 5, 1), cards.Card(2, 9)]
+    p.remove_cards_from_player_cards([cards.Card(1, 5, 1)], cards.Card_Types.CARD_HAND)
+    assert p.hand == [cards.Card(1, 5), cards.Card(2, 9)]
@@ -0,0 +1,64 @@
+import json
+import random
+
+import pytest
+
+import bots
+import game
+import replay
+
+
+def play_logged_game(db, seed, moves_per_save=(1, 1, 4)):
+    '''play and save a whole game of bots, returning it and {move number: checksum}'''
+    g = game.Game(1)
+    g.state.number_of_players_requested = 3
+    g.add_players_to_game(2)
+    g.add_players_to_game(3)
+    rng = random.Random(seed)
+    g.deal(rng)
+    checksums = {}
+    while True:
+        s = db.common_Sessionmaker()
+        saved, message = g.save(s, expected_checksum=g.database_checksum)
+        assert saved, message
+        s.commit()
+        s.close()
+        checksums[g.state.current_turn_number] = g.checksum()
+        if g.state.game_finished:
+            return g, checksums
+        assert bots.play_bot_turns(g, {1, 2, 3}, max_moves=rng.choice(moves_per_save))
+
+
+def test_game_at_every_move(db, monkeypatch):
+    monkeypatch.setattr(game, "SNAPSHOT_INTERVAL", 1000)
+    g, checksums = play_logged_game(db, 1)
+    s = db.common_Sessionmaker()
+    game_replay = replay.Game_Replay(s, g.state.game_id, checkpoint_interval=10)
+    s.close()
+    # only the deal was snapshotted, so the replay works from its own checkpoints
+    assert game_replay.checkpoints() == [1]
+    for move_number, checksum in sorted(checksums.items(), reverse=True):
+        assert game_replay.game_at(move_number).checksum() == checksum
+    last = game_replay.last_move_number()
+    assert game_replay.checkpoints() == [1] + list(range(10, last + 1, 10))
+    assert game_replay.game_at().state.game_finished
+    with pytest.raises(ValueError):
+        game_replay.game_at(last + 1)
+
+
+def test_verify_all_games(db):
+    games = [play_logged_game(db, seed)[0] for seed in range(3)]
+    failures, checked = replay.verify_all_games(processes=2)
+    assert (failures, checked) == ({}, 3)
+
+    # a move which didn't happen the way it's logged
+    tampered = games[1].state.game_id
+    s = db.common_Sessionmaker()
+    deal = db.execute(s, "SELECT cards FROM game_moves WHERE game_id = :game_id AND action = 'deal'",
+                      game_id=tampered)[0]["cards"]
+    db.execute(s, "UPDATE game_moves SET cards = :cards WHERE game_id = :game_id AND action = 'deal'",
+               game_id=tampered, cards=json.dumps(json.loads(deal)[::-1]))
+    s.commit()
+    s.close()
+    failures, checked = replay.verify_all_games(processes=2)
+    assert list(failures) == [tampered]
@@ -0,0 +1,88 @@
+import json
+import random
+
+import jsonpickle
+import pytest
+from werkzeug.datastructures import MIMEAccept
+
+import benchmarks
+import cards
+import controller
+import serializers
+import simulator
+
+
+def dealt_game():
+    g = simulator.new_game(simulator.make_config(number_of_players_requested=3), random.Random(2))
+    g.set_this_player(2)
+    return g
+
+
+def test_game_state_schema():
+    g = dealt_game()
+    g.cards.pile_played = [cards.Card(1, 10), cards.Card(3, 4)]
+    g.state.play_list = g.cards.pile_played
+    g.players[1].face_up[0] = cards.Card(4, 14)
+    encoded = json.loads(serializers.encode_game_state(controller.game_view(g)))
+
+    assert set(encoded) == {"game", "allowed_moves", "players_state", "checksum"}
+    state = encoded["game"]["state"]
+    assert set(state) == set(serializers.STATE_FIELDS) | {"play_list"}
+    assert state["this_player_id"] == 2
+    assert state["play_list"] == ["TH", "4C"]
+    assert encoded["allowed_moves"] == {"allowed_action": "swap",
+                                        "action_message": "You can choose to swap cards,",
+                                        "allowed_players": [1, 2, 3]}
+
+    players = {player["player_id"]: player for player in encoded["players_state"]}
+    assert players[2]["face_up_cards"][0] == "AS"
+    assert players[2]["hand_cards"] == [card.key for card in g.players[1].hand]
+    # only your own hand is sent, and face down cards never are
+    assert players[1]["hand_cards"] == [] and players[1]["number_in_hand"] == 3
+    assert "face_down_cards" not in players[1] and players[1]["number_face_down"] == 3
+
+
+def test_no_game():
+    assert json.loads(serializers.encode_game_state(controller.get_game_state(None))) == {"active-game": False}
+
+
+def test_encoded_state_is_smaller_than_jsonpickle():
+    views = benchmarks.sample_views(1, simulator.make_config(number_of_players_requested=3))
+    assert views
+    results = benchmarks.benchmark_encoders(views, repeats=1)
+    assert results["serializers"]["bytes_per_view"] < results["jsonpickle"]["bytes_per_view"]
+    # the same cards in the same places
+    view = views[-1]
+    encoded = json.loads(serializers.encode_game_state(view))
+    pickled = json.loads(jsonpickle.encode(view, unpicklable=False))
+    assert [cards.Card(card["suit"], card["rank"]).key for card in pickled["game"]["state"]["play_list"]] == \
+        encoded["game"]["state"]["play_list"]
+
+
+def test_msgpack_is_the_same_state():
+    msgpack = pytest.importorskip("msgpack")
+    view = controller.game_view(dealt_game())
+    as_json = json.loads(serializers.encode_game_state(view))
+    packed = serializers.encode_game_state(view, serializers.Wire_Formats.MSGPACK)
+    assert len(packed) < len(serializers.encode_game_state(view))
+
+    unpacked = msgpack.unpackb(packed, strict_map_key=False)
+    # cards are one byte each
+    hand = unpacked["players_state"][1]["hand_cards"]
+    assert hand == bytes(card.code for card in view["players_state"][1]["hand_cards"])
+    for player in unpacked["players_state"]:
+        for location in ("face_up_cards", "hand_cards"):
+            player[location] = [cards.Card.from_code(code).key for code in player[location]]
+    unpacked["game"]["state"]["play_list"] = list(unpacked["game"]["state"]["play_list"])
+    assert unpacked == as_json
+
+
+def test_negotiate_wire_format():
+    pytest.importorskip("msgpack")
+    negotiate = serializers.negotiate_wire_format
+    assert negotiate(MIMEAccept()) == serializers.Wire_Formats.JSON
+    assert negotiate(MIMEAccept([("*/*", 1)])) == serializers.Wire_Formats.JSON
+    assert negotiate(MIMEAccept([("application/x-msgpack", 1), ("application/json", 0.5)])) == \
+        serializers.Wire_Formats.MSGPACK
+    assert negotiate(MIMEAccept([("application/x-msgpack", 0.5), ("application/json", 1)])) == \
+        serializers.Wire_Formats.JSON
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+import simulator
+from game import Game
+
+
+def test_same_seed_plays_same_game():
+    config = simulator.make_config(number_of_players_requested=3)
+    policies = [simulator.Random_Policy()]
+    first = simulator.play_game(config, policies, "seed", max_turns=200)
+    second = simulator.play_game(config, policies, "seed", max_turns=200)
+    assert first == second
+
+
+def test_default_game_plays_without_violations():
+    stats = simulator.simulate(simulator.make_config(), 5, seed=1,
+                               policies=[simulator.Lowest_Card_Policy(), simulator.Random_Policy()])
+    report = stats.report()
+    assert report["games"] == 5
+    assert report["violations"] == {}
+    assert report["finished"] + report["abandoned"] == 5
+    assert report["turns_per_game"] > 0
+
+
+def test_lowest_card_policy_swaps_high_cards_face_up():
+    game = simulator.new_game(simulator.make_config(), random.Random(3))
+    player = game.players[0]
+    game.set_this_player(player.ID)
+    swap = simulator.Lowest_Card_Policy().choose_swap(game, player, random.Random(3))
+    if swap:
+        assert game.play_action("swap", swap)["action_result"]
+    assert min(card.rank for card in player.face_up) >= max(card.rank for card in player.hand)
+
+
+def test_stats_merge():
+    config = simulator.make_config()
+    merged = simulator.simulate(config, 2, seed="a", max_turns=100)
+    merged.merge(simulator.simulate(config, 3, seed="b", max_turns=100))
+    assert merged.games == 5
+
+
+def test_config_needing_too_many_cards_rejected():
+    g = Game()
+    parsed, message = g.parse_requested_config(simulator.make_config(
+        number_of_players_requested=6, number_face_down_cards=9, number_hand_cards=9))
+    assert not parsed
+    assert "Not enough cards" in message
+
+
+def accepted_configs():
+    '''a spread of the configs parse_requested_config accepts, including the largest'''
+    rng = random.Random(0)
+    configs = [simulator.make_config(number_of_players_requested=6, number_of_decks=2,
+                                     number_face_down_cards=5, number_hand_cards=7),
+               simulator.make_config(number_face_down_cards=1, number_hand_cards=1,
+                                     transparent_card=7, less_than_card=None, less_than_card_on_anything="on")]
+    while len(configs) < 12:
+        config = simulator.make_config(number_of_players_requested=rng.randint(2, 6),
+                                       number_of_decks=rng.randint(1, 2),
+                                       number_face_down_cards=rng.randint(1, 9),
+                                       number_hand_cards=rng.randint(1, 9))
+        if Game().parse_requested_config(config)[0]:
+            configs.append(config)
+    return configs
+
+
+@pytest.mark.parametrize("config", accepted_configs())
+def test_every_accepted_config_can_be_simulated(config):
+    result = simulator.play_game(config, [simulator.Random_Policy()], "config", max_turns=30)
+    assert result.turns > 0
+
+
+def test_two_deck_games_keep_every_card():
+    config = simulator.make_config(number_of_players_requested=6, number_of_decks=2,
+                                   number_face_down_cards=5, number_hand_cards=5)
+    stats = simulator.simulate(config, 3, seed=2)
+    assert stats.report()["violations"] == {}
@@ -0,0 +1,94 @@
+import json
+import random
+
+import bots
+import controller
+import serializers
+import simulator
+import view_deltas
+
+
+def play_and_view(game, moves, player_id):
+    assert bots.play_bot_turns(game, {player.ID for player in game.players}, max_moves=moves)
+    game.set_this_player(player_id)
+    # a new version, as if it had been saved
+    game.database_checksum = game.checksum()
+    return controller.game_view(game)
+
+
+def new_game(seed):
+    g = simulator.new_game(simulator.make_config(number_of_players_requested=3), random.Random(seed))
+    g.set_this_player(1)
+    g.database_checksum = g.checksum()
+    return g
+
+
+def test_patches_rebuild_the_view():
+    view_deltas.history.clear()
+    g = new_game(3)
+    sent = json.loads(serializers.encode_game_state(controller.game_view(g)))
+    assert view_deltas.delta_since(controller.game_view(g), 1, g.state.game_id, None) is None
+    extended = False
+    while not g.state.game_finished:
+        view = play_and_view(g, 1, 1)
+        delta = view_deltas.delta_since(view, 1, g.state.game_id, sent["checksum"])
+        assert delta is not None and delta["since"] == sent["checksum"]
+        extended |= any(action == "extend" for action, _, _ in delta["patches"])
+        patched = view_deltas.apply_patches(sent, json.loads(serializers.encode_game_state_delta(delta))["patches"])
+        patched["checksum"] = delta["checksum"]
+        sent = json.loads(serializers.encode_game_state(view))
+        assert patched == sent
+    # cards played on the pile are sent on their own
+    assert extended
+
+
+def test_delta_is_smaller_than_the_view():
+    view_deltas.history.clear()
+    g = new_game(4)
+    view = play_and_view(g, 20, 1)
+    view_deltas.delta_since(view, 1, g.state.game_id, None)
+    since = view["checksum"]
+    view = play_and_view(g, 1, 1)
+    delta = view_deltas.delta_since(view, 1, g.state.game_id, since)
+    for wire_format in serializers.available_wire_formats():
+        assert len(serializers.encode_game_state_delta(delta, wire_format)) < \
+            len(serializers.encode_game_state(view, wire_format))
+
+
+def test_full_view_when_too_far_behind(monkeypatch):
+    view_deltas.history.clear()
+    g = new_game(5)
+    view = controller.game_view(g)
+    view_deltas.delta_since(view, 1, g.state.game_id, None)
+    since = view["checksum"]
+    # another player's view isn't this player's
+    assert view_deltas.delta_since(play_and_view(g, 1, 2), 2, g.state.game_id, since) is None
+    monkeypatch.setattr(view_deltas, "MAX_DELTA_MOVES", 3)
+    assert view_deltas.delta_since(play_and_view(g, 1, 1), 1, g.state.game_id, since) is not None
+    assert view_deltas.delta_since(play_and_view(g, 3, 1), 1, g.state.game_id, since) is None
+    assert view_deltas.delta_since(controller.game_view(g), 1, g.state.game_id, "unknown") is None
+
+
+def test_view_history_is_bounded():
+    history = view_deltas.View_History(versions_per_viewer=2, max_viewers=2)
+    for checksum in "abc":
+        history.remember(1, 1, checksum, {checksum: 1})
+    assert history.get(1, 1, "a") is None
+    assert history.get(1, 1, "c") == {"c": 1}
+    history.remember(1, 2, "a", {})
+    history.remember(2, 1, "a", {})
+    assert history.get(1, 1, "c") is None
+    assert history.get(2, 1, "a") == {}
+
+
+def test_games_with_the_same_checksum():
+    view_deltas.history.clear()
+    first, second = new_game(6), new_game(6)
+    first.state.game_id, second.state.game_id = 1, 2
+    first_view, second_view = controller.game_view(first), controller.game_view(second)
+    assert first_view["checksum"] == second_view["checksum"]
+    view_deltas.delta_since(first_view, 1, None, None)
+    # the client has the first game, so needs all of the second
+    assert view_deltas.delta_since(second_view, 1, 1, first_view["checksum"]) is None
+    assert view_deltas.delta_since(second_view, 1, 2, first_view["checksum"]) == \
+        {"since": second_view["checksum"], "checksum": second_view["checksum"], "patches": []}
@@ -0,0 +1,142 @@
+"""Sends a player what has changed in their view of a game since the version they
+   last saw, rather than the whole view again - late in a game most of the view is
+   a tall played pile which hasn't changed, other than a card or two on top.
+
+   Each worker remembers the last few views it sent to each player (see View_History),
+   keyed by the game's checksum, which with the game's ID is how clients name the
+   version they have - different games can have the same checksum. A client asks for
+   /getgamestate?game_id=GAME_ID&since=CHECKSUM, and if that's the game it's playing,
+   the view is remembered and it's no more than MAX_DELTA_MOVES moves old it gets
+   {"since": CHECKSUM, "checksum": the new checksum, "patches": [patch, ...]}
+   where each patch is one of
+       ["set", path, value] - replace what's at path with value
+       ["extend", path, cards] - add cards to the end of the list of cards at path
+   and path is the list of keys (and indexes into players_state) which lead from the
+   top of the full view (see serializers) to the field or pile changed. Otherwise,
+   e.g. if the client's view was sent by another worker, it gets the full view.
+
+   In the views remembered, lists of cards are tuples of Cards, so that they can be
+   encoded for either wire format once the patches are worked out.
+"""
+import copy
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import serializers
+
+logger = logging.getLogger(__name__)
+
+# how many versions of each player's view of each game are kept, and for how many
+# players and games; set VIEW_HISTORY_SIZE=0 to always send the full view
+VIEW_HISTORY_SIZE = int(os.environ.get("VIEW_HISTORY_SIZE", 4))
+VIEW_HISTORY_VIEWERS = int(os.environ.get("VIEW_HISTORY_VIEWERS", 512))
+
+# clients further behind than this get the full view
+MAX_DELTA_MOVES = int(os.environ.get("MAX_DELTA_MOVES", 30))
+
+
+class View_History(object):
+    """a bounded least-recently-used cache of the views sent to each player of each game.
+
+        methods:
+        .remember(game_id, player_id, checksum, view) --> keep view as the version checksum
+        .get(game_id, player_id, checksum) --> the view, or None if it isn't kept
+        .clear() --> forget everything
+    """
+
+    def __init__(self, versions_per_viewer=VIEW_HISTORY_SIZE, max_viewers=VIEW_HISTORY_VIEWERS):
+        self.versions_per_viewer = versions_per_viewer
+        self.max_viewers = max_viewers
+        self.__lock = threading.Lock()
+        # (game_id, player_id) --> OrderedDict of checksum --> view
+        self.__viewers = OrderedDict()
+
+    def remember(self, game_id, player_id, checksum, view):
+        if not self.versions_per_viewer or not self.max_viewers:
+            return
+        with self.__lock:
+            versions = self.__viewers.setdefault((game_id, player_id), OrderedDict())
+            self.__viewers.move_to_end((game_id, player_id))
+            versions[checksum] = view
+            versions.move_to_end(checksum)
+            while len(versions) > self.versions_per_viewer:
+                versions.popitem(last=False)
+            while len(self.__viewers) > self.max_viewers:
+                self.__viewers.popitem(last=False)
+
+    def get(self, game_id, player_id, checksum):
+        with self.__lock:
+            versions = self.__viewers.get((game_id, player_id))
+            return versions.get(checksum) if versions else None
+
+    def clear(self):
+        with self.__lock:
+            self.__viewers.clear()
+
+
+history = View_History()
+
+
+def __copy_view(value):
+    """a copy of a view which shares no lists with the game (tuples of cards are never changed)"""
+    if isinstance(value, dict):
+        return {key: __copy_view(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [__copy_view(item) for item in value]
+    return value
+
+
+def diff_views(old, new, path=()):
+    """the patches which turn the view old into new"""
+    if old == new:
+        return []
+    if isinstance(old, dict) and isinstance(new, dict) and old.keys() == new.keys():
+        return [patch for key in new for patch in diff_views(old[key], new[key], path + (key,))]
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new) \
+            and all(isinstance(item, dict) for item in new):
+        # players_state, which has the players in the same order each time
+        return [patch for index in range(len(new)) for patch in diff_views(old[index], new[index], path + (index,))]
+    if isinstance(old, tuple) and isinstance(new, tuple) and old and new[:len(old)] == old:
+        # cards added to a pile
+        return [["extend", list(path), new[len(old):]]]
+    return [["set", list(path), new]]
+
+
+def apply_patches(view, patches):
+    """a copy of view with patches applied, as the browser does"""
+    view = copy.deepcopy(view)
+    for action, path, value in patches:
+        parent = view
+        for key in path[:-1]:
+            parent = parent[key]
+        if action == "extend":
+            parent[path[-1]] = parent[path[-1]] + value
+        else:
+            parent[path[-1]] = value
+    return view
+
+
+def delta_since(game_state, player_id, since_game_id, since):
+    """remembers game_state (from controller.get_game_state) as sent to player_id, and
+       returns the delta to it from the version since of game since_game_id, or None if
+       the full view should be sent instead"""
+    view = __copy_view(serializers.game_state_to_dict(game_state, tuple))
+    checksum = view.pop("checksum")
+    game_id = view["game"]["state"]["game_id"]
+    # looked up before this view is remembered, in case it has the same checksum
+    old = history.get(game_id, player_id, since) if since and since_game_id == game_id else None
+    history.remember(game_id, player_id, checksum, view)
+    if not since:
+        return None
+    if old is None:
+        logger.debug("no view of game %s at %s for player %s - sending it all", since_game_id, since, player_id)
+        return None
+    if since == checksum:
+        return {"since": since, "checksum": checksum, "patches": []}
+    moves = view["game"]["state"]["current_turn_number"] - old["game"]["state"]["current_turn_number"]
+    if not 0 <= moves <= MAX_DELTA_MOVES:
+        logger.debug("view of game %s for player %s is %s moves old - sending it all", game_id, player_id, moves)
+        return None
+    return {"since": since, "checksum": checksum, "patches": diff_views(old, view)}